@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Stand-in for FirmAE's `run.sh -c <brand> <firmware>`: no extraction, no QEMU,
+just the scratch/<iid> footprint the MCP server reads, written over time.
+
+Behaviour is driven by the environment:
+  FAKE_DURATION    seconds to run, "N" or "MIN-MAX" (default 2)
+  FAKE_LOG_LINES   serial log lines written over the run (default 2000)
+  FAKE_MODE        ok | fail | panic | hang | random (default ok)
+  FAKE_FAIL_RATIO  share of failures when FAKE_MODE=random (default 0.3)
+  FAKE_ARCH        architecture file contents (default mipsel)
+  FAKE_IMAGES      "1" to also write images/<iid>.tar.gz like FirmAE's extractor
+  FAKE_REUSE_IID   "1" (default) re-runs a firmware in the IID of its earlier run, like
+                   FirmAE (name rewritten, result/ping/web removed, logs truncated);
+                   "0" always allocates a new IID
+
+panic writes a kernel panic then hangs (the server's log watcher should kill it);
+hang never finishes (the timeout should). Prints "[fake] IID=<n>" so a driver
+can check which IID the server attributed to this run.
+"""
+import os, sys, time, random, tarfile, io
+
+SERIAL_LINES = [
+    "eth0: link up, 100Mbps, full-duplex, lpa 0x{x:04X}",
+    "br0: port 1(eth0) entering forwarding state",
+    "nvram_get: key lan_ipaddr not found",
+    "httpd[{pid}]: GET /cgi-bin/login.cgi HTTP/1.1 from 192.168.0.{ip}",
+    "random: nonblocking pool is initialized",
+    "udhcpc: sending discover",
+]
+
+def _duration(spec: str) -> float:
+    lo, _, hi = spec.partition("-")
+    return random.uniform(float(lo), float(hi)) if hi else float(lo)
+
+def _alloc_iid(scratch: str) -> tuple[int, str]:
+    """mkdir is atomic, so concurrent stand-ins never share an IID."""
+    os.makedirs(scratch, exist_ok=True)
+    while True:
+        ids = [int(d) for d in os.listdir(scratch) if d.isdigit()]
+        n = max(ids, default=0) + 1
+        d = os.path.join(scratch, str(n))
+        try:
+            os.mkdir(d)
+            return n, d
+        except FileExistsError:
+            time.sleep(random.random() * 0.01)
+
+def _find_iid(scratch: str, stem: str) -> tuple[int, str] | None:
+    """The IID an earlier run of this firmware used (FirmAE keeps it in its DB)."""
+    for entry in sorted(os.listdir(scratch)):
+        d = os.path.join(scratch, entry)
+        if not entry.isdigit():
+            continue
+        try:
+            with open(os.path.join(d, "name"), encoding="utf-8") as f:
+                if f.read().strip() == stem:
+                    return int(entry), d
+        except OSError:
+            continue
+    return None
+
+def _write(d: str, name: str, text: str, mode: str = "w") -> None:
+    with open(os.path.join(d, name), mode, encoding="utf-8") as f:
+        f.write(text)
+
+def main(argv: list[str]) -> int:
+    if len(argv) < 3:
+        print("usage: run.sh -c <brand> <firmware>", file=sys.stderr)
+        return 2
+    brand, firmware = argv[1], argv[2]
+    mode = os.environ.get("FAKE_MODE", "ok")
+    if mode == "random":
+        mode = "fail" if random.random() < float(os.environ.get("FAKE_FAIL_RATIO", "0.3")) else "ok"
+    duration = _duration(os.environ.get("FAKE_DURATION", "2"))
+    lines = int(os.environ.get("FAKE_LOG_LINES", "2000"))
+
+    scratch = os.path.join(os.getcwd(), "scratch")
+    fw_name = os.path.basename(firmware)
+    found = None
+    if os.environ.get("FAKE_REUSE_IID", "1") == "1" and os.path.isdir(scratch):
+        found = _find_iid(scratch, os.path.splitext(fw_name)[0])
+    if found:
+        iid, d = found
+        for name in ("result", "ping", "web", "qemu.final.serial.log", "emulation.log"):
+            try:
+                os.remove(os.path.join(d, name))
+            except OSError:
+                pass
+    else:
+        iid, d = _alloc_iid(scratch)
+    _write(d, "name", os.path.splitext(fw_name)[0] + "\n")
+    _write(d, "brand", brand + "\n")
+    _write(d, "architecture", os.environ.get("FAKE_ARCH", "mipsel") + "\n")
+    print(f"[fake] IID={iid} firmware={fw_name} mode={mode}", flush=True)
+    print(f"[*] {fw_name} emulation start!!!", flush=True)
+    _write(d, "makeImage.log", "creating image\n" * 20 + ("mke2fs: Device size reported to be zero\n" if mode == "fail" else ""))
+    _write(d, "makeNetwork.log", "probing network\n" * 20)
+
+    # Stream the serial log in steps so log followers see it grow
+    steps = max(1, int(duration / 0.1))
+    per_step = max(1, lines // steps)
+    ts, written = 0.0, 0
+    for _ in range(steps):
+        chunk = []
+        for _ in range(min(per_step, lines - written)):
+            ts += random.random() * 0.05
+            msg = random.choice(SERIAL_LINES).format(x=random.randrange(1 << 16), pid=random.randrange(100, 4000),
+                                                     ip=random.randrange(2, 254))
+            chunk.append(f"[{ts:12.6f}] {msg}\n")
+        written += len(chunk)
+        if chunk:
+            _write(d, "qemu.final.serial.log", "".join(chunk), "a")
+        time.sleep(duration / steps)
+
+    if mode == "panic":
+        _write(d, "qemu.final.serial.log", "Kernel panic - not syncing: VFS: Unable to mount root fs\n", "a")
+        time.sleep(3600)
+    if mode == "hang":
+        time.sleep(3600)
+
+    ok = mode == "ok"
+    for name in ("ping", "web", "result"):
+        _write(d, name, ("true" if ok else "false") + "\n")
+    _write(d, "emulation.log", "emulation start\n" + ("" if ok else "emulation failed\n"))
+
+    if os.environ.get("FAKE_IMAGES") == "1":
+        images = os.path.join(os.getcwd(), "images")
+        os.makedirs(images, exist_ok=True)
+        with tarfile.open(os.path.join(images, f"{iid}.tar.gz"), "w:gz") as tf:
+            data = b"#!/bin/sh\n"
+            info = tarfile.TarInfo("bin/sh")
+            info.size, info.mode = len(data), 0o755
+            tf.addfile(info, io.BytesIO(data))
+
+    print(f"[fake] done IID={iid} result={str(ok).lower()}", flush=True)
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,3 @@
+#!/bin/bash
+# Stand-in for FirmAE's run.sh (see fake_run.py). Copy or symlink into a fake FIRMAE_HOME.
+exec python3 "$(dirname "$(readlink -f "$0")")/fake_run.py" "$@"
@@ -0,0 +1,125 @@
+import os, random, sqlite3
+from datetime import datetime, timedelta
+
+# ---- synthetic, offline fixtures for the benchmark suite ----
+# Everything is generated from a seeded RNG so two runs (or two commits)
+# benchmark identical inputs.
+
+BRANDS = ["DLINK", "TPLINK", "NETGEAR", "ASUS", "LINKSYS", "TRENDNET", "BELKIN", "ZYXEL"]
+ARCHES = ["mipseb", "mipsel", "armel"]
+
+SERIAL_LINES = [
+    "[{ts:12.6f}] eth0: link up, 100Mbps, full-duplex, lpa 0x{x:04X}",
+    "[{ts:12.6f}] br0: port 1(eth0) entering forwarding state",
+    "[{ts:12.6f}] nvram_get: key lan_ipaddr not found",
+    "[{ts:12.6f}] httpd[{pid}]: GET /cgi-bin/login.cgi HTTP/1.1 from 192.168.0.{ip}",
+    "[{ts:12.6f}] mtd: partition \"rootfs\" extends beyond the end of device",
+    "[{ts:12.6f}] random: nonblocking pool is initialized",
+    "[{ts:12.6f}] udhcpc: sending discover",
+]
+FAILURE_TAILS = [
+    "Kernel panic - not syncing: VFS: Unable to mount root fs on unknown-block(0,0)",
+    "mount: mounting /dev/sda1 on /firmadyne failed: No such device",
+    "Segmentation fault",
+    "qemu-system-mipsel: Could not open '/dev/kvm'",
+]
+
+def _serial_log(rng: random.Random, n_lines: int, fail: bool) -> str:
+    out, ts = [], 0.0
+    for _ in range(n_lines):
+        ts += rng.random() * 0.05
+        out.append(rng.choice(SERIAL_LINES).format(ts=ts, x=rng.randrange(1 << 16),
+                                                   pid=rng.randrange(100, 4000), ip=rng.randrange(2, 254)))
+    if fail:
+        out.append(rng.choice(FAILURE_TAILS))
+    return "\n".join(out) + "\n"
+
+def make_scratch(root: str, n_iids: int, log_lines: int, seed: int = 1) -> str:
+    """
+    FirmAE-style scratch/<iid> dirs with large serial logs and result files.
+    Every third IID failed.
+    """
+    rng = random.Random(seed)
+    scratch = os.path.join(root, "scratch")
+    for iid in range(1, n_iids + 1):
+        d = os.path.join(scratch, str(iid))
+        os.makedirs(d, exist_ok=True)
+        fail = iid % 3 == 0
+        files = {
+            "name": f"FW_{iid}.bin", "brand": rng.choice(BRANDS), "architecture": rng.choice(ARCHES),
+            "ping": "false" if fail else "true", "web": "false" if fail else "true",
+            "result": "false" if fail else "true",
+            "makeImage.log": "creating image\n" * 50 + ("mke2fs: Device size reported to be zero\n" if fail else ""),
+            "makeNetwork.log": "probing network\n" * 100,
+            "qemu.final.serial.log": _serial_log(rng, log_lines, fail),
+            "emulation.log": "emulation start\n" * 20,
+        }
+        for name, text in files.items():
+            with open(os.path.join(d, name), "w", encoding="utf-8") as f:
+                f.write(text + ("" if text.endswith("\n") else "\n"))
+    return scratch
+
+def make_extract_tree(root: str, depth: int, files_per_dir: int, seed: int = 2) -> str:
+    """
+    binwalk-style nested *.extracted tree with decoy 'rootfs' dirs and one real
+    squashfs-root (etc/, bin/, lib/ ...) at the bottom.
+    """
+    rng = random.Random(seed)
+    top = os.path.join(root, "fw.bin.extracted")
+    cur = top
+    for level in range(depth):
+        os.makedirs(cur, exist_ok=True)
+        for i in range(files_per_dir):
+            with open(os.path.join(cur, f"{rng.randrange(1 << 24):X}.lzma"), "wb") as f:
+                f.write(os.urandom(rng.randrange(256, 4096)))
+        decoy = os.path.join(cur, "rootfs" if level % 2 else "cramfs-root")
+        os.makedirs(os.path.join(decoy, "tmp"), exist_ok=True)
+        cur = os.path.join(cur, f"_{rng.randrange(1 << 16):X}.extracted")
+    real = os.path.join(cur, "squashfs-root")
+    for sub in ("bin", "sbin", "etc", "lib", "usr/bin", "usr/lib", "www"):
+        d = os.path.join(real, sub)
+        os.makedirs(d, exist_ok=True)
+        for i in range(files_per_dir):
+            with open(os.path.join(d, f"f{i}"), "wb") as f:
+                # mostly compressible, like real rootfs content
+                f.write((b"\x7fELF" + bytes(60) + os.urandom(64)) * rng.randrange(4, 64))
+    return top
+
+def make_kb(db_path: str, n_runs: int, seed: int = 4) -> str:
+    """
+    A KB with n_runs runs and one analysis each, inserted in bulk.
+    """
+    from firmae_lib.sqlite_helper import kb_init
+    rng = random.Random(seed)
+    kb_init(db_path)
+    con = sqlite3.connect(db_path)
+    t0 = datetime(2025, 1, 1)
+    runs, analyses = [], []
+    for i in range(1, n_runs + 1):
+        ok = rng.random() < 0.4
+        ts = (t0 + timedelta(minutes=i)).isoformat(timespec="seconds") + "Z"
+        runs.append((i, ts, rng.choice(BRANDS), None, f"FW_{rng.randrange(n_runs // 4 + 1)}.bin",
+                     f"scratch/{i}", 0 if ok else 1, int(ok), rng.random() * 1800, rng.choice(ARCHES)))
+        tail = _serial_log(rng, 20, not ok)
+        analyses.append((i, ts, "summary" if ok else "heuristic", "synthetic", tail, None))
+    con.executemany("""INSERT INTO runs (id, ts, brand, model, firmware, iid_dir, exit_code, result_bool,
+                       duration_sec, architecture) VALUES (?,?,?,?,?,?,?,?,?,?)""", runs)
+    con.executemany("""INSERT INTO analyses (run_id, at_ts, source, summary, content, reasons_json)
+                       VALUES (?,?,?,?,?,?)""", analyses)
+    con.commit()
+    con.close()
+    return db_path
+
+def make_devices(emux_home: str, n_rows: int, seed: int = 5) -> str:
+    from emux_lib.devices import DEVICES_HEADER
+    rng = random.Random(seed)
+    path = os.path.join(emux_home, "files", "emux", "firmware", "devices")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    presets = [("qemu-system-mips", "malta", "MALTA2"), ("qemu-system-arm", "vexpress-a9", "VEXPRESS1"),
+               ("qemu-system-arm", "versatilepb", "VERSATILEPB")]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(",".join(DEVICES_HEADER) + "\n")
+        for i in range(n_rows):
+            qb, mt, qo = rng.choice(presets)
+            f.write(f"firmware/DEV{i:05d},{qb},{mt},,,256M,kernel-{i % 7},{qo},Device {i}\n")
+    return path
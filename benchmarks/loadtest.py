@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Load-test the MCP server over its stdin/stdout JSON-RPC protocol with the
+stand-in FirmAE from benchmarks/fake_firmae (no QEMU, no real firmware).
+
+    python benchmarks/loadtest.py --requests 200 --concurrency 50
+    FAKE_MODE=random FAKE_DURATION=1-4 python benchmarks/loadtest.py --mix emulate=8,rerun=2,history=1,scratch=1
+    python benchmarks/loadtest.py --workers 3 --worker-capacity 8   # coordinator + 3 local workers
+
+Each run gets a throwaway FIRMAE_HOME / EMUX_HOME / KB. Reports throughput,
+latency percentiles per tool, server RSS and whether every emulation was
+attributed to the IID its stand-in actually used. `rerun` emulates a firmware
+an earlier request emulated (once that finished); the stand-in then reuses its
+IID like FirmAE does. JSON goes to stdout or --out.
+"""
+import os, re, sys, json, time, shutil, sqlite3, argparse, tempfile, threading, subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_RUN = os.path.join(ROOT, "benchmarks", "fake_firmae", "run.sh")
+
+TOOLS = {
+    "emulate": "firmae.emulate",
+    "rerun": "firmae.emulate",
+    "history": "firmae.history",
+    "scratch": "firmae.scratch",
+    "kbsearch": "firmae.kbsearch",
+    "clusters": "firmae.clusters",
+}
+IID_RE = re.compile(r"\[fake\] IID=(\d+) firmware=(\S+)")
+WORKER_RE = re.compile(r"\[coordinator\] ran on worker ([^\s;]+)")
+
+def _percentile(samples: list[float], p: float) -> float | None:
+    if not samples:
+        return None
+    s = sorted(samples)
+    k = (len(s) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+def _rss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def _parse_mix(spec: str) -> list[str]:
+    """'emulate=8,history=1' -> a weighted round-robin schedule of tool keys."""
+    schedule = []
+    for part in spec.split(","):
+        key, _, weight = part.partition("=")
+        if key not in TOOLS:
+            raise SystemExit(f"unknown tool '{key}' in --mix; choose from {', '.join(TOOLS)}")
+        schedule += [key] * int(weight or 1)
+    return schedule
+
+def _arguments(key: str, seq: int, brand: str, timeout: int, fw_dir: str) -> dict:
+    if key in ("emulate", "rerun"):
+        return {"brand": brand, "firmware_file": os.path.join(fw_dir, f"fw_{seq:06d}.bin"), "timeout": timeout}
+    if key == "history":
+        return {"brand": brand, "last_n": 20}
+    if key == "scratch":
+        return {"limit": 20}
+    if key == "kbsearch":
+        return {"query": "kernel panic", "limit": 5}
+    return {"limit": 5}
+
+class Server:
+    """The MCP server as a child process, with a reader thread matching replies to ids."""
+
+    def __init__(self, env: dict):
+        self.proc = subprocess.Popen(
+            [sys.executable, "-u", os.path.join(ROOT, "firmae_mcp.py")],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True, bufsize=1, env=env,
+        )
+        self.pending: dict[int, tuple[float, str, threading.Event]] = {}
+        self.results: dict[int, dict] = {}
+        self.lock = threading.Lock()
+        self.stray = 0
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self) -> None:
+        for line in self.proc.stdout:
+            now = time.perf_counter()
+            try:
+                msg = json.loads(line)
+            except ValueError:
+                self.stray += 1
+                continue
+            with self.lock:
+                entry = self.pending.pop(msg.get("id"), None)
+            if not entry:
+                self.stray += 1
+                continue
+            sent, key, ev = entry
+            self.results[msg["id"]] = {"key": key, "latency": now - sent, "msg": msg}
+            ev.set()
+
+    def send(self, mid: int, method: str, params: dict, key: str) -> threading.Event:
+        ev = threading.Event()
+        with self.lock:
+            self.pending[mid] = (time.perf_counter(), key, ev)
+        self.proc.stdin.write(json.dumps({"jsonrpc": "2.0", "id": mid, "method": method, "params": params}) + "\n")
+        self.proc.stdin.flush()
+        return ev
+
+    def close(self) -> None:
+        try:
+            self.proc.stdin.close()
+            self.proc.wait(timeout=10)
+        except Exception:
+            self.proc.kill()
+
+def _fake_home(path: str) -> str:
+    os.makedirs(os.path.join(path, "scratch"))
+    os.symlink(FAKE_RUN, os.path.join(path, "run.sh"))
+    return path
+
+def check_attribution(results: dict, firmae_home: str, kb_path: str, worker_homes: dict | None = None) -> dict:
+    """
+    Three views must agree for every emulation: the IID the stand-in printed,
+    scratch/<iid>/name, and the iid_dir the server stored in the KB for the
+    run id in the response. Without workers, each run must also have its own
+    archived logs (re-runs write into the same IID). With workers, scratch/ is
+    the one of the worker named in the response.
+    """
+    report = {"checked": 0, "ok": 0, "reruns": 0, "mismatches": [], "per_worker": {}}
+    kb_iid, run_iid, archived = {}, {}, {}
+    if os.path.exists(kb_path):
+        con = sqlite3.connect(kb_path)
+        for run_id, firmware, iid_dir in con.execute("SELECT id, firmware, iid_dir FROM runs"):
+            kb_iid[firmware] = run_iid[run_id] = os.path.basename(iid_dir or "")
+        try:
+            archived = dict(con.execute("SELECT run_id, COUNT(*) FROM log_archives GROUP BY run_id"))
+        except sqlite3.Error:
+            pass
+        con.close()
+    for mid, r in results.items():
+        if r["key"] not in ("emulate", "rerun"):
+            continue
+        report["reruns"] += r["key"] == "rerun"
+        run_id = (r["msg"].get("result", {}).get("_meta") or {}).get("run_id")
+        text = "\n".join(c.get("text", "") for c in r["msg"].get("result", {}).get("content", []))
+        m = IID_RE.search(text)
+        report["checked"] += 1
+        if not m:
+            report["mismatches"].append({"id": mid, "problem": "no IID in response"})
+            continue
+        iid, fw = m.group(1), m.group(2)
+        home = firmae_home
+        if worker_homes:
+            w = WORKER_RE.search(text)
+            if not w or w.group(1) not in worker_homes:
+                report["mismatches"].append({"id": mid, "firmware": fw, "problem": "not run on a known worker"})
+                continue
+            home = worker_homes[w.group(1)]
+            report["per_worker"][w.group(1)] = report["per_worker"].get(w.group(1), 0) + 1
+        try:
+            with open(os.path.join(home, "scratch", iid, "name")) as f:
+                recorded = f.read().strip()
+        except OSError:
+            recorded = None
+        problems = []
+        if recorded != os.path.splitext(fw)[0]:
+            problems.append(f"scratch/{iid}/name={recorded!r}")
+        stored = run_iid.get(run_id) if run_id is not None else kb_iid.get(fw)
+        if stored != iid:
+            problems.append(f"KB iid_dir={stored!r}")
+        if run_id is not None and not worker_homes and not archived.get(run_id):
+            problems.append(f"no archived logs for run #{run_id}")
+        if problems:
+            report["mismatches"].append({"id": mid, "firmware": fw, "iid": iid, "problem": ", ".join(problems)})
+        else:
+            report["ok"] += 1
+    return report
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=50, help="max requests in flight")
+    ap.add_argument("--mix", default="emulate=1", help="weighted tools, e.g. emulate=8,history=1,scratch=1")
+    ap.add_argument("--brand", default="DLINK")
+    ap.add_argument("--timeout", type=int, default=300, help="emulate timeout argument (seconds)")
+    ap.add_argument("--deadline", type=float, default=900, help="give up waiting after this many seconds")
+    ap.add_argument("--out", help="write JSON here (default: stdout)")
+    ap.add_argument("--keep", action="store_true", help="keep the temp FIRMAE_HOME/KB")
+    ap.add_argument("--workers", type=int, default=0, help="run as coordinator with this many local worker processes")
+    ap.add_argument("--worker-capacity", type=int, default=8, help="concurrent jobs per worker")
+    args = ap.parse_args(argv)
+
+    work = tempfile.mkdtemp(prefix="affirm-load-")
+    firmae_home = _fake_home(os.path.join(work, "firmae"))
+    fw_dir = os.path.join(work, "fw")
+    os.makedirs(fw_dir)
+    for i in range(args.requests):
+        with open(os.path.join(fw_dir, f"fw_{i:06d}.bin"), "wb") as f:
+            f.write(os.urandom(64))
+    kb_path = os.path.join(work, "kb.sqlite")
+    env = dict(os.environ, FIRMAE_HOME=firmae_home, EMUX_HOME=os.path.join(work, "emux"), FIRMAE_KB_DB=kb_path)
+
+    worker_homes, workers = {}, []
+    if args.workers:
+        addr = "unix:" + os.path.join(work, "coordinator.sock")
+        env["FIRMAE_COORDINATOR_LISTEN"] = addr
+    schedule = _parse_mix(args.mix)
+    server = Server(env)
+    for k in range(args.workers):
+        name = f"w{k}"
+        worker_homes[name] = _fake_home(os.path.join(work, name))
+        wenv = dict(env, FIRMAE_HOME=worker_homes[name], FIRMAE_KB_DB=os.path.join(work, f"kb-{name}.sqlite"))
+        wenv.pop("FIRMAE_COORDINATOR_LISTEN")
+        workers.append(subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "firmae_mcp.py"), "--worker", addr,
+             "--capacity", str(args.worker_capacity), "--name", name],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=wenv,
+        ))
+    rss, stop_sampling = [], threading.Event()
+
+    def _sample():
+        while not stop_sampling.is_set():
+            rss.append(_rss_kb(server.proc.pid))
+            stop_sampling.wait(0.2)
+
+    sampler = threading.Thread(target=_sample, daemon=True)
+    sampler.start()
+    try:
+        server.send(0, "initialize", {"protocolVersion": "2025-03-26"}, "initialize").wait(30)
+        # Wait (up to 30s) until every worker has registered with the coordinator
+        probe = -1
+        while workers and probe > -300:
+            server.send(probe, "tools/call", {"name": "firmae.workers", "arguments": {}}, "probe").wait(10)
+            text = server.results.pop(probe, {}).get("msg", {}).get("result", {}).get("content", [{}])[0].get("text", "")
+            if text.count("\n- ") >= len(workers):
+                break
+            probe -= 1
+            time.sleep(0.1)
+        slots = threading.Semaphore(args.concurrency)
+        events = []
+        emulated, reran = [], 0   # (firmware seq, event) of emulate requests; how many were re-run
+        t0 = time.perf_counter()
+        for i in range(args.requests):
+            slots.acquire()
+            key, seq = schedule[i % len(schedule)], i
+            if key == "rerun":
+                if reran < len(emulated):
+                    seq, earlier = emulated[reran]
+                    reran += 1
+                    earlier.wait(args.deadline)   # FirmAE runs one firmware at a time
+                else:
+                    key = "emulate"   # nothing emulated yet to run again
+            ev = server.send(i + 1, "tools/call",
+                             {"name": TOOLS[key], "arguments": _arguments(key, seq, args.brand, args.timeout, fw_dir)}, key)
+            threading.Thread(target=lambda e=ev: (e.wait(args.deadline), slots.release()), daemon=True).start()
+            events.append(ev)
+            if key == "emulate":
+                emulated.append((seq, ev))
+        end = t0 + args.deadline
+        for ev in events:
+            ev.wait(max(0.0, end - time.perf_counter()))
+        elapsed = time.perf_counter() - t0
+    finally:
+        stop_sampling.set()
+        sampler.join()
+        server.close()
+        for w in workers:
+            w.terminate()
+            w.wait()
+
+    results = {mid: r for mid, r in server.results.items() if mid > 0}
+    per_tool, tool_errors = {}, {}
+    for r in results.values():
+        per_tool.setdefault(r["key"], []).append(r["latency"])
+        if "error" in r["msg"] or r["msg"].get("result", {}).get("isError"):
+            tool_errors[r["key"]] = tool_errors.get(r["key"], 0) + 1
+    report = {
+        "config": {"requests": args.requests, "concurrency": args.concurrency, "mix": args.mix,
+                   "workers": args.workers, "worker_capacity": args.worker_capacity if args.workers else None,
+                   "fake": {k: v for k, v in os.environ.items() if k.startswith("FAKE_")}},
+        "completed": len(results),
+        "missing": args.requests - len(results),
+        "tool_errors": tool_errors,
+        "stray_lines": server.stray,
+        "elapsed_sec": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 3) if elapsed else None,
+        "latency_sec": {
+            key: {"n": len(s), "p50": _percentile(s, 50), "p90": _percentile(s, 90),
+                  "p99": _percentile(s, 99), "max": max(s)}
+            for key, s in per_tool.items()
+        },
+        "rss_mb": {"peak": round(max(rss, default=0) / 1024, 1), "last": round((rss[-1] if rss else 0) / 1024, 1)},
+        "attribution": check_attribution(results, firmae_home, kb_path, worker_homes),
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.keep:
+        print(f"workdir kept in {work}", file=sys.stderr)
+    else:
+        shutil.rmtree(work, ignore_errors=True)
+    return 0 if report["missing"] == 0 and not report["attribution"]["mismatches"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
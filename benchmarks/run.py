@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Time afFIRM's hot paths on synthetic fixtures and emit JSON.
+
+    python benchmarks/run.py                       # default scale, JSON to stdout
+    python benchmarks/run.py --scale small --out before.json
+    python benchmarks/run.py --out after.json --compare before.json
+    python benchmarks/run.py --only analyze_logs,kb_insert
+
+Fixtures are built offline in a temp dir (nothing touches the real
+FIRMAE_HOME, EMUX_HOME or KB). Each benchmark runs once to warm up, then
+`--repeat` times; min/median/mean/max are reported in seconds.
+"""
+import os, sys, json, time, shutil, random, argparse, platform, tempfile, statistics, subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import fixtures
+
+SCALES = {
+    #           iids  log_lines  depth files  kb_runs  devices  inserts
+    "small":   (20,   2_000,     4,    20,    2_000,   1_000,   50),
+    "default": (100,  20_000,    6,    60,    20_000,  5_000,   200),
+    "large":   (300,  100_000,   8,    150,   100_000, 20_000,  500),
+}
+
+def _timeit(fn, repeat: int, setup=None) -> dict:
+    if setup:
+        setup()
+    fn()  # warm-up: imports, page cache, sqlite schema
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return {
+        "repeat": repeat,
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "max": max(samples),
+        "unit": "s",
+    }
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "-C", ROOT, "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, check=True).stdout.strip() or None
+    except Exception:
+        return None
+
+def build_benchmarks(work: str, scale: str) -> dict:
+    """
+    Create fixtures under `work` and return {name: (callable, setup|None, params)}.
+    """
+    n_iids, log_lines, depth, files, kb_runs, n_devices, n_inserts = SCALES[scale]
+    firmae_home = os.path.join(work, "firmae")
+    emux_home = os.path.join(work, "emux")
+    os.makedirs(firmae_home)
+    kb_path = os.path.join(work, "kb.sqlite")
+
+    # firmae_mcp reads these at import time
+    os.environ["FIRMAE_HOME"] = firmae_home
+    os.environ["EMUX_HOME"] = emux_home
+    os.environ["FIRMAE_KB_DB"] = kb_path
+
+    scratch = fixtures.make_scratch(firmae_home, n_iids, log_lines)
+    extract_root = os.path.join(work, "extract")
+    fixtures.make_extract_tree(extract_root, depth, files)
+    fixtures.make_kb(kb_path, kb_runs)
+    devices_path = fixtures.make_devices(emux_home, n_devices)
+    devices_pristine = devices_path + ".pristine"
+    shutil.copy2(devices_path, devices_pristine)
+
+    import firmae_mcp
+    from firmae_lib.analysis import _analyze_logs, _safe_tail, LOG_NAMES
+    from firmae_lib.sqlite_helper import kb_insert_run, kb_insert_analysis
+    from firmae_lib.similar import kb_backfill_similar, failure_terms, kb_similar_failures
+    from firmae_lib.models import kb_backfill_models
+    from emux_lib.tar_helper import _find_rootfs_dir, _make_rootfs_tar_bz2
+
+    failed_dir = os.path.join(scratch, "3")
+    serial = os.path.join(failed_dir, "qemu.final.serial.log")
+    texts = {n: _safe_tail(os.path.join(failed_dir, n)) for n in LOG_NAMES}
+    big_texts = {n: open(os.path.join(failed_dir, n), encoding="utf-8").read() for n in LOG_NAMES}
+    rootfs = _find_rootfs_dir(extract_root)
+    tar_out = os.path.join(work, "rootfs.tar.bz2")
+    rng = random.Random(7)
+
+    # history filters on brand_norm/model_norm; fill them now rather than racing the server's backfill
+    while kb_backfill_models(kb_path, limit=5000):
+        pass
+
+    def _history():
+        res = firmae_mcp.handle_call({"name": "firmae.history", "arguments": {"brand": "dlink", "last_n": 50}})
+        assert not res.get("isError"), res
+
+    def _reset_devices():
+        shutil.copy2(devices_pristine, devices_path)
+        for fn in os.listdir(os.path.dirname(devices_path)):
+            if ".bak." in fn:
+                os.remove(os.path.join(os.path.dirname(devices_path), fn))
+
+    def _applyconfig_one():
+        i = rng.randrange(n_devices)
+        res = firmae_mcp.handle_call({"name": "emux.applyconfig", "arguments": {
+            "row": f"firmware/DEV{i:05d},qemu-system-arm,vexpress-a9,,,512M,zImage-x,VEXPRESS1,Updated {i}"}})
+        assert not res.get("isError"), res
+
+    def _applyconfig_batch():
+        rows = [f"firmware/NEW{i:05d},qemu-system-mips,malta,,,256M,vmlinux,MALTA2,New {i}" for i in range(100)]
+        res = firmae_mcp.handle_call({"name": "emux.applyconfig", "arguments": {"rows": rows}})
+        assert not res.get("isError"), res
+
+    while kb_backfill_similar(kb_path, limit=5000):
+        pass
+    query_terms = failure_terms(texts, ["Kernel panic"])
+
+    def _kb_similar():
+        kb_similar_failures(kb_path, query_terms, k=3)
+
+    def _kb_insert():
+        for i in range(n_inserts):
+            run_id = kb_insert_run(kb_path, brand="DLINK", model=None, firmware=f"BENCH_{i}.bin",
+                                   iid_dir=f"scratch/{i}", exit_code=1, result_bool=False, duration_sec=12.5,
+                                   architecture="mipsel")
+            kb_insert_analysis(kb_path, run_id=run_id, source="heuristic", summary="bench",
+                               content=texts["qemu.final.serial.log"][-2000:], reasons_json={"reasons": []})
+
+    return {
+        "analyze_logs": (lambda: _analyze_logs(texts), None, {"chars": sum(map(len, texts.values()))}),
+        "analyze_logs_full": (lambda: _analyze_logs(big_texts), None, {"chars": sum(map(len, big_texts.values()))}),
+        "safe_tail": (lambda: _safe_tail(serial), None, {"file_bytes": os.path.getsize(serial)}),
+        "safe_tail_all_iids": (
+            lambda: [_safe_tail(os.path.join(scratch, str(i), "qemu.final.serial.log")) for i in range(1, n_iids + 1)],
+            None, {"iids": n_iids}),
+        "find_rootfs_dir": (lambda: _find_rootfs_dir(extract_root), None, {"depth": depth, "files_per_dir": files}),
+        "make_rootfs_tar_bz2": (lambda: _make_rootfs_tar_bz2(rootfs, tar_out), None, {"files": files * 7}),
+        "firmae_history": (_history, None, {"kb_runs": kb_runs}),
+        "emux_applyconfig_one": (_applyconfig_one, _reset_devices, {"devices_rows": n_devices}),
+        "emux_applyconfig_batch100": (_applyconfig_batch, _reset_devices, {"devices_rows": n_devices}),
+        "kb_similar": (_kb_similar, None, {"kb_runs": kb_runs}),
+        "kb_insert": (_kb_insert, None, {"inserts": n_inserts, "kb_runs": kb_runs}),
+    }
+
+def compare(old: dict, new: dict) -> str:
+    lines = [f"{'benchmark':<28}{'before':>12}{'after':>12}{'change':>10}"]
+    for name, res in new["results"].items():
+        prev = old.get("results", {}).get(name)
+        if not prev:
+            lines.append(f"{name:<28}{'-':>12}{res['median']:>12.4f}{'new':>10}")
+            continue
+        ratio = res["median"] / prev["median"] if prev["median"] else float("inf")
+        lines.append(f"{name:<28}{prev['median']:>12.4f}{res['median']:>12.4f}{(ratio - 1) * 100:>+9.1f}%")
+    return "\n".join(lines)
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--scale", choices=sorted(SCALES), default="default")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--only", help="comma-separated benchmark names")
+    ap.add_argument("--out", help="write JSON here (default: stdout)")
+    ap.add_argument("--compare", help="previous JSON result; prints a median comparison to stderr")
+    ap.add_argument("--keep", action="store_true", help="keep the fixture directory")
+    args = ap.parse_args(argv)
+
+    work = tempfile.mkdtemp(prefix="affirm-bench-")
+    try:
+        t0 = time.perf_counter()
+        benches = build_benchmarks(work, args.scale)
+        fixture_sec = time.perf_counter() - t0
+        wanted = set(args.only.split(",")) if args.only else set(benches)
+        unknown = wanted - set(benches)
+        if unknown:
+            ap.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}; available: {', '.join(benches)}")
+
+        results = {}
+        for name, (fn, setup, params) in benches.items():
+            if name not in wanted:
+                continue
+            results[name] = dict(_timeit(fn, args.repeat, setup), params=params)
+            print(f"{name:<28} median {results[name]['median']:.4f}s", file=sys.stderr)
+
+        report = {
+            "meta": {
+                "commit": _git_commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "scale": args.scale,
+                "fixture_build_sec": round(fixture_sec, 3),
+            },
+            "results": results,
+        }
+        text = json.dumps(report, indent=2)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+        else:
+            print(text)
+        if args.compare:
+            with open(args.compare, encoding="utf-8") as f:
+                print(compare(json.load(f), report), file=sys.stderr)
+        return 0
+    finally:
+        if args.keep:
+            print(f"fixtures kept in {work}", file=sys.stderr)
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import os, re, csv, glob, time, shutil, tempfile
+
+# Columns of EMUX files/emux/firmware/devices(-extra)
+DEVICES_HEADER = ["ID","qemu-binary","machine-type","cpu-type","dtb","memory","kernel-image","qemuopts","description"]
+
+def _build_row_from_fields(fields: dict) -> str:
+    missing = [c for c in DEVICES_HEADER if c not in fields]
+    if missing:
+        raise ValueError(f"Missing fields for CSV build: {', '.join(missing)}")
+    return ",".join(fields.get(c, "") or "" for c in DEVICES_HEADER)
+
+def _parse_row(row_str: str) -> tuple[str, list[str]]:
+    """
+    Validate one devices CSV row; returns (ID, columns).
+    """
+    try:
+        cols = [c.strip() for c in next(csv.reader([row_str]))]
+    except Exception as e:
+        raise ValueError(f"Invalid CSV row format: {e}")
+    if len(cols) != len(DEVICES_HEADER):
+        raise ValueError(f"CSV row must have {len(DEVICES_HEADER)} columns, got {len(cols)}")
+    if not cols[0]:
+        raise ValueError("First column (ID) cannot be empty.")
+    return cols[0], cols
+
+class DevicesFile:
+    """
+    A devices file loaded once, with an ID -> line index, so any number of
+    upserts cost one read and one atomic write.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.body: list[str] = []
+        self.index: dict[str, int] = {}
+        self.existed = os.path.exists(path)
+        if self.existed:
+            with open(path, "r", encoding="utf-8") as f:
+                lines = [ln.rstrip("\n") for ln in f]
+            header = ",".join(DEVICES_HEADER)
+            if lines and re.sub(r"\s+", "", lines[0]) == re.sub(r"\s+", "", header):
+                lines = lines[1:]
+            # If file existed but no valid header, we keep its lines and prepend ours on save
+            self.body = lines
+        data_rows = [(i, ln) for i, ln in enumerate(self.body) if ln.strip() and not ln.strip().startswith("#")]
+        for (i, _), cols in zip(data_rows, csv.reader(ln for _, ln in data_rows)):
+            if cols:
+                # first occurrence wins, matching the old line-by-line scan
+                self.index.setdefault(cols[0].strip(), i)
+
+    def upsert(self, row_str: str, allow_update: bool = True) -> tuple[str, str]:
+        """
+        Add or replace one row; returns (ID, "updated" | "appended").
+        """
+        row_id, _ = _parse_row(row_str)
+        if allow_update and row_id in self.index:
+            self.body[self.index[row_id]] = row_str
+            return row_id, "updated"
+        self.body.append(row_str)
+        self.index.setdefault(row_id, len(self.body) - 1)
+        return row_id, "appended"
+
+    def lines(self) -> list[str]:
+        return [",".join(DEVICES_HEADER)] + self.body
+
+    def backup(self, retention: int | None = None) -> str | None:
+        """
+        Copy the current file to <path>.bak.<timestamp>, then keep only the newest `retention` backups.
+        """
+        if not os.path.exists(self.path):
+            return None
+        backup_path = self.path + f".bak.{time.strftime('%Y%m%d-%H%M%S')}"
+        shutil.copy2(self.path, backup_path)
+        if retention is not None and retention >= 0:
+            baks = sorted(glob.glob(glob.escape(self.path) + ".bak.*"), key=os.path.getmtime, reverse=True)
+            for old in baks[max(retention, 1):]:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+        return backup_path
+
+    def save(self) -> None:
+        """
+        Write via a temp file in the same directory + rename, so readers never see a partial file.
+        """
+        d = os.path.dirname(self.path) or "."
+        fd, tmp = tempfile.mkstemp(prefix=".devices.", dir=d)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write("\n".join(self.lines()) + "\n")
+            if self.existed:
+                shutil.copymode(self.path, tmp)
+            os.replace(tmp, self.path)
+        except Exception:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
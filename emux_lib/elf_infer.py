@@ -0,0 +1,420 @@
+import os, json, struct, hashlib, threading
+from collections import Counter
+
+# ---- ELF-driven kernel/machine inference ----
+# The rootfs binaries tell us the CPU (e_machine), byte order (EI_DATA) and ABI
+# (e_flags / .ARM.attributes); template kernels tell us the same through their
+# own headers (ELF vmlinux, uImage, ARM zImage, arm64 Image). PRESETS maps a
+# rootfs profile onto the EMUX qemuopts preset and the kernel it can boot.
+
+EM_386, EM_MIPS, EM_ARM, EM_X86_64, EM_AARCH64 = 3, 8, 40, 62, 183
+MACHINES = {EM_386: "x86", EM_MIPS: "mips", EM_ARM: "arm", EM_X86_64: "x86_64", EM_AARCH64: "aarch64"}
+
+# EF_MIPS_ARCH (top nibble of e_flags)
+MIPS_ISA = {
+    0x0: "mips1", 0x1: "mips2", 0x2: "mips3", 0x3: "mips4", 0x4: "mips5",
+    0x5: "mips32", 0x6: "mips64", 0x7: "mips32r2", 0x8: "mips64r2",
+    0x9: "mips32r6", 0xa: "mips64r6",
+}
+
+# Tag_CPU_arch values from the ARM EABI attributes section
+ARM_CPU_ARCH = {
+    1: 4, 2: 4, 3: 5, 4: 5, 5: 5, 6: 6, 7: 6, 8: 6, 9: 6,
+    10: 7, 11: 6, 12: 6, 13: 7, 14: 8, 15: 8,
+}
+
+# uImage ih_arch -> our arch names
+UIMAGE_ARCH = {2: "arm", 3: "x86", 5: "mips", 22: "aarch64", 24: "x86_64"}
+
+UIMAGE_MAGIC = 0x27051956
+ZIMAGE_MAGIC = 0x016F2818
+ARM64_MAGIC = b"ARM\x64"
+
+SHT_ARM_ATTRIBUTES = 0x70000003
+
+# First match wins. `arm_v` bounds are inclusive; None means "any".
+# `hints` are kernel filename tokens used to rank template kernels after the
+# header check; `endian_hints` break ties between the BE/LE builds of one board.
+PRESETS = [
+    {"arch": "mips", "endian": "big", "qemu_binary": "qemu-system-mips", "machine_type": "malta",
+     "qemuopts": "MALTA2", "hints": ("malta",), "endian_hints": ("-be", "big", "mipseb")},
+    {"arch": "mips", "endian": "little", "qemu_binary": "qemu-system-mips", "machine_type": "malta",
+     "qemuopts": "MALTA3", "hints": ("malta",), "endian_hints": ("-le", "little", "mipsel")},
+    {"arch": "arm", "endian": "little", "arm_v": (None, 5), "qemu_binary": "qemu-system-arm",
+     "machine_type": "versatilepb", "qemuopts": "VERSATILEPB", "hints": ("versatile",), "endian_hints": ()},
+    {"arch": "arm", "endian": "little", "arm_v": (6, 6), "qemu_binary": "qemu-system-arm",
+     "machine_type": "realview-eb", "qemuopts": "REALVIEW-EB", "hints": ("realview",), "endian_hints": ()},
+    {"arch": "arm", "endian": "little", "arm_v": (7, None), "qemu_binary": "qemu-system-arm",
+     "machine_type": "vexpress-a9", "qemuopts": "VEXPRESS1", "hints": ("vexpress", "a9"), "endian_hints": ()},
+    {"arch": "aarch64", "endian": "little", "qemu_binary": "qemu-system-aarch64", "machine_type": "virt",
+     "qemuopts": "VIRTARM64", "hints": ("aarch64", "arm64", "virt"), "endian_hints": ()},
+]
+
+# Where to look for representative binaries, most telling first
+PROBE_PATHS = ("bin/busybox", "sbin/init", "bin/sh", "usr/sbin/httpd", "sbin/httpd")
+PROBE_DIRS = ("bin", "sbin", "usr/bin", "usr/sbin", "lib")
+MAX_PROBES = 24
+
+CACHE_FILE = os.path.join(".affirm", "infer-cache.json")
+_CACHE: dict[str, dict] = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def _elf_header(data: bytes) -> dict | None:
+    """
+    Parse e_ident/e_machine/e_flags from the first 64 bytes of an ELF file.
+    """
+    if len(data) < 52 or data[:4] != b"\x7fELF":
+        return None
+    bits = {1: 32, 2: 64}.get(data[4])
+    endian = {1: "little", 2: "big"}.get(data[5])
+    if not bits or not endian:
+        return None
+    e = "<" if endian == "little" else ">"
+    machine = struct.unpack_from(e + "H", data, 0x12)[0]
+    flags_off = 0x24 if bits == 32 else 0x30
+    if len(data) < flags_off + 4:
+        return None
+    flags = struct.unpack_from(e + "I", data, flags_off)[0]
+    return {"bits": bits, "endian": endian, "e_machine": machine,
+            "arch": MACHINES.get(machine, f"em{machine}"), "e_flags": flags}
+
+
+def _uleb128(buf: bytes, pos: int) -> tuple[int, int]:
+    val = shift = 0
+    while pos < len(buf):
+        b = buf[pos]
+        pos += 1
+        val |= (b & 0x7F) << shift
+        shift += 7
+        if not b & 0x80:
+            break
+    return val, pos
+
+
+def _arm_cpu_arch(f, hdr: dict) -> int | None:
+    """
+    Tag_CPU_arch from .ARM.attributes, mapped to an architecture version (4..8).
+    """
+    e = "<" if hdr["endian"] == "little" else ">"
+    try:
+        f.seek(0)
+        head = f.read(52)
+        shoff = struct.unpack_from(e + "I", head, 0x20)[0]
+        shentsize, shnum = struct.unpack_from(e + "HH", head, 0x2E)
+        if not shoff or shentsize < 40 or shnum > 4096:
+            return None
+        f.seek(shoff)
+        table = f.read(shentsize * shnum)
+        for i in range(shnum):
+            sh = table[i * shentsize:(i + 1) * shentsize]
+            if len(sh) < 40:
+                break
+            sh_type, _, _, sh_offset, sh_size = struct.unpack_from(e + "IIIII", sh, 4)
+            if sh_type != SHT_ARM_ATTRIBUTES or sh_size > 1 << 16:
+                continue
+            f.seek(sh_offset)
+            attrs = f.read(sh_size)
+            return _parse_arm_attributes(attrs, e)
+    except (OSError, struct.error):
+        return None
+    return None
+
+
+def _parse_arm_attributes(attrs: bytes, e: str) -> int | None:
+    # 'A' <u32 len><"aeabi\0"> <tag 1 (file)><u32 len> <tag/value pairs...>
+    if not attrs or attrs[0:1] != b"A":
+        return None
+    pos = 1
+    while pos + 4 <= len(attrs):
+        sec_len = struct.unpack_from(e + "I", attrs, pos)[0]
+        end = min(pos + sec_len, len(attrs))
+        name_end = attrs.find(b"\0", pos + 4, end)
+        if sec_len < 5 or name_end < 0:
+            return None
+        if attrs[pos + 4:name_end] == b"aeabi":
+            sub = name_end + 1
+            while sub + 5 <= end:
+                tag = attrs[sub]
+                sub_len = struct.unpack_from(e + "I", attrs, sub + 1)[0]
+                sub_end = min(sub + sub_len, end)
+                if tag == 1:  # Tag_File
+                    p = sub + 5
+                    while p < sub_end:
+                        t, p = _uleb128(attrs, p)
+                        if t in (4, 5, 67):  # NTBS-valued tags
+                            z = attrs.find(b"\0", p, sub_end)
+                            p = (z + 1) if z >= 0 else sub_end
+                        elif t == 32:  # Tag_compatibility: uleb + NTBS
+                            _, p = _uleb128(attrs, p)
+                            z = attrs.find(b"\0", p, sub_end)
+                            p = (z + 1) if z >= 0 else sub_end
+                        else:
+                            v, p = _uleb128(attrs, p)
+                            if t == 6:  # Tag_CPU_arch
+                                return ARM_CPU_ARCH.get(v)
+                if sub_len < 5:
+                    break
+                sub = sub_end
+        pos = end
+    return None
+
+
+def inspect_elf(path: str) -> dict | None:
+    """
+    Profile one ELF file: arch, bits, endian and ABI details from e_flags.
+    Returns None for non-ELF files.
+    """
+    try:
+        with open(path, "rb") as f:
+            hdr = _elf_header(f.read(64))
+            if not hdr:
+                return None
+            flags = hdr["e_flags"]
+            if hdr["arch"] == "mips":
+                hdr["isa"] = MIPS_ISA.get(flags >> 28, "mips?")
+                hdr["abi"] = "o32" if hdr["bits"] == 32 else "n64"
+            elif hdr["arch"] == "arm":
+                eabi = flags >> 24
+                hdr["abi"] = f"eabi{eabi}" if eabi else "oabi"
+                if flags & 0x400:
+                    hdr["float"] = "hard"
+                elif flags & 0x200:
+                    hdr["float"] = "soft"
+                if hdr["bits"] == 32:
+                    hdr["arm_v"] = _arm_cpu_arch(f, hdr)
+            return hdr
+    except OSError:
+        return None
+
+
+def inspect_kernel(path: str) -> dict:
+    """
+    Read what a kernel image says about itself: format, arch and byte order.
+    Unknown fields are None (a uImage header, for example, has no endianness).
+    """
+    info = {"format": None, "arch": None, "endian": None}
+    try:
+        with open(path, "rb") as f:
+            head = f.read(64)
+    except OSError:
+        return info
+    hdr = _elf_header(head)
+    if hdr:
+        info.update(format="elf", arch=hdr["arch"], endian=hdr["endian"])
+        return info
+    if len(head) >= 32 and struct.unpack_from(">I", head, 0)[0] == UIMAGE_MAGIC:
+        info.update(format="uimage", arch=UIMAGE_ARCH.get(head[29]))
+        return info
+    if len(head) >= 0x30:
+        if struct.unpack_from("<I", head, 0x24)[0] == ZIMAGE_MAGIC:
+            info.update(format="zimage", arch="arm", endian="little")
+            return info
+        if struct.unpack_from(">I", head, 0x24)[0] == ZIMAGE_MAGIC:
+            info.update(format="zimage", arch="arm", endian="big")
+            return info
+    if len(head) >= 0x3C and head[0x38:0x3C] == ARM64_MAGIC:
+        info.update(format="image", arch="aarch64", endian="little")
+    return info
+
+
+def _probe_files(rootfs_dir: str) -> list[str]:
+    """
+    A bounded, deterministic sample of regular files likely to be ELF binaries.
+    Symlinks are resolved inside the rootfs (busybox applets point at /bin/busybox).
+    """
+    root = os.path.realpath(rootfs_dir)
+    out = []
+
+    def _resolve(rel: str) -> str | None:
+        p = os.path.join(root, rel)
+        for _ in range(8):
+            if not os.path.islink(p):
+                break
+            tgt = os.readlink(p)
+            p = os.path.join(root, tgt.lstrip("/")) if os.path.isabs(tgt) else os.path.join(os.path.dirname(p), tgt)
+        p = os.path.realpath(p)
+        if (p == root or p.startswith(root + os.sep)) and os.path.isfile(p):
+            return p
+        return None
+
+    for rel in PROBE_PATHS:
+        p = _resolve(rel)
+        if p and p not in out:
+            out.append(p)
+    for d in PROBE_DIRS:
+        try:
+            names = sorted(os.listdir(os.path.join(root, d)))
+        except OSError:
+            continue
+        for n in names:
+            if len(out) >= MAX_PROBES:
+                return out
+            p = _resolve(os.path.join(d, n))
+            if p and p not in out:
+                out.append(p)
+    return out
+
+
+def _rootfs_hash(files: list[str], rootfs_dir: str) -> str:
+    h = hashlib.sha256()
+    for p in files:
+        try:
+            st = os.stat(p)
+            with open(p, "rb") as f:
+                head = f.read(4096)
+        except OSError:
+            continue
+        h.update(os.path.relpath(p, rootfs_dir).encode() + b"\0" + str(st.st_size).encode() + b"\0")
+        h.update(head)
+    return h.hexdigest()
+
+
+def profile_rootfs(rootfs_dir: str) -> dict | None:
+    """
+    Majority vote over sampled rootfs binaries. None if no ELF was found.
+    """
+    votes, samples = Counter(), {}
+    for p in _probe_files(rootfs_dir):
+        hdr = inspect_elf(p)
+        if not hdr:
+            continue
+        key = (hdr["arch"], hdr["endian"], hdr["bits"])
+        votes[key] += 1
+        samples.setdefault(key, []).append(hdr)
+    if not votes:
+        return None
+    (arch, endian, bits), n = votes.most_common(1)[0]
+    hdrs = samples[(arch, endian, bits)]
+    prof = {"arch": arch, "endian": endian, "bits": bits, "binaries": n}
+    for field in ("isa", "abi", "float"):
+        vals = Counter(h[field] for h in hdrs if h.get(field))
+        if vals:
+            prof[field] = vals.most_common(1)[0][0]
+    arm_vs = [h["arm_v"] for h in hdrs if h.get("arm_v")]
+    if arm_vs:
+        # The newest ISA any binary needs is what the CPU must provide
+        prof["arm_v"] = max(arm_vs)
+    elif arch == "arm" and prof.get("float") == "hard":
+        prof["arm_v"] = 7  # hard-float EABI userlands are ARMv7 in practice
+    return prof
+
+
+def _match_preset(prof: dict) -> dict | None:
+    for p in PRESETS:
+        if p["arch"] != prof["arch"] or p["endian"] != prof["endian"]:
+            continue
+        lo, hi = p.get("arm_v", (None, None))
+        v = prof.get("arm_v")
+        if v is not None and ((lo is not None and v < lo) or (hi is not None and v > hi)):
+            continue
+        if v is None and "arm_v" in p and lo is not None:
+            continue  # unknown ARM version: fall through to the ARMv5 (lowest common) preset
+        return p
+    return None
+
+
+def rank_kernels(kernel_dir: str, preset: dict, prof: dict) -> list[tuple[int, str]]:
+    """
+    Score template kernels against a preset: header arch/endian must not
+    contradict the rootfs, then filename hints break ties. Best first.
+    """
+    ranked = []
+    try:
+        names = sorted(os.listdir(kernel_dir))
+    except OSError:
+        return ranked
+    for name in names:
+        path = os.path.join(kernel_dir, name)
+        if not os.path.isfile(path) or name.lower().endswith(".dtb"):
+            continue
+        k = inspect_kernel(path)
+        if k["arch"] and k["arch"] != prof["arch"]:
+            continue
+        if k["endian"] and k["endian"] != prof["endian"]:
+            continue
+        low = name.lower()
+        score = 0
+        if k["arch"]:
+            score += 4
+        if k["endian"]:
+            score += 2
+        score += 3 * sum(1 for h in preset["hints"] if h in low)
+        score += 2 * sum(1 for h in preset["endian_hints"] if h in low)
+        # A name that advertises the other byte order is a strong negative
+        other = [p for p in PRESETS if p["arch"] == preset["arch"] and p["endian"] != preset["endian"]]
+        if any(h in low for o in other for h in o["endian_hints"]):
+            score -= 5
+        ranked.append((score, name))
+    ranked.sort(key=lambda t: (-t[0], t[1]))
+    return ranked
+
+
+def _load_cache(cache_path: str) -> None:
+    if _CACHE or not cache_path or not os.path.isfile(cache_path):
+        return
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            _CACHE.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+
+
+def _save_cache(cache_path: str) -> None:
+    if not cache_path:
+        return
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp = cache_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(_CACHE, f, indent=1, sort_keys=True)
+        os.replace(tmp, cache_path)
+    except OSError:
+        pass
+
+
+def infer_config(rootfs_dir: str, kernel_dir: str | None = None, cache_path: str | None = None) -> dict | None:
+    """
+    Profile `rootfs_dir`, pick the matching preset and rank the kernels in
+    `kernel_dir`. Cached by rootfs content hash (in memory and in `cache_path`);
+    kernel ranking is redone when the template kernels change.
+    Returns None when the rootfs has no recognisable ELF binaries.
+    """
+    files = _probe_files(rootfs_dir)
+    if not files:
+        return None
+    digest = _rootfs_hash(files, rootfs_dir)
+    kernels_sig = ""
+    if kernel_dir and os.path.isdir(kernel_dir):
+        kernels_sig = ",".join(
+            f"{n}:{os.path.getsize(os.path.join(kernel_dir, n))}"
+            for n in sorted(os.listdir(kernel_dir)) if os.path.isfile(os.path.join(kernel_dir, n))
+        )
+    with _CACHE_LOCK:
+        _load_cache(cache_path)
+        hit = _CACHE.get(digest)
+        if hit and hit.get("kernels_sig") == kernels_sig:
+            return dict(hit, cached=True)
+
+    prof = profile_rootfs(rootfs_dir)
+    if not prof:
+        return None
+    preset = _match_preset(prof)
+    result = {"rootfs_hash": digest, "profile": prof, "preset": None, "kernels": [], "kernels_sig": kernels_sig}
+    if preset:
+        result["preset"] = {k: preset[k] for k in ("qemu_binary", "machine_type", "qemuopts")}
+        if kernel_dir:
+            result["kernels"] = [n for _, n in rank_kernels(kernel_dir, preset, prof)]
+    with _CACHE_LOCK:
+        _CACHE[digest] = result
+        _save_cache(cache_path)
+    return dict(result, cached=False)
+
+
+def describe_profile(prof: dict) -> str:
+    """One-line human summary, e.g. 'mips 32-bit big-endian (mips32r2, o32)'."""
+    extra = [prof[k] for k in ("isa", "abi", "float") if prof.get(k)]
+    if prof.get("arm_v"):
+        extra.insert(0, f"ARMv{prof['arm_v']}")
+    s = f"{prof['arch']} {prof['bits']}-bit {prof['endian']}-endian"
+    return s + (f" ({', '.join(extra)})" if extra else "")
@@ -1,10 +1,13 @@
 import os, sys
+from emux_lib.elf_infer import PRESETS
 
-def _infer_device_suggestion(dest_dir: str, kernel_filename: str, model_for_desc: str):
+def _infer_device_suggestion(dest_dir: str, kernel_filename: str, model_for_desc: str, inferred: dict | None = None):
     """
     Build a row for files/emux/devices:
     ID,qemu-binary,machine-type,cpu-type,dtb,memory,kernel-image,qemuopts,description
     Fills qemuopts using your EMUX presets.
+    `inferred` is the result of elf_infer.infer_config(); when present, the
+    rootfs ELF profile overrides filename guesses that contradict it.
     """
     # Defaults
     qemu_binary  = ""
@@ -76,6 +79,25 @@ def _infer_device_suggestion(dest_dir: str, kernel_filename: str, model_for_desc
                 machine_type = "malta"
                 qemuopts = "MALTA3" if "-le" in k else "MALTA2"
 
+    # --- Reconcile with the rootfs ELF profile ---
+    preset = (inferred or {}).get("preset")
+    if preset:
+        guessed = next((p for p in PRESETS if p["qemuopts"] == qemuopts), None)
+        prof = inferred["profile"]
+        keep_board = (
+            guessed is not None
+            and guessed["arch"] == prof["arch"]
+            and guessed["endian"] == prof["endian"]
+            # an older board cannot run a userland built for a newer ISA
+            and (prof.get("arm_v") is None or guessed.get("arm_v", (None, None))[1] is None
+                 or prof["arm_v"] <= guessed["arm_v"][1])
+        )
+        if not keep_board:
+            qemu_binary  = preset["qemu_binary"]
+            machine_type = preset["machine_type"]
+            qemuopts     = preset["qemuopts"]
+            cpu_type     = ""
+
     # Compose CSV row
     # ID is relative to files/emux: firmware/<folder>
     device_id = f"firmware/{os.path.basename(dest_dir)}"
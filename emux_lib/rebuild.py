@@ -0,0 +1,243 @@
+import os, json, time, uuid, shlex, signal, hashlib, threading, subprocess
+
+# ---- incremental EMUX rebuild ----
+# build-emux-volume packs files/emux/ into the volume; build-emux-docker builds the
+# image from the rest of the tree. We hash both input sets against a stored
+# manifest and only run the step whose inputs changed.
+
+STATE_DIR = ".affirm"
+MANIFEST = "rebuild-manifest.json"
+SKIP_DIRS = {".git", STATE_DIR, "__pycache__"}
+
+def _step_inputs(rel: str) -> str:
+    """
+    Which rebuild step a path under EMUX_HOME feeds: 'volume' or 'docker'.
+    """
+    return "volume" if rel == os.path.join("files", "emux") or rel.startswith(os.path.join("files", "emux") + os.sep) else "docker"
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _scan(emux_home: str, previous: dict) -> dict:
+    """
+    {relpath: [size, mtime_ns, sha256]}. Files whose size/mtime match the
+    previous manifest reuse its hash, so only touched files are read.
+    """
+    out = {}
+    for root, dirs, files in os.walk(emux_home):
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for fn in files:
+            full = os.path.join(root, fn)
+            rel = os.path.relpath(full, emux_home)
+            if ".bak." in fn:
+                continue  # emux.applyconfig backups are not build inputs
+            try:
+                st = os.stat(full)
+            except OSError:
+                continue
+            prev = previous.get(rel)
+            if prev and prev[0] == st.st_size and prev[1] == st.st_mtime_ns:
+                out[rel] = prev
+                continue
+            try:
+                out[rel] = [st.st_size, st.st_mtime_ns, _sha256(full)]
+            except OSError:
+                continue
+    return out
+
+def _changes(old: dict, new: dict) -> dict[str, list[str]]:
+    """
+    Changed paths per step: {'volume': [...], 'docker': [...]}.
+    """
+    changed = {"volume": [], "docker": []}
+    for rel in sorted(set(old) | set(new)):
+        a, b = old.get(rel), new.get(rel)
+        if a is None or b is None or a[2] != b[2]:
+            changed[_step_inputs(rel)].append(rel)
+    return changed
+
+def _load_manifest(emux_home: str) -> dict:
+    try:
+        with open(os.path.join(emux_home, STATE_DIR, MANIFEST), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def _save_manifest(emux_home: str, manifest: dict) -> None:
+    d = os.path.join(emux_home, STATE_DIR)
+    os.makedirs(d, exist_ok=True)
+    tmp = os.path.join(d, MANIFEST + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(d, MANIFEST))
+
+def _kill_group(proc) -> None:
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except Exception:
+        proc.kill()
+
+def _sudo_hint(stderr: str) -> str:
+    s = (stderr or "").lower()
+    if "a terminal is required" in s or "no tty present" in s:
+        return "[hint] sudo may require a TTY. Configure NOPASSWD or run without sudo (no_sudo=true) if permitted."
+    if "may not run sudo" in s or "password" in s:
+        return "[hint] sudo denied or needs a password. Configure NOPASSWD or set no_sudo=true."
+    return ""
+
+class RebuildJob:
+    """
+    One emux rebuild running in a background thread. Output of both steps is
+    streamed line by line into a log file that can be read incrementally.
+    """
+
+    def __init__(self, emux_home: str, timeout_sec: int, no_sudo: bool, force: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.emux_home = emux_home
+        self.timeout_sec = timeout_sec
+        self.no_sudo = no_sudo
+        self.force = force
+        self.status = "queued"     # queued | running | done | failed
+        self.steps: list[dict] = []
+        self.started = time.time()
+        self.finished = None
+        log_dir = os.path.join(emux_home, STATE_DIR, "rebuild-logs")
+        os.makedirs(log_dir, exist_ok=True)
+        self.log_path = os.path.join(log_dir, f"{self.id}.log")
+        self._log_lock = threading.Lock()
+        self._thread = None
+
+    def log(self, text: str) -> None:
+        with self._log_lock:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(text if text.endswith("\n") else text + "\n")
+
+    def read_log(self, offset: int = 0, max_bytes: int | None = 64_000) -> tuple[str, int, int]:
+        """
+        (chunk, next_offset, total_size) starting at byte `offset` (max_bytes=None reads to EOF).
+        """
+        try:
+            size = os.path.getsize(self.log_path)
+            with open(self.log_path, "rb") as f:
+                f.seek(offset)
+                data = f.read(-1 if max_bytes is None else max_bytes)
+        except OSError:
+            return "", offset, 0
+        return data.decode("utf-8", "replace"), offset + len(data), size
+
+    def _cmd(self, script: str) -> list[str]:
+        return [script] if self.no_sudo else ["sudo", "-n", script]
+
+    def _run_step(self, label: str, cmd: list[str]) -> int:
+        self.log(f"\n--- {label} ---\n[cmd] {' '.join(shlex.quote(c) for c in cmd)}")
+        start = time.time()
+        tail = []
+        try:
+            proc = subprocess.Popen(cmd, cwd=self.emux_home, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    text=True, errors="replace", start_new_session=True)
+        except FileNotFoundError as e:
+            self.log(f"[error] {e}")
+            rc = 127
+        else:
+            timer = threading.Timer(self.timeout_sec, _kill_group, args=(proc,))
+            timer.start()
+            try:
+                for line in proc.stdout:
+                    self.log(line)
+                    tail = (tail + [line])[-20:]
+                rc = proc.wait()
+            finally:
+                timer.cancel()
+            if rc < 0 and time.time() - start >= self.timeout_sec:
+                self.log("[timeout]")
+                rc = 124
+        dur = time.time() - start
+        hint = _sudo_hint("".join(tail))
+        if rc != 0 and hint:
+            self.log(hint)
+        self.log(f"[exit={rc}] [duration={dur:.2f}s] [cwd={self.emux_home}]")
+        self.steps.append({"step": label, "exit": rc, "duration": dur})
+        return rc
+
+    def _run(self) -> None:
+        self.status = "running"
+        old = _load_manifest(self.emux_home)
+        new = _scan(self.emux_home, old)
+        changed = _changes(old, new)
+        todo = {
+            "volume": self.force or not old or bool(changed["volume"]),
+            "docker": self.force or not old or bool(changed["docker"]),
+        }
+        for step in ("volume", "docker"):
+            n = len(changed[step])
+            why = "forced" if self.force else ("no previous manifest" if not old else f"{n} changed file(s)")
+            self.log(f"[plan] build-emux-{step}: {'run' if todo[step] else 'skip'} ({why})"
+                     + ("".join(f"\n  ~ {p}" for p in changed[step][:10]) if n and old and not self.force else ""))
+
+        # Steps that succeed record their half of the manifest; failures keep the old one
+        saved = dict(old)
+        failed = False
+        for step in ("volume", "docker"):
+            if not todo[step]:
+                self.steps.append({"step": f"build-emux-{step}", "exit": None, "duration": 0.0, "skipped": True})
+                continue
+            rc = self._run_step(f"build-emux-{step}", self._cmd(f"./build-emux-{step}"))
+            if rc != 0:
+                failed = True
+                break
+            saved = {k: v for k, v in saved.items() if _step_inputs(k) != step}
+            saved.update({k: v for k, v in new.items() if _step_inputs(k) == step})
+        try:
+            _save_manifest(self.emux_home, saved)
+        except Exception as e:
+            self.log(f"[warn] could not save rebuild manifest: {e}")
+        self.status = "failed" if failed else "done"
+        self.finished = time.time()
+        self.log(f"[emux.rebuild] {self.status}")
+
+    def start(self) -> "RebuildJob":
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def wait(self, timeout: float | None = None) -> None:
+        if self._thread:
+            self._thread.join(timeout)
+
+    def summary(self) -> str:
+        parts = []
+        for s in self.steps:
+            if s.get("skipped"):
+                parts.append(f"{s['step']}: skipped (unchanged)")
+            else:
+                parts.append(f"{s['step']}: exit={s['exit']} ({s['duration']:.1f}s)")
+        elapsed = (self.finished or time.time()) - self.started
+        return f"job {self.id} | {self.status} | {elapsed:.0f}s" + ("".join(f"\n- {p}" for p in parts))
+
+_JOBS: dict[str, RebuildJob] = {}
+_JOBS_LOCK = threading.Lock()
+
+def start_rebuild(emux_home: str, timeout_sec: int = 7200, no_sudo: bool = False, force: bool = False) -> RebuildJob:
+    """
+    Start a rebuild in the background; refuses to run two at once for the same EMUX_HOME.
+    """
+    with _JOBS_LOCK:
+        for job in _JOBS.values():
+            if job.emux_home == emux_home and job.status in ("queued", "running"):
+                raise RuntimeError(f"rebuild job {job.id} is already running")
+        job = RebuildJob(emux_home, timeout_sec, no_sudo, force)
+        _JOBS[job.id] = job
+    return job.start()
+
+def get_rebuild_job(job_id: str | None) -> RebuildJob | None:
+    """
+    Job by id, or the most recent job when `job_id` is empty.
+    """
+    with _JOBS_LOCK:
+        if job_id:
+            return _JOBS.get(job_id)
+        return max(_JOBS.values(), key=lambda j: j.started) if _JOBS else None
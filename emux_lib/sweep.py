@@ -0,0 +1,278 @@
+import os, re, json, stat, time, shlex, signal, tarfile, subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from firmae_lib.sqlite_helper import kb_init, kb_connect
+from firmae_lib.quota import _parse_size
+
+# ---- kernel candidate sweep ----
+# Each shortlisted template kernel is booted straight in QEMU against one shared
+# initramfs built from the packed rootfs. The serial console is scored on boot
+# milestones; the best candidate wins and every attempt lands in emux_sweeps.
+
+SWEEP_DIR = os.path.join(".affirm", "sweeps")
+
+# (name, pattern, points) — reached milestones add up; later ones weigh more
+MILESTONES = [
+    ("decompress", re.compile(r"Uncompressing Linux|Decompressing Linux|Booting the kernel"), 1),
+    ("banner",     re.compile(r"Linux version \d"), 2),
+    ("console",    re.compile(r"console \[\w+\] enabled|Serial: 8250"), 1),
+    ("initramfs",  re.compile(r"Unpacking initramfs|Freeing unused kernel memory|Freeing init memory"), 3),
+    ("init",       re.compile(r"Run /s?bin/init|init started|BusyBox v\d"), 3),
+    ("userland",   re.compile(r"login:|Please press Enter|httpd|br0: |^[/\w~-]*\s?# ", re.M), 2),
+]
+# (name, pattern, points) — subtracted once each
+PENALTIES = [
+    ("panic",    re.compile(r"Kernel panic"), 3),
+    ("illegal",  re.compile(r"Illegal instruction|Exec format error"), 2),
+    ("kill_init", re.compile(r"Attempted to kill init"), 2),
+]
+MAX_SCORE = sum(p for _, _, p in MILESTONES)
+
+CONSOLES = {
+    "malta": "ttyS0", "versatilepb": "ttyAMA0", "realview-eb": "ttyAMA0",
+    "vexpress-a9": "ttyAMA0", "vexpress-a15": "ttyAMA0", "virt": "ttyAMA0",
+}
+
+SERIAL_CAP = 1 << 20  # bytes of serial output kept per candidate
+POLL = 0.5
+
+
+def score_serial(text: str) -> tuple[int, list[str]]:
+    """
+    Score a serial log. Returns (score, [reached milestone / penalty names]).
+    """
+    score, hits = 0, []
+    for name, pat, pts in MILESTONES:
+        if pat.search(text):
+            score += pts
+            hits.append(name)
+    for name, pat, pts in PENALTIES:
+        if pat.search(text):
+            score -= pts
+            hits.append(f"-{name}")
+    return score, hits
+
+
+def _cpio_entry(out, name: str, mode: int, data: bytes = b"", mtime: int = 0,
+                nlink: int = 1, rdev: tuple[int, int] = (0, 0), ino: int = 0) -> None:
+    name_b = name.encode() + b"\0"
+    hdr = "070701" + "".join(f"{v:08X}" for v in (
+        ino, mode, 0, 0, nlink, mtime, len(data), 0, 0, rdev[0], rdev[1], len(name_b), 0))
+    out.write(hdr.encode() + name_b)
+    out.write(b"\0" * (-(110 + len(name_b)) % 4))
+    out.write(data)
+    out.write(b"\0" * (-len(data) % 4))
+
+
+def build_initramfs(rootfs_tar: str, out_path: str) -> str:
+    """
+    Convert rootfs.tar.bz2 into an uncompressed newc cpio usable with -initrd.
+    Reused while it is newer than the tarball. Ownership is flattened to root.
+    """
+    try:
+        if os.path.getmtime(out_path) >= os.path.getmtime(rootfs_tar):
+            return out_path
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    tmp = out_path + ".part"
+    seen = set()
+    with tarfile.open(rootfs_tar, "r:*") as tf, open(tmp, "wb") as out:
+        ino = 1
+        for m in tf:
+            name = os.path.normpath(m.name).lstrip("/")
+            if name in ("", ".") or name.startswith(".."):
+                continue
+            perm = m.mode & 0o7777
+            if m.isdir():
+                _cpio_entry(out, name, stat.S_IFDIR | perm, mtime=int(m.mtime), nlink=2, ino=ino)
+            elif m.issym():
+                _cpio_entry(out, name, stat.S_IFLNK | 0o777, m.linkname.encode(), int(m.mtime), ino=ino)
+            elif m.ischr() or m.isblk():
+                kind = stat.S_IFCHR if m.ischr() else stat.S_IFBLK
+                _cpio_entry(out, name, kind | perm, mtime=int(m.mtime), rdev=(m.devmajor, m.devminor), ino=ino)
+            elif m.isfile() or m.islnk():
+                f = tf.extractfile(m)
+                data = f.read() if f else b""
+                _cpio_entry(out, name, stat.S_IFREG | perm, data, int(m.mtime), ino=ino)
+            else:
+                continue
+            seen.add(name)
+            ino += 1
+        # The kernel opens /dev/console before init; rootfs tarballs rarely carry it
+        if "dev" not in seen:
+            _cpio_entry(out, "dev", stat.S_IFDIR | 0o755, nlink=2, ino=ino)
+            ino += 1
+        if "dev/console" not in seen:
+            _cpio_entry(out, "dev/console", stat.S_IFCHR | 0o600, rdev=(5, 1), ino=ino)
+        _cpio_entry(out, "TRAILER!!!", 0)
+    os.replace(tmp, out_path)
+    return out_path
+
+
+def boot_command(row: dict, kernel_path: str, initrd: str, profile: dict | None) -> list[str]:
+    """
+    QEMU argv for one candidate. `row` carries the devices-row fields
+    (qemu-binary, machine-type, cpu-type, memory). EMUX_SWEEP_CMD, if set,
+    is a format string over the same fields (e.g. to run QEMU inside docker).
+    """
+    qemu = row["qemu-binary"]
+    if profile and profile.get("arch") == "mips" and profile.get("endian") == "little" and qemu == "qemu-system-mips":
+        qemu = "qemu-system-mipsel"  # the MALTA3 preset row names the BE binary; boot needs the LE one
+    console = CONSOLES.get(row["machine-type"], "ttyS0")
+    append = f"console={console} rdinit=/sbin/init panic=1"
+    fields = {
+        "qemu": qemu, "machine": row["machine-type"], "memory": row.get("memory") or "256M",
+        "kernel": kernel_path, "initrd": initrd, "append": append, "cpu": row.get("cpu-type") or "",
+    }
+    tmpl = os.environ.get("EMUX_SWEEP_CMD")
+    if tmpl:
+        return shlex.split(tmpl.format(**{k: shlex.quote(v) for k, v in fields.items()}))
+    cmd = [qemu, "-M", fields["machine"], "-m", fields["memory"], "-kernel", kernel_path,
+           "-initrd", initrd, "-nographic", "-no-reboot", "-append", append]
+    if fields["cpu"]:
+        cmd += ["-cpu", fields["cpu"]]
+    return cmd
+
+
+def _guest_class(cand: dict) -> str:
+    """Admission-control class of a candidate, e.g. 'mipsel-malta'."""
+    qemu = os.path.basename(cand["cmd"][0])
+    if not qemu.startswith("qemu-system-"):
+        qemu = cand["row"]["qemu-binary"]
+    return f"{qemu.removeprefix('qemu-system-')}-{cand['row']['machine-type']}"
+
+def _boot_one(cand: dict, timeout_sec: int, admission=None) -> dict:
+    """
+    Run one candidate until it reaches userland, panics, exits or times out.
+    With an Admission gate the boot waits for room, charged the row's guest memory.
+    """
+    res = {"kernel": cand["kernel"], "qemuopts": cand["row"]["qemuopts"], "score": 0,
+           "milestones": [], "elapsed_sec": 0.0, "error": None, "log": cand["log"]}
+    job = None
+    if admission is not None:
+        try:
+            job = admission.acquire("emux", _guest_class(cand), guest_mem=_parse_size(cand["row"].get("memory") or "256M"),
+                                    label=cand["kernel"])
+        except RuntimeError as e:
+            res["error"] = str(e)
+            return res
+    try:
+        return _boot_admitted(cand, timeout_sec, res, admission, job)
+    finally:
+        if job is not None:
+            admission.release(job)
+
+def _boot_admitted(cand: dict, timeout_sec: int, res: dict, admission, job) -> dict:
+    started = time.time()
+    try:
+        logf = open(cand["log"], "wb")
+    except OSError as e:
+        res["error"] = str(e)
+        return res
+    try:
+        proc = subprocess.Popen((job.pin_prefix() if job else []) + cand["cmd"], stdout=logf, stderr=subprocess.STDOUT,
+                                stdin=subprocess.DEVNULL, start_new_session=True)
+    except FileNotFoundError:
+        logf.close()
+        res["error"] = f"{cand['cmd'][0]} not found"
+        return res
+    if job is not None:
+        admission.attach(job, proc.pid)
+    try:
+        while True:
+            rc = proc.poll()
+            try:
+                with open(cand["log"], "rb") as f:
+                    text = f.read(SERIAL_CAP).decode("utf-8", "replace")
+            except OSError:
+                text = ""
+            res["score"], res["milestones"] = score_serial(text)
+            if rc is not None or "userland" in res["milestones"] or "-panic" in res["milestones"]:
+                break
+            if time.time() - started >= timeout_sec:
+                res["milestones"].append("timeout")
+                break
+            time.sleep(POLL)
+    finally:
+        if proc.poll() is None:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except Exception:
+                proc.kill()
+        proc.wait()
+        logf.close()
+    res["elapsed_sec"] = round(time.time() - started, 1)
+    return res
+
+
+def run_sweep(candidates: list[dict], timeout_sec: int = 60, workers: int = 2, admission=None) -> list[dict]:
+    """
+    Boot candidates in parallel ({kernel, row, cmd, log} each) under a bounded
+    pool, each admitted through `admission` if given. Results come back best
+    first: score, then time to get there.
+    """
+    if not candidates:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(candidates)))) as pool:
+        results = list(pool.map(lambda c: _boot_one(c, timeout_sec, admission), candidates))
+    results.sort(key=lambda r: (r["error"] is not None, -r["score"], r["elapsed_sec"]))
+    return results
+
+
+def _init_sweep_tables(con) -> None:
+    con.executescript("""
+    CREATE TABLE IF NOT EXISTS emux_sweeps (
+      id              INTEGER PRIMARY KEY AUTOINCREMENT,
+      sweep_ts        TEXT NOT NULL,
+      firmware_model  TEXT,
+      dest_dir        TEXT,
+      rootfs_hash     TEXT,
+      kernel          TEXT NOT NULL,
+      qemuopts        TEXT,
+      score           INTEGER,
+      milestones_json TEXT,
+      elapsed_sec     REAL,
+      error           TEXT,
+      winner          INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS emux_sweeps_rootfs ON emux_sweeps(rootfs_hash, winner);
+    """)
+
+
+def kb_record_sweep(db_path: str, firmware_model: str, dest_dir: str, rootfs_hash: str | None,
+                    results: list[dict], winner: str | None) -> None:
+    kb_init(db_path)
+    con = kb_connect(db_path)
+    try:
+        _init_sweep_tables(con)
+        ts = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+        con.executemany("""
+          INSERT INTO emux_sweeps (sweep_ts, firmware_model, dest_dir, rootfs_hash, kernel, qemuopts,
+                                   score, milestones_json, elapsed_sec, error, winner)
+          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(ts, firmware_model, dest_dir, rootfs_hash, r["kernel"], r["qemuopts"], r["score"],
+               json.dumps(r["milestones"]), r["elapsed_sec"], r["error"], int(r["kernel"] == winner))
+              for r in results])
+        con.commit()
+    finally:
+        con.close()
+
+
+def kb_previous_winner(db_path: str, rootfs_hash: str) -> dict | None:
+    """
+    Latest winning kernel for an identical rootfs, if a sweep already ran.
+    """
+    kb_init(db_path)
+    con = kb_connect(db_path)
+    try:
+        _init_sweep_tables(con)
+        row = con.execute("""
+          SELECT id, kernel, qemuopts, score, sweep_ts FROM emux_sweeps
+          WHERE rootfs_hash = ? AND winner = 1 ORDER BY id DESC LIMIT 1
+        """, (rootfs_hash,)).fetchone()
+    finally:
+        con.close()
+    if not row:
+        return None
+    return {"id": row[0], "kernel": row[1], "qemuopts": row[2], "score": row[3], "sweep_ts": row[4]}
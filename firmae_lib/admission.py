@@ -0,0 +1,428 @@
+import os, glob, time, shutil, threading
+from datetime import datetime
+from firmae_lib.sqlite_helper import kb_init, kb_connect
+from firmae_lib.timeouts import _percentile
+from firmae_lib.quota import _parse_size
+
+# ---- admission control for concurrent guests ----
+# Each emulation (kind "firmae") or sweep boot (kind "emux") asks for a slot
+# with an estimated cost: peak RSS and CPU cores. Costs are learned per
+# (kind, architecture) from past jobs in the KB table job_costs, and emux guests
+# are charged at least their devices-row memory. A job is admitted when, after
+# the memory still owed to running jobs, MemAvailable stays above
+# FIRMAE_ADMIT_MIN_FREE and the sampled CPU use fits FIRMAE_ADMIT_CPU cores.
+# A job is always admitted when nothing else is running.
+#   FIRMAE_ADMISSION       "0" turns admission control off
+#   FIRMAE_ADMIT_MIN_FREE  memory to keep free (default 1G)
+#   FIRMAE_ADMIT_CPU       core budget (default: all online CPUs)
+#   FIRMAE_ADMIT_MAX_JOBS  hard cap on concurrent jobs (default: none)
+#   FIRMAE_ADMIT_WAIT      seconds a job may queue before failing (default 3600)
+#   FIRMAE_PIN_CPUS        cores pinned to each job (default 0: no pinning)
+# With pinning, a job also needs that many unallocated cores. They are taken from
+# one NUMA node where possible. Commands run under numactl (which also prefers
+# memory on that node) or taskset, and the process group inherits the affinity.
+
+DEFAULT_RSS    = 512 << 20
+DEFAULT_CORES  = 1.0
+MIN_CORES      = 0.05       # floor for learned CPU, so idle-looking classes still count
+QEMU_OVERHEAD  = 96 << 20   # QEMU's own footprint on top of guest RAM
+MIN_SAMPLES    = 3
+PERCENTILE     = 90
+HISTORY        = 50         # most recent jobs per class used for the estimate
+SAMPLE_SEC     = 1.0
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE    = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def _now() -> str:
+    return datetime.utcnow().isoformat(timespec="seconds") + "Z"
+
+def _meminfo() -> dict[str, int]:
+    out = {}
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                parts = rest.split()
+                if parts:
+                    out[key] = int(parts[0]) * 1024
+    except OSError:
+        pass
+    return out
+
+def _cpu_times() -> tuple[int, int]:
+    """(busy, total) jiffies summed over all CPUs."""
+    try:
+        with open("/proc/stat") as f:
+            vals = [int(v) for v in f.readline().split()[1:]]
+    except (OSError, ValueError):
+        return 0, 0
+    idle = vals[3] + (vals[4] if len(vals) > 4 else 0)
+    return sum(vals) - idle, sum(vals)
+
+def host_snapshot() -> dict:
+    """
+    CPUs, load averages and memory from /proc.
+    """
+    try:
+        with open("/proc/loadavg") as f:
+            load = [float(x) for x in f.read().split()[:3]]
+    except (OSError, ValueError):
+        load = [0.0, 0.0, 0.0]
+    mem = _meminfo()
+    return {
+        "cpus": os.cpu_count() or 1,
+        "load1": load[0], "load5": load[1], "load15": load[2],
+        "mem_total": mem.get("MemTotal", 0),
+        "mem_available": mem.get("MemAvailable", mem.get("MemFree", 0)),
+    }
+
+def pgroup_table() -> dict[int, tuple[int, int]]:
+    """
+    {pgid: (rss_bytes, cpu_jiffies)} over every live process, from one /proc scan.
+    CPU time includes reaped children, so short-lived helpers still count.
+    """
+    table: dict[int, tuple[int, int]] = {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rpartition(")")[2].split()
+            # fields[0] is stat field 3 (state); pgrp, utime..cstime and rss are fields 5, 14-17 and 24
+            pgid = int(fields[2])
+            ticks = sum(int(x) for x in fields[11:15])
+            rss = int(fields[21]) * _PAGE
+        except (OSError, ValueError, IndexError):
+            continue
+        prev = table.get(pgid, (0, 0))
+        table[pgid] = (prev[0] + rss, prev[1] + ticks)
+    return table
+
+def _parse_cpulist(text: str) -> set[int]:
+    """'0-3,8,10-11' -> {0, 1, 2, 3, 8, 10, 11}"""
+    cpus = set()
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        lo, _, hi = part.partition("-")
+        cpus.update(range(int(lo), int(hi or lo) + 1))
+    return cpus
+
+def numa_nodes() -> dict[int | None, set[int]]:
+    """
+    {node: usable cpus}, restricted to this process's affinity. Without NUMA
+    information everything is one node, None.
+    """
+    usable = os.sched_getaffinity(0)
+    nodes = {}
+    for path in glob.glob("/sys/devices/system/node/node[0-9]*/cpulist"):
+        try:
+            with open(path) as f:
+                cpus = _parse_cpulist(f.read()) & usable
+        except (OSError, ValueError):
+            continue
+        if cpus:
+            nodes[int(os.path.basename(os.path.dirname(path))[4:])] = cpus
+    return nodes or {None: set(usable)}
+
+def _init_admission_tables(con) -> None:
+    con.executescript("""
+    CREATE TABLE IF NOT EXISTS job_costs (
+      id              INTEGER PRIMARY KEY AUTOINCREMENT,
+      at_ts           TEXT NOT NULL,
+      kind            TEXT NOT NULL,
+      architecture    TEXT,
+      peak_rss_bytes  INTEGER NOT NULL,
+      cpu_sec         REAL,
+      duration_sec    REAL,
+      label           TEXT
+    );
+    CREATE INDEX IF NOT EXISTS job_costs_class ON job_costs(kind, architecture, id);
+    """)
+
+def kb_record_job_cost(db_path: str, kind: str, architecture: str | None, peak_rss: int,
+                       cpu_sec: float, duration_sec: float, label: str | None = None) -> None:
+    kb_init(db_path)
+    con = kb_connect(db_path)
+    try:
+        _init_admission_tables(con)
+        con.execute("""
+          INSERT INTO job_costs (at_ts, kind, architecture, peak_rss_bytes, cpu_sec, duration_sec, label)
+          VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (_now(), kind, architecture, peak_rss, cpu_sec, duration_sec, label))
+        con.commit()
+    finally:
+        con.close()
+
+def kb_learned_costs(db_path: str) -> dict[tuple[str, str | None], dict]:
+    """
+    {(kind, architecture): {n, rss, cores}} from the last HISTORY jobs of each
+    class; (kind, None) pools every architecture of that kind.
+    """
+    kb_init(db_path)
+    con = kb_connect(db_path)
+    try:
+        _init_admission_tables(con)
+        rows = con.execute("""
+          SELECT kind, architecture, peak_rss_bytes, cpu_sec, duration_sec FROM job_costs ORDER BY id DESC
+        """).fetchall()
+    finally:
+        con.close()
+    samples: dict[tuple, list] = {}
+    for kind, arch, rss, cpu, dur in rows:
+        for key in ((kind, arch), (kind, None)) if arch else ((kind, None),):
+            bucket = samples.setdefault(key, [])
+            if len(bucket) < HISTORY:
+                bucket.append((rss, (cpu / dur) if cpu and dur else 0.0))
+    return {
+        key: {"n": len(v), "rss": int(_percentile([s[0] for s in v], PERCENTILE)),
+              "cores": round(_percentile([s[1] for s in v], PERCENTILE), 2)}
+        for key, v in samples.items() if len(v) >= MIN_SAMPLES
+    }
+
+class Job:
+    def __init__(self, kind: str, architecture: str | None, label: str | None, guest_mem: int | None):
+        self.kind = kind
+        self.architecture = architecture
+        self.label = label
+        self.guest_mem = guest_mem
+        self.est_rss = DEFAULT_RSS
+        self.est_cores = DEFAULT_CORES
+        self.basis = "default"
+        self.queued_at = time.time()
+        self.started_at = None
+        self.pgid = None
+        self.rss = 0
+        self.peak_rss = 0
+        self.cores = 0.0
+        self.ticks = 0
+        self._last = None   # (monotonic time, ticks) of the previous sample
+        self.cpus: list[int] = []   # pinned cores, empty when not pinned
+        self.node = None            # NUMA node of those cores, None when spread or unknown
+
+    def pin_prefix(self) -> list[str]:
+        """
+        argv prefix pinning the command (and so its whole group) to the job's
+        cores: numactl, which also prefers memory on the job's node, else taskset.
+        Affinity is set by exec'ing the wrapper, not in a preexec_fn, which is
+        unsafe in this multi-threaded server.
+        """
+        if not self.cpus:
+            return []
+        cpus = ",".join(map(str, sorted(self.cpus)))
+        if shutil.which("numactl"):
+            return ["numactl", f"--physcpubind={cpus}"] + ([f"--preferred={self.node}"] if self.node is not None else [])
+        if shutil.which("taskset"):
+            return ["taskset", "-c", cpus]
+        return []
+
+    def as_dict(self) -> dict:
+        return {
+            "kind": self.kind, "architecture": self.architecture, "label": self.label,
+            "est_rss": self.est_rss, "est_cores": self.est_cores, "basis": self.basis,
+            "rss": self.rss, "peak_rss": self.peak_rss, "cores": round(self.cores, 2),
+            "cpus": self.cpus, "node": self.node,
+            "age_sec": round(time.time() - (self.started_at or self.queued_at), 1),
+        }
+
+class Admission:
+    """
+    Gate in front of every guest launch. acquire() blocks until the host can
+    take the job, attach() starts RSS/CPU sampling of its process group and
+    release() frees the slot and feeds the observed cost back into the KB.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.enabled = os.environ.get("FIRMAE_ADMISSION", "1") != "0"
+        self.min_free = _parse_size(os.environ.get("FIRMAE_ADMIT_MIN_FREE") or "1G")
+        self.cpu_budget = float(os.environ.get("FIRMAE_ADMIT_CPU") or (os.cpu_count() or 1))
+        self.max_jobs = int(os.environ.get("FIRMAE_ADMIT_MAX_JOBS") or 0) or None
+        self.max_wait = float(os.environ.get("FIRMAE_ADMIT_WAIT") or 3600)
+        self.nodes = numa_nodes()
+        self.pin = min(int(os.environ.get("FIRMAE_PIN_CPUS") or 0), sum(len(c) for c in self.nodes.values()))
+        self.cpu_owner: dict[int, Job] = {}
+        self.running: list[Job] = []
+        self.waiting: list[Job] = []
+        self.cond = threading.Condition()
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "wait_sec_total": 0.0}
+        self.busy_cores = 0.0
+        self._cpu_last = None
+        self._costs = None
+        self._sampler = None
+
+    # -- estimates --
+
+    def _learned(self) -> dict:
+        if self._costs is None:
+            try:
+                self._costs = kb_learned_costs(self.db_path)
+            except Exception:
+                self._costs = {}
+        return self._costs
+
+    def estimate(self, kind: str, architecture: str | None = None, guest_mem: int | None = None) -> tuple[int, float, str]:
+        """
+        (rss_bytes, cores, basis) for a job of this kind/architecture.
+        """
+        costs = self._learned()
+        learned = costs.get((kind, architecture)) if architecture else None
+        basis = f"learned {kind}/{architecture} (n={learned['n']})" if learned else ""
+        if not learned:
+            learned = costs.get((kind, None))
+            basis = f"learned {kind} (n={learned['n']})" if learned else "default"
+        rss, cores = (learned["rss"], max(learned["cores"], MIN_CORES)) if learned else (DEFAULT_RSS, DEFAULT_CORES)
+        if guest_mem and guest_mem + QEMU_OVERHEAD > rss:
+            rss, basis = guest_mem + QEMU_OVERHEAD, f"guest memory {guest_mem >> 20}M + QEMU"
+        return rss, cores, basis
+
+    # -- gate --
+
+    def _pick_cpus(self) -> tuple[list[int], int | None] | None:
+        """
+        `self.pin` free cores: from the single node with the most free cores if
+        one has enough, otherwise the lowest free cores across nodes.
+        """
+        free = {n: sorted(c - self.cpu_owner.keys()) for n, c in self.nodes.items()}
+        fitting = [n for n, c in free.items() if len(c) >= self.pin]
+        if fitting:
+            node = max(fitting, key=lambda n: (len(free[n]), -(n or 0)))
+            return free[node][:self.pin], node
+        spread = sorted(c for cpus in free.values() for c in cpus)
+        return (spread[:self.pin], None) if len(spread) >= self.pin else None
+
+    def _fits(self, job: Job) -> bool:
+        if self.pin and self._pick_cpus() is None:
+            return False
+        if not self.running:
+            return True
+        if self.max_jobs and len(self.running) >= self.max_jobs:
+            return False
+        host = host_snapshot()
+        # Running jobs still growing towards their estimate have memory and CPU on credit
+        owed_mem = sum(max(0, j.est_rss - j.rss) for j in self.running)
+        owed_cpu = sum(max(0.0, j.est_cores - j.cores) for j in self.running)
+        if host["mem_available"] and host["mem_available"] - owed_mem - job.est_rss < self.min_free:
+            return False
+        return self.busy_cores + owed_cpu + job.est_cores <= self.cpu_budget
+
+    def acquire(self, kind: str, architecture: str | None = None, guest_mem: int | None = None,
+                label: str | None = None) -> Job:
+        """
+        Block until the job is admitted. Raises RuntimeError after FIRMAE_ADMIT_WAIT.
+        """
+        job = Job(kind, architecture, label, guest_mem)
+        with self.cond:
+            self._ensure_sampler()
+            job.est_rss, job.est_cores, job.basis = self.estimate(kind, architecture, guest_mem)
+            if self.enabled:
+                self.waiting.append(job)
+                queued = False
+                try:
+                    while not (self.waiting[0] is job and self._fits(job)):
+                        if time.time() - job.queued_at >= self.max_wait:
+                            self.stats["rejected"] += 1
+                            raise RuntimeError(
+                                f"host busy: not admitted within {self.max_wait:.0f}s "
+                                f"({len(self.running)} running, need {job.est_rss >> 20}M / {job.est_cores} cores)")
+                        queued = True
+                        self.cond.wait(SAMPLE_SEC)
+                        # Jobs finishing meanwhile may have taught us a better estimate
+                        job.est_rss, job.est_cores, job.basis = self.estimate(kind, architecture, guest_mem)
+                finally:
+                    self.waiting.remove(job)
+                    self.cond.notify_all()
+                if queued:
+                    self.stats["queued"] += 1
+            if self.pin:
+                picked = self._pick_cpus()
+                if picked:
+                    job.cpus, job.node = picked
+                    self.cpu_owner.update((c, job) for c in job.cpus)
+            job.started_at = time.time()
+            self.stats["wait_sec_total"] += job.started_at - job.queued_at
+            self.stats["admitted"] += 1
+            self.running.append(job)
+        return job
+
+    def attach(self, job: Job, pgid: int) -> None:
+        job.pgid = pgid
+        self._sample_job(job, pgroup_table())
+
+    def release(self, job: Job, architecture: str | None = None) -> None:
+        """
+        Free the slot; the job's observed peak RSS and CPU time become history
+        for its class (under `architecture` if it is only known now).
+        """
+        with self.cond:
+            if job in self.running:
+                self.running.remove(job)
+            for c in job.cpus:
+                self.cpu_owner.pop(c, None)
+            self.cond.notify_all()
+        if architecture:
+            job.architecture = architecture
+        if job.pgid is None or job.peak_rss <= 0:
+            return
+        duration = time.time() - job.started_at
+        try:
+            kb_record_job_cost(self.db_path, job.kind, job.architecture, job.peak_rss,
+                               job.ticks / _CLK_TCK, duration, job.label)
+            self._costs = None
+        except Exception:
+            pass
+
+    # -- sampling --
+
+    def _ensure_sampler(self) -> None:
+        if self._sampler is None or not self._sampler.is_alive():
+            self._sampler = threading.Thread(target=self._sample_loop, daemon=True)
+            self._sampler.start()
+
+    def _sample_job(self, job: Job, table: dict) -> None:
+        if job.pgid is None or job.pgid not in table:
+            return
+        rss, ticks = table[job.pgid]
+        now = time.monotonic()
+        if job._last and now > job._last[0]:
+            job.cores = max(0.0, (ticks - job._last[1]) / _CLK_TCK / (now - job._last[0]))
+        job._last = (now, ticks)
+        job.rss = rss
+        job.peak_rss = max(job.peak_rss, rss)
+        job.ticks = max(job.ticks, ticks)
+
+    def _sample_loop(self) -> None:
+        while True:
+            busy, total = _cpu_times()
+            if self._cpu_last and total > self._cpu_last[1]:
+                frac = (busy - self._cpu_last[0]) / (total - self._cpu_last[1])
+                self.busy_cores = frac * (os.cpu_count() or 1)
+            self._cpu_last = (busy, total)
+            jobs = list(self.running)
+            table = pgroup_table() if any(j.pgid is not None for j in jobs) else {}
+            for job in jobs:
+                self._sample_job(job, table)
+            with self.cond:
+                self.cond.notify_all()
+                if not self.running and not self.waiting:
+                    self._sampler = None
+                    return
+            time.sleep(SAMPLE_SEC)
+
+    def metrics(self) -> dict:
+        with self.cond:
+            running = [j.as_dict() for j in self.running]
+            waiting = [j.as_dict() for j in self.waiting]
+        return {
+            "enabled": self.enabled,
+            "limits": {"min_free": self.min_free, "cpu_budget": self.cpu_budget, "max_jobs": self.max_jobs,
+                       "max_wait_sec": self.max_wait},
+            "pinning": {"cores_per_job": self.pin, "nodes": {
+                str(n): {"cpus": sorted(c), "free": sorted(c - self.cpu_owner.keys())} for n, c in self.nodes.items()}},
+            "host": dict(host_snapshot(), busy_cores=round(self.busy_cores, 2)),
+            "running": running,
+            "waiting": waiting,
+            "stats": dict(self.stats),
+            "learned": {f"{k}/{a or '*'}": v for (k, a), v in sorted(self._learned().items(), key=lambda kv: (kv[0][0], kv[0][1] or ""))},
+        }
@@ -1,9 +1,14 @@
 import os, re, sys
+from firmae_lib.scratch import scratch_index
 
 # ---- scratch utils & log analysis helpers ----
+
+# Per-IID logs FirmAE leaves in scratch/<iid>/
+LOG_NAMES = ("makeImage.log", "makeNetwork.log", "qemu.final.serial.log", "emulation.log")
+
 def _numeric_dirs(path: str):
     try:
-        return sorted(int(d) for d in os.listdir(path) if d.isdigit())
+        return scratch_index(path).ids()
     except Exception:
         return []
 
@@ -30,29 +35,30 @@ def _safe_tail(path: str, max_bytes: int = 64_000, max_lines: int = 200) -> str:
     except Exception as e:
         return f"[could not read {path}: {e}]"
 
+# Failure signatures: (reason title, regex, flags)
+SIGNATURE_PATTERNS = [
+    ("Filesystem image build error",
+     r"(mke2fs|e2fsck).*(error|aborted|unable|fail)|No such file or directory.*(root|image)|mount:.*failed", re.I),
+    ("Architecture / binfmt issue",
+     r"(Unknown architecture|binfmt_misc|Exec format error|qemu-.*: Could not open|get architecture.*fail)", re.I),
+    ("QEMU boot/kernel failure",
+     r"(Kernel panic|Unable to mount root|Segmentation fault|qemu: .*error|end Kernel panic)", re.I),
+    ("Network bridging/tap error",
+     r"(tap|bridge|br_add_if|br_dev_ioctl|SIOCSIF).* (fail|error|denied)|Network unreachable", re.I),
+    ("Permission / capability problem",
+     r"(Permission denied|Operation not permitted|cap_net_admin)", re.I),
+    ("Timeout / watchdog",
+     r"\b(timeout|timed out)\b", re.I),
+    ("Web service did not come up",
+     r"(Web service on .* (down|failed)|httpd.*fail|lighttpd.*fail|nginx.*fail)", re.I),
+]
+
 # Heuristic pattern detector: returns list of human-readable reasons
 def _analyze_logs(text_by_name: dict[str, str]) -> list[str]:
     reasons = []
     combined = "\n".join(v for v in text_by_name.values() if v)
 
-    PATTERNS = [
-        ("Filesystem image build error",
-         r"(mke2fs|e2fsck).*(error|aborted|unable|fail)|No such file or directory.*(root|image)|mount:.*failed", re.I),
-        ("Architecture / binfmt issue",
-         r"(Unknown architecture|binfmt_misc|Exec format error|qemu-.*: Could not open|get architecture.*fail)", re.I),
-        ("QEMU boot/kernel failure",
-         r"(Kernel panic|Unable to mount root|Segmentation fault|qemu: .*error|end Kernel panic)", re.I),
-        ("Network bridging/tap error",
-         r"(tap|bridge|br_add_if|br_dev_ioctl|SIOCSIF).* (fail|error|denied)|Network unreachable", re.I),
-        ("Permission / capability problem",
-         r"(Permission denied|Operation not permitted|cap_net_admin)", re.I),
-        ("Timeout / watchdog",
-         r"\b(timeout|timed out)\b", re.I),
-        ("Web service did not come up",
-         r"(Web service on .* (down|failed)|httpd.*fail|lighttpd.*fail|nginx.*fail)", re.I),
-    ]
-
-    for title, pat, flags in PATTERNS:
+    for title, pat, flags in SIGNATURE_PATTERNS:
         if re.search(pat, combined, flags):
             reasons.append(title)
 
@@ -64,15 +70,35 @@ def _analyze_logs(text_by_name: dict[str, str]) -> list[str]:
 
     return sorted(set(reasons))
 
-def _collect_failure_context(scratch_root: str) -> tuple[str | None, dict[str, str]]:
+# Serial-log signatures after which the guest cannot come up any more.
+# Matching one of these means waiting out the timeout is wasted wall time.
+TERMINAL_PATTERNS = [
+    ("Kernel panic",               r"Kernel panic - not syncing"),
+    ("Root filesystem not mounted", r"VFS: Unable to mount root fs"),
+    ("No init found",              r"No (working )?init found"),
+    ("Init killed",                r"Attempted to kill init"),
+]
+
+def _terminal_signature(text: str) -> str | None:
+    """
+    Return the title of the first terminal pattern found in `text`, else None.
+    """
+    if not text:
+        return None
+    for title, pat in TERMINAL_PATTERNS:
+        if re.search(pat, text):
+            return title
+    return None
+
+def _collect_failure_context(scratch_root: str, iid_dir: str | None = None) -> tuple[str | None, dict[str, str]]:
     """
     Returns (iid_dir, texts) where texts maps log name -> tail text.
-    Picks the newest numeric scratch/<iid>.
+    Uses `iid_dir` when the caller knows it, else picks the newest numeric scratch/<iid>.
     """
-    iid_dir = _latest_iid_dir(scratch_root)
+    iid_dir = iid_dir or _latest_iid_dir(scratch_root)
     logs = {}
     if iid_dir:
-        for fname in ("makeImage.log", "makeNetwork.log", "qemu.final.serial.log", "emulation.log"):
+        for fname in LOG_NAMES:
             fpath = os.path.join(iid_dir, fname)
             logs[fname] = _safe_tail(fpath)
     return iid_dir, logs
@@ -0,0 +1,247 @@
+import os, zlib, sqlite3
+from collections import Counter
+from datetime import datetime
+from firmae_lib.sqlite_helper import kb_init, kb_connect
+from firmae_lib.analysis import LOG_NAMES
+
+# zstd is optional; zlib (with a preset dictionary) is the fallback
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+CODEC = "zstd" if zstd else "zlib"
+ZSTD_LEVEL = 19
+ZLIB_LEVEL = 9
+DICT_SIZE = {"zstd": 112_640, "zlib": 32_768}   # zlib's window caps a zdict at 32 KiB
+DICT_MIN_SAMPLES = 8        # archived logs needed before a shared dictionary is trained
+DICT_SAMPLE_LIMIT = 200     # most recent logs used as training samples
+DICT_RETRY_AFTER = 100      # new archived logs before a failed training is retried
+
+def _now() -> str:
+    return datetime.utcnow().isoformat(timespec="seconds") + "Z"
+
+def _init_archive_tables(con) -> None:
+    con.executescript("""
+    CREATE TABLE IF NOT EXISTS log_dicts (
+      id         INTEGER PRIMARY KEY AUTOINCREMENT,
+      codec      TEXT NOT NULL,
+      data       BLOB NOT NULL,
+      samples    INTEGER,
+      created_ts TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS log_archives (
+      id          INTEGER PRIMARY KEY AUTOINCREMENT,
+      run_id      INTEGER REFERENCES runs(id) ON DELETE CASCADE,
+      iid_dir     TEXT,
+      name        TEXT NOT NULL,
+      codec       TEXT NOT NULL,     -- 'zstd' | 'zlib'
+      dict_id     INTEGER REFERENCES log_dicts(id),
+      raw_size    INTEGER NOT NULL,
+      stored_size INTEGER NOT NULL,
+      at_ts       TEXT NOT NULL,
+      data        BLOB NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS log_dict_attempts (
+      codec      TEXT PRIMARY KEY,
+      archive_id INTEGER NOT NULL,   -- newest log_archives.id when training last failed
+      at_ts      TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS log_archives_run ON log_archives(run_id);
+    CREATE INDEX IF NOT EXISTS log_archives_iid ON log_archives(iid_dir);
+    """)
+
+def _compress(raw: bytes, codec: str, dict_data: bytes | None) -> bytes:
+    if codec == "zstd":
+        if zstd is None:
+            raise RuntimeError("zstandard module not installed")
+        d = zstd.ZstdCompressionDict(dict_data) if dict_data else None
+        return zstd.ZstdCompressor(level=ZSTD_LEVEL, dict_data=d).compress(raw)
+    c = zlib.compressobj(ZLIB_LEVEL, zdict=dict_data) if dict_data else zlib.compressobj(ZLIB_LEVEL)
+    return c.compress(raw) + c.flush()
+
+def _decompress(blob: bytes, codec: str, dict_data: bytes | None) -> bytes:
+    if codec == "zstd":
+        if zstd is None:
+            raise RuntimeError("log archived with zstd but the zstandard module is not installed")
+        d = zstd.ZstdCompressionDict(dict_data) if dict_data else None
+        return zstd.ZstdDecompressor(dict_data=d).decompress(blob)
+    d = zlib.decompressobj(zdict=dict_data) if dict_data else zlib.decompressobj()
+    return d.decompress(blob) + d.flush()
+
+def _train_zlib_dict(samples: list[bytes], size: int) -> bytes:
+    """
+    zlib has no trainer: use the most frequent log lines, most common last
+    (zlib matches nearer the end of the dictionary more cheaply).
+    """
+    counts = Counter()
+    for s in samples:
+        counts.update(set(s.splitlines(keepends=True)))
+    picked, total = [], 0
+    for line, n in counts.most_common():
+        if n < 2 or total + len(line) > size:
+            continue
+        picked.append(line)
+        total += len(line)
+    return b"".join(reversed(picked))
+
+def _current_dict(con, codec: str) -> tuple[int | None, bytes | None]:
+    row = con.execute(
+        "SELECT id, data FROM log_dicts WHERE codec = ? ORDER BY id DESC LIMIT 1", (codec,)
+    ).fetchone()
+    return (row[0], row[1]) if row else (None, None)
+
+# (db_path, dict_id) -> dictionary bytes; dictionaries are immutable once stored
+_DICT_CACHE: dict[tuple[str, int], bytes | None] = {}
+
+def _dict_by_id(con, db_path: str, dict_id: int | None) -> bytes | None:
+    if dict_id is None:
+        return None
+    key = (db_path, dict_id)
+    if key not in _DICT_CACHE:
+        row = con.execute("SELECT data FROM log_dicts WHERE id = ?", (dict_id,)).fetchone()
+        _DICT_CACHE[key] = row[0] if row else None
+    return _DICT_CACHE[key]
+
+def _maybe_train(con, db_path: str, codec: str, extra: list[bytes]) -> tuple[int | None, bytes | None]:
+    """
+    Return the codec's shared dictionary, training one from past logs the first
+    time enough samples exist. A failed training is recorded and retried only
+    after DICT_RETRY_AFTER more logs were archived, so runs do not keep paying
+    for decompressing the samples.
+    """
+    dict_id, data = _current_dict(con, codec)
+    if dict_id is not None:
+        return dict_id, data
+    newest = con.execute("SELECT COALESCE(MAX(id), 0) FROM log_archives").fetchone()[0]
+    if newest + len(extra) < DICT_MIN_SAMPLES:
+        return None, None
+    tried = con.execute("SELECT archive_id FROM log_dict_attempts WHERE codec = ?", (codec,)).fetchone()
+    if tried and newest < tried[0] + DICT_RETRY_AFTER:
+        return None, None
+
+    samples = list(extra)
+    for blob, c, d_id in con.execute(
+        "SELECT data, codec, dict_id FROM log_archives ORDER BY id DESC LIMIT ?", (DICT_SAMPLE_LIMIT,)
+    ):
+        try:
+            samples.append(_decompress(blob, c, _dict_by_id(con, db_path, d_id)))
+        except Exception:
+            continue
+    samples = [s for s in samples if s]
+    data = None
+    if len(samples) >= DICT_MIN_SAMPLES:   # fewer when older archives cannot be read back
+        try:
+            if codec == "zstd":
+                # zstd's trainer fails when the target is large next to the corpus
+                size = min(DICT_SIZE["zstd"], max(4096, sum(map(len, samples)) // 20))
+                data = zstd.train_dictionary(size, samples).as_bytes()
+            else:
+                data = _train_zlib_dict(samples, DICT_SIZE["zlib"])
+        except Exception:
+            data = None
+    if not data:
+        con.execute(
+            "INSERT OR REPLACE INTO log_dict_attempts(codec, archive_id, at_ts) VALUES (?, ?, ?)",
+            (codec, newest, _now())
+        )
+        return None, None
+    cur = con.execute(
+        "INSERT INTO log_dicts(codec, data, samples, created_ts) VALUES (?, ?, ?, ?)",
+        (codec, data, len(samples), _now())
+    )
+    return cur.lastrowid, data
+
+def kb_archive_logs(db_path: str, iid_dir: str, run_id: int | None = None, names: tuple[str, ...] = LOG_NAMES) -> list[dict]:
+    """
+    Compress the full scratch/<iid>/ logs into log_archives, linked to runs.id
+    (default: the latest run recorded for this iid_dir). Logs already archived
+    for that run are skipped; FirmAE reuses an IID when a firmware is run
+    again, so the same iid_dir holds the logs of several runs. Without a run,
+    a log is skipped if the same iid_dir/name/size is already archived
+    unlinked. Returns one dict per stored log.
+    """
+    if not iid_dir or not os.path.isdir(iid_dir):
+        return []
+    raws = {}
+    for name in names:
+        path = os.path.join(iid_dir, name)
+        try:
+            with open(path, "rb") as f:
+                raws[name] = f.read()
+        except OSError:
+            continue
+    if not raws:
+        return []
+
+    kb_init(db_path)
+    con = kb_connect(db_path)
+    try:
+        _init_archive_tables(con)
+        if run_id is None:
+            row = con.execute("SELECT MAX(id) FROM runs WHERE iid_dir = ?", (iid_dir,)).fetchone()
+            run_id = row[0] if row else None
+        if run_id is not None:
+            done = {r[0] for r in con.execute("SELECT name FROM log_archives WHERE run_id = ?", (run_id,))}
+        else:
+            done = {r[0] for r in con.execute(
+                "SELECT name || '/' || raw_size FROM log_archives WHERE iid_dir = ? AND run_id IS NULL", (iid_dir,)
+            )}
+        raws = {k: v for k, v in raws.items() if k not in done and f"{k}/{len(v)}" not in done}
+        if not raws:
+            return []
+        dict_id, dict_data = _maybe_train(con, db_path, CODEC, list(raws.values()))
+
+        stored = []
+        for name, raw in raws.items():
+            blob = _compress(raw, CODEC, dict_data)
+            cur = con.execute("""
+              INSERT INTO log_archives(run_id, iid_dir, name, codec, dict_id, raw_size, stored_size, at_ts, data)
+              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (run_id, iid_dir, name, CODEC, dict_id, len(raw), len(blob), _now(), blob))
+            stored.append({"id": cur.lastrowid, "name": name, "raw_size": len(raw), "stored_size": len(blob)})
+        con.commit()
+        return stored
+    finally:
+        con.close()
+
+def kb_list_archived_logs(db_path: str, *, run_id: int | None = None, iid_dir: str | None = None) -> list[dict]:
+    """
+    Archive metadata only; blobs are not read or decompressed.
+    """
+    kb_init(db_path)
+    where, params = [], []
+    if run_id is not None:
+        where.append("run_id = ?")
+        params.append(int(run_id))
+    if iid_dir:
+        where.append("iid_dir = ?")
+        params.append(iid_dir)
+    con = kb_connect(db_path)
+    con.row_factory = sqlite3.Row
+    try:
+        _init_archive_tables(con)
+        rows = con.execute(
+            "SELECT id, run_id, iid_dir, name, codec, dict_id, raw_size, stored_size, at_ts FROM log_archives"
+            + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY id", params
+        ).fetchall()
+        return [dict(r) for r in rows]
+    finally:
+        con.close()
+
+def kb_read_archived_log(db_path: str, archive_id: int) -> str:
+    """
+    Decompress one archived log on demand.
+    """
+    kb_init(db_path)
+    con = kb_connect(db_path)
+    try:
+        _init_archive_tables(con)
+        row = con.execute("SELECT data, codec, dict_id FROM log_archives WHERE id = ?", (int(archive_id),)).fetchone()
+        if not row:
+            raise KeyError(f"no archived log with id {archive_id}")
+        blob, codec, dict_id = row
+        return _decompress(blob, codec, _dict_by_id(con, db_path, dict_id)).decode("utf-8", "replace")
+    finally:
+        con.close()
@@ -0,0 +1,243 @@
+import os, csv, hashlib, sqlite3, threading
+from datetime import datetime
+from firmae_lib.sqlite_helper import kb_init, kb_connect, _norm_brand, _norm_model
+
+# ---- multi-brand model catalog: kb/*.csv (brand,model,aliases) -> KB tables ----
+# kb_brands / kb_models / kb_aliases hold the catalog with normalized keys
+# (indexed, for exact and prefix lookups); kb_models_fts indexes each model's
+# normalized name and aliases with the FTS5 trigram tokenizer for substring
+# and fuzzy (shared-trigram) matches. A CSV is re-imported only when its
+# sha256 changes, and only once per process; the parsed rows are cached for
+# the model-name trie (models.py). Aliases are ';'-separated.
+
+CATALOG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "kb")
+FUZZY_MIN   = 0.4   # share of the query's trigrams a fuzzy match must contain
+
+_ENTRIES: list[tuple[str, str, list[str]]] | None = None
+_LOADED: set[str] = set()
+_LOCK = threading.Lock()
+
+def _catalog_files(kb_dir: str) -> list[str]:
+    try:
+        return sorted(os.path.join(kb_dir, f) for f in os.listdir(kb_dir) if f.endswith(".csv"))
+    except OSError:
+        return []
+
+def _read_csv(path: str) -> list[tuple[str, str, list[str]]]:
+    out = []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            brand, model = (row.get("brand") or "").strip(), " ".join((row.get("model") or "").split())
+            if not brand or not model:
+                continue
+            aliases = [" ".join(a.split()) for a in (row.get("aliases") or "").split(";") if a.strip()]
+            out.append((brand.upper(), model, aliases))
+    return out
+
+def catalog_entries(kb_dir: str = CATALOG_DIR) -> list[tuple[str, str, list[str]]]:
+    """
+    (brand, model, aliases) of every catalog CSV, parsed once per process.
+    """
+    global _ENTRIES
+    if _ENTRIES is None:
+        with _LOCK:
+            if _ENTRIES is None:
+                entries = []
+                for path in _catalog_files(kb_dir):
+                    try:
+                        entries += _read_csv(path)
+                    except (OSError, csv.Error):
+                        continue
+                _ENTRIES = entries
+    return _ENTRIES
+
+def _init_catalog_tables(con) -> None:
+    con.executescript("""
+    CREATE TABLE IF NOT EXISTS kb_brands (
+      id   INTEGER PRIMARY KEY AUTOINCREMENT,
+      name TEXT NOT NULL,
+      norm TEXT NOT NULL UNIQUE
+    );
+
+    CREATE TABLE IF NOT EXISTS kb_models (
+      id         INTEGER PRIMARY KEY AUTOINCREMENT,
+      brand_id   INTEGER NOT NULL REFERENCES kb_brands(id),
+      model      TEXT NOT NULL,
+      model_norm TEXT NOT NULL,
+      source     TEXT,
+      UNIQUE (brand_id, model_norm)
+    );
+    CREATE INDEX IF NOT EXISTS kb_models_norm ON kb_models(model_norm);
+
+    CREATE TABLE IF NOT EXISTS kb_aliases (
+      alias_norm TEXT NOT NULL,
+      model_id   INTEGER NOT NULL REFERENCES kb_models(id) ON DELETE CASCADE,
+      alias      TEXT NOT NULL,
+      PRIMARY KEY (alias_norm, model_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS kb_aliases_model ON kb_aliases(model_id);
+
+    CREATE TABLE IF NOT EXISTS kb_catalog_sources (
+      path      TEXT PRIMARY KEY,
+      sha256    TEXT NOT NULL,
+      models    INTEGER NOT NULL,
+      loaded_at TEXT NOT NULL
+    );
+    """)
+    try:
+        con.execute("CREATE VIRTUAL TABLE IF NOT EXISTS kb_models_fts USING fts5(keys, tokenize='trigram')")
+    except sqlite3.OperationalError:
+        pass   # SQLite < 3.34: exact/prefix lookups only
+
+def _has_fts(con) -> bool:
+    return bool(con.execute("SELECT 1 FROM sqlite_master WHERE name = 'kb_models_fts'").fetchone())
+
+def _import_file(con, path: str, rows: list[tuple[str, str, list[str]]], fts: bool) -> None:
+    source = os.path.basename(path)
+    old = [r[0] for r in con.execute("SELECT id FROM kb_models WHERE source = ?", (source,))]
+    if old:
+        marks = ",".join("?" * len(old))
+        con.execute(f"DELETE FROM kb_aliases WHERE model_id IN ({marks})", old)
+        if fts:
+            con.execute(f"DELETE FROM kb_models_fts WHERE rowid IN ({marks})", old)
+        con.execute(f"DELETE FROM kb_models WHERE id IN ({marks})", old)
+    brands = {}
+    for brand, model, aliases in rows:
+        bnorm = _norm_brand(brand)
+        if bnorm not in brands:
+            con.execute("INSERT OR IGNORE INTO kb_brands(name, norm) VALUES (?, ?)", (brand, bnorm))
+            brands[bnorm] = con.execute("SELECT id FROM kb_brands WHERE norm = ?", (bnorm,)).fetchone()[0]
+        cur = con.execute(
+            "INSERT OR IGNORE INTO kb_models(brand_id, model, model_norm, source) VALUES (?, ?, ?, ?)",
+            (brands[bnorm], model, _norm_model(model), source)
+        )
+        if not cur.rowcount:
+            continue   # same model listed twice (or by another file)
+        model_id = cur.lastrowid
+        con.executemany(
+            "INSERT OR IGNORE INTO kb_aliases(alias_norm, model_id, alias) VALUES (?, ?, ?)",
+            [(_norm_model(a), model_id, a) for a in aliases if _norm_model(a)]
+        )
+        if fts:
+            keys = " ".join([_norm_model(model)] + [_norm_model(a) for a in aliases])
+            con.execute("INSERT INTO kb_models_fts(rowid, keys) VALUES (?, ?)", (model_id, keys))
+
+def kb_load_catalog(db_path: str, kb_dir: str = CATALOG_DIR) -> None:
+    """
+    Import new or changed catalog CSVs into the KB (once per process and KB).
+    """
+    if db_path in _LOADED:
+        return
+    with _LOCK:
+        if db_path in _LOADED:
+            return
+        kb_init(db_path)
+        con = kb_connect(db_path)
+        try:
+            _init_catalog_tables(con)
+            fts = _has_fts(con)
+            for path in _catalog_files(kb_dir):
+                try:
+                    with open(path, "rb") as f:
+                        digest = hashlib.sha256(f.read()).hexdigest()
+                    row = con.execute("SELECT sha256 FROM kb_catalog_sources WHERE path = ?", (os.path.basename(path),)).fetchone()
+                    if row and row[0] == digest:
+                        continue
+                    rows = _read_csv(path)
+                except (OSError, csv.Error):
+                    continue
+                _import_file(con, path, rows, fts)
+                con.execute(
+                    "INSERT OR REPLACE INTO kb_catalog_sources(path, sha256, models, loaded_at) VALUES (?, ?, ?, ?)",
+                    (os.path.basename(path), digest, len(rows), datetime.utcnow().isoformat(timespec="seconds") + "Z")
+                )
+            con.commit()
+        finally:
+            con.close()
+        _LOADED.add(db_path)
+
+def _trigrams(s: str) -> set[str]:
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+def kb_catalog_brands(db_path: str) -> list[tuple[str, int]]:
+    """
+    (brand, model count) for every brand in the catalog.
+    """
+    kb_load_catalog(db_path)
+    con = kb_connect(db_path)
+    try:
+        return con.execute("""
+          SELECT b.name, COUNT(m.id) FROM kb_brands b LEFT JOIN kb_models m ON m.brand_id = b.id
+          GROUP BY b.id ORDER BY b.name
+        """).fetchall()
+    finally:
+        con.close()
+
+def kb_lookup_models(db_path: str, *, brand: str | None = None, query: str | None = None, limit: int = 20) -> tuple[int | None, list[dict]]:
+    """
+    Catalog models of `brand` (all brands if None) matching `query`: exact
+    model or alias first, then prefix, substring and fuzzy (trigram) matches.
+    Without a query, the brand's models alphabetically.
+    Returns (total or None when unknown, [{brand, model, aliases, match}]).
+    """
+    kb_load_catalog(db_path)
+    con = kb_connect(db_path)
+    con.row_factory = sqlite3.Row
+    try:
+        where, params = [], []
+        if brand:
+            where.append("b.norm = ?")
+            params.append(_norm_brand(brand))
+        q = _norm_model(query)
+
+        def public(r: dict) -> dict:
+            return {k: v for k, v in r.items() if k != "id"}
+
+        def fetch(cond: str, args: list, order: str = "m.model_norm", n: int = limit) -> list[sqlite3.Row]:
+            conds = where + ([cond] if cond else [])
+            return con.execute(f"""
+              SELECT m.id, b.name AS brand, m.model,
+                     (SELECT GROUP_CONCAT(alias, '; ') FROM kb_aliases WHERE model_id = m.id) AS aliases
+              FROM kb_models m JOIN kb_brands b ON b.id = m.brand_id
+              {"WHERE " + " AND ".join(conds) if conds else ""}
+              ORDER BY {order} LIMIT ?
+            """, params + args + [n]).fetchall()
+
+        if not q:
+            total = con.execute(
+                "SELECT COUNT(*) FROM kb_models m JOIN kb_brands b ON b.id = m.brand_id"
+                + (" WHERE " + " AND ".join(where) if where else ""), params
+            ).fetchone()[0]
+            return total, [public(dict(r, match="list")) for r in fetch("", [], order="b.name, m.model")]
+
+        stages = [
+            ("exact", "(m.model_norm = ? OR m.id IN (SELECT model_id FROM kb_aliases WHERE alias_norm = ?))", [q, q]),
+            ("prefix", "(m.model_norm >= ? AND m.model_norm < ? OR m.id IN "
+                       "(SELECT model_id FROM kb_aliases WHERE alias_norm >= ? AND alias_norm < ?))", [q, q + "~", q, q + "~"]),
+        ]
+        fts = _has_fts(con)
+        if fts and len(q) >= 3:
+            stages.append(("substring", "m.id IN (SELECT rowid FROM kb_models_fts WHERE keys LIKE ?)", [f"%{q}%"]))
+        out, seen = [], set()
+        for how, cond, args in stages:
+            for r in fetch(cond, args):
+                if r["id"] not in seen and len(out) < limit:
+                    seen.add(r["id"])
+                    out.append(dict(r, match=how))
+        if fts and len(q) >= 3 and len(out) < limit:
+            grams = _trigrams(q)
+            hits = con.execute(
+                "SELECT rowid, keys FROM kb_models_fts WHERE kb_models_fts MATCH ? ORDER BY rank LIMIT ?",
+                (" OR ".join(f'"{g}"' for g in sorted(grams)), limit * 5)
+            ).fetchall()
+            shared = {h["rowid"]: max(len(grams & _trigrams(k)) for k in h["keys"].split())
+                      for h in hits if h["rowid"] not in seen}
+            close = sorted((mid for mid, n in shared.items() if n >= FUZZY_MIN * len(grams)), key=lambda mid: -shared[mid])
+            if close:
+                rows = {r["id"]: r for r in fetch(f"m.id IN ({','.join('?' * len(close))})", close, n=len(close))}
+                for mid in close:
+                    if mid in rows and len(out) < limit:
+                        out.append(dict(rows[mid], match="fuzzy"))
+        return None, [public(r) for r in out]
+    finally:
+        con.close()
@@ -0,0 +1,222 @@
+import re, json, hashlib, sqlite3
+from datetime import datetime
+from firmae_lib.sqlite_helper import kb_init, _norm_brand, kb_connect
+
+# ---- failure fingerprints: masked log tails -> 64-bit SimHash -> LSH clusters ----
+
+# Order matters: specific shapes first, bare numbers last
+MASKS = [
+    (re.compile(r"\[\s*\d+\.\d+\]"), "<TS>"),                                        # [    0.853475]
+    (re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(\.\d+)?Z?"), "<TS>"),       # ISO timestamps
+    (re.compile(r"\b\d{2}:\d{2}:\d{2}\b"), "<TS>"),
+    (re.compile(r"\b\d{1,3}(\.\d{1,3}){3}(:\d+)?\b"), "<IP>"),
+    (re.compile(r"\b([0-9a-f]{2}:){5}[0-9a-f]{2}\b", re.I), "<MAC>"),
+    (re.compile(r"\b(pid|PID)[:=\s]+\d+"), "PID <PID>"),
+    (re.compile(r"\b0x[0-9a-f]+\b", re.I), "<ADDR>"),
+    (re.compile(r"\b[0-9a-f]{8,}\b", re.I), "<ADDR>"),
+    (re.compile(r"\d+"), "<N>"),
+]
+
+BANDS = 4            # 4 x 16-bit bands
+HAMMING_MAX = 3      # < BANDS, so near-duplicates always share at least one band
+SHINGLE = 3
+
+def _mask_log(text: str) -> str:
+    for pat, repl in MASKS:
+        text = pat.sub(repl, text)
+    return text
+
+def _features(texts: dict[str, str]) -> set[str]:
+    """
+    Word shingles over masked, de-duplicated log lines (per log name).
+    """
+    feats = set()
+    for name, text in texts.items():
+        if not text:
+            continue
+        seen = set()
+        for line in _mask_log(text).splitlines():
+            line = " ".join(line.split())
+            if not line or line in seen:
+                continue
+            seen.add(line)
+            words = line.split()
+            if len(words) < SHINGLE:
+                feats.add(f"{name}|{line}")
+                continue
+            for i in range(len(words) - SHINGLE + 1):
+                feats.add(f"{name}|{' '.join(words[i:i + SHINGLE])}")
+    return feats
+
+def _simhash64(features: set[str]) -> int:
+    if not features:
+        return 0
+    acc = [0] * 64
+    for feat in features:
+        h = int.from_bytes(hashlib.blake2b(feat.encode("utf-8", "replace"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            acc[bit] += 1 if (h >> bit) & 1 else -1
+    return sum(1 << bit for bit in range(64) if acc[bit] > 0)
+
+def _bands(h: int) -> list[int]:
+    width = 64 // BANDS
+    return [(h >> (i * width)) & ((1 << width) - 1) for i in range(BANDS)]
+
+def _to_signed(h: int) -> int:
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+def _to_unsigned(h: int) -> int:
+    return h + (1 << 64) if h < 0 else h
+
+def _init_cluster_tables(con) -> None:
+    con.executescript("""
+    CREATE TABLE IF NOT EXISTS failure_clusters (
+      id                    INTEGER PRIMARY KEY AUTOINCREMENT,
+      simhash               INTEGER NOT NULL,
+      representative_run_id INTEGER REFERENCES runs(id) ON DELETE SET NULL,
+      title                 TEXT,
+      first_ts              TEXT,
+      last_ts               TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS failure_fingerprints (
+      run_id     INTEGER PRIMARY KEY REFERENCES runs(id) ON DELETE CASCADE,
+      cluster_id INTEGER NOT NULL REFERENCES failure_clusters(id),
+      simhash    INTEGER NOT NULL,
+      band0      INTEGER NOT NULL,
+      band1      INTEGER NOT NULL,
+      band2      INTEGER NOT NULL,
+      band3      INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS failure_fp_band0 ON failure_fingerprints(band0);
+    CREATE INDEX IF NOT EXISTS failure_fp_band1 ON failure_fingerprints(band1);
+    CREATE INDEX IF NOT EXISTS failure_fp_band2 ON failure_fingerprints(band2);
+    CREATE INDEX IF NOT EXISTS failure_fp_band3 ON failure_fingerprints(band3);
+    CREATE INDEX IF NOT EXISTS failure_fp_cluster ON failure_fingerprints(cluster_id);
+    """)
+
+def _assign(con, run_id: int, texts: dict[str, str], title: str | None) -> tuple[int, bool]:
+    h = _simhash64(_features(texts))
+    bands = _bands(h)
+    now = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+
+    best = None
+    rows = con.execute(
+        "SELECT cluster_id, simhash FROM failure_fingerprints "
+        "WHERE band0 = ? OR band1 = ? OR band2 = ? OR band3 = ?", bands
+    ).fetchall()
+    for cluster_id, other in rows:
+        dist = bin(h ^ _to_unsigned(other)).count("1")
+        if dist <= HAMMING_MAX and (best is None or dist < best[1]):
+            best = (cluster_id, dist)
+
+    if best:
+        cluster_id, is_new = best[0], False
+        con.execute("UPDATE failure_clusters SET last_ts = ? WHERE id = ?", (now, cluster_id))
+    else:
+        cur = con.execute(
+            "INSERT INTO failure_clusters(simhash, representative_run_id, title, first_ts, last_ts) "
+            "VALUES (?, ?, ?, ?, ?)", (_to_signed(h), run_id, title, now, now)
+        )
+        cluster_id, is_new = cur.lastrowid, True
+
+    con.execute(
+        "INSERT OR REPLACE INTO failure_fingerprints(run_id, cluster_id, simhash, band0, band1, band2, band3) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)", (run_id, cluster_id, _to_signed(h), *bands)
+    )
+    return cluster_id, is_new
+
+def kb_assign_cluster(db_path: str, run_id: int, texts: dict[str, str], title: str | None = None) -> tuple[int, bool]:
+    """
+    Fingerprint one failed run's log tails and file it under the nearest
+    cluster (Hamming distance <= HAMMING_MAX), creating a cluster if none is close.
+    Returns (cluster_id, is_new).
+    """
+    kb_init(db_path)
+    con = kb_connect(db_path)
+    try:
+        _init_cluster_tables(con)
+        result = _assign(con, run_id, texts, title)
+        con.commit()
+        return result
+    finally:
+        con.close()
+
+_TAIL_HEADER = re.compile(r"^--- (\S+) \(tail\) ---$", re.M)
+
+def _texts_from_analysis(content: str) -> dict[str, str]:
+    """
+    Split a stored heuristic analysis back into {log name: tail}, as built by firmae.emulate.
+    """
+    parts = _TAIL_HEADER.split(content or "")
+    return {parts[i]: parts[i + 1].strip("\n") for i in range(1, len(parts) - 1, 2)}
+
+def _titles_from_reasons(reasons_json: str | None) -> str | None:
+    try:
+        reasons = (json.loads(reasons_json) or {}).get("reasons") or []
+    except Exception:
+        return None
+    return ", ".join(reasons) if reasons else None
+
+def kb_backfill_clusters(db_path: str, limit: int = 5000) -> int:
+    """
+    Fingerprint failed runs that predate clustering, from their stored heuristic analysis text.
+    Returns how many runs were assigned.
+    """
+    kb_init(db_path)
+    con = kb_connect(db_path)
+    try:
+        _init_cluster_tables(con)
+        rows = con.execute("""
+          SELECT r.id, a.content, a.reasons_json
+          FROM runs r
+          JOIN analyses a ON a.run_id = r.id AND a.source = 'heuristic'
+          LEFT JOIN failure_fingerprints f ON f.run_id = r.id
+          WHERE r.result_bool = 0 AND f.run_id IS NULL
+          GROUP BY r.id
+          ORDER BY r.id
+          LIMIT ?
+        """, (limit,)).fetchall()
+        for run_id, content, reasons_json in rows:
+            texts = _texts_from_analysis(content) or {"analysis": content or ""}
+            _assign(con, run_id, texts, _titles_from_reasons(reasons_json))
+        con.commit()
+        return len(rows)
+    finally:
+        con.close()
+
+def kb_list_clusters(db_path: str, *, brand: str | None = None, limit: int = 20, offset: int = 0, samples: int = 5) -> list[dict]:
+    """
+    Clusters ordered by member count, each with its representative run and a few recent member run ids.
+    With `brand`, only members of that brand are counted and listed.
+    """
+    kb_init(db_path)
+    cond, params = "r.brand_norm = ?", [_norm_brand(brand)] if brand else []
+    con = kb_connect(db_path)
+    con.row_factory = sqlite3.Row
+    try:
+        _init_cluster_tables(con)
+        rows = con.execute(f"""
+          SELECT c.id, c.title, c.first_ts, c.last_ts, c.representative_run_id,
+                 COUNT(f.run_id) AS members,
+                 rep.firmware AS rep_firmware, rep.brand AS rep_brand
+          FROM failure_clusters c
+          JOIN failure_fingerprints f ON f.cluster_id = c.id
+          JOIN runs r ON r.id = f.run_id
+          LEFT JOIN runs rep ON rep.id = c.representative_run_id
+          {"WHERE " + cond if brand else ""}
+          GROUP BY c.id
+          ORDER BY members DESC, c.last_ts DESC
+          LIMIT ? OFFSET ?
+        """, params + [int(limit), int(offset)]).fetchall()
+        out = []
+        for r in rows:
+            d = dict(r)
+            d["recent_runs"] = [x[0] for x in con.execute(f"""
+              SELECT f.run_id FROM failure_fingerprints f JOIN runs r ON r.id = f.run_id
+              WHERE f.cluster_id = ? {"AND " + cond if brand else ""} ORDER BY f.run_id DESC LIMIT ?
+            """, [r["id"]] + params + [samples])]
+            out.append(d)
+        return out
+    finally:
+        con.close()
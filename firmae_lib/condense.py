@@ -0,0 +1,208 @@
+import os, re, json, math, hashlib
+from firmae_lib.analysis import SIGNATURE_PATTERNS, TERMINAL_PATTERNS, LOG_NAMES
+from firmae_lib.clusters import _mask_log, _texts_from_analysis
+from firmae_lib.sqlite_helper import kb_init, kb_connect, kb_insert_analysis
+
+# ---- token-budgeted condensation of failure logs (input for LLM analysis) ----
+# 1. runs of stack-dump / register lines collapse to their first frames
+# 2. lines equal after masking (timestamps, addresses, PIDs) merge with a count
+# 3. lines score by closeness to signature hits (SIGNATURE_PATTERNS, TERMINAL_PATTERNS)
+#    and error words, plus a little for recency
+# 4. the best lines are packed, in log order, into FIRMAE_CONDENSE_TOKENS tokens
+# Results are cached in analyses with source 'condensed'.
+
+DEFAULT_BUDGET  = 2000
+CHARS_PER_TOKEN = 4        # rough estimate; avoids depending on a tokenizer
+MAX_LINE        = 300      # longer lines are cut before packing
+STACK_KEEP      = 3        # frames kept from each collapsed stack dump
+DECAY           = 4.0      # a hit's weight halves every DECAY lines away from it
+HIT_WEIGHT      = 10.0
+TERMINAL_WEIGHT = 12.0
+WORD_WEIGHT     = 3.0
+
+_TS_PREFIX = re.compile(r"^\[\s*\d+\.\d+\]\s*")
+_STACK = re.compile(
+    r"^(\[<[0-9a-f]+>\]|Call Trace:|Stack\s*:|Code:|Backtrace:|Function entered at|Exception stack"
+    r"|\$\s?\d+\s*:|(epc|ra|Status|Cause|BadVA|PrId|Hi|Lo|Modules linked in)\s*:"
+    r"|(r\d+|sp|lr|pc|ip|fp|psr)\s*:\s*[0-9a-f]{8}"
+    r"|\(?[0-9a-f]{8}\)?(\s+\(?[0-9a-f]{8}\)?){3,})", re.I)
+_WORDS = re.compile(r"\b(error|fail(ed|ure)?|fatal|warn(ing)?|denied|not found|unable|cannot|can't|oops|bug|segfault|abort(ed)?)\b", re.I)
+_SIGNATURES = ([(re.compile(p, f), HIT_WEIGHT) for _, p, f in SIGNATURE_PATTERNS]
+               + [(re.compile(p), TERMINAL_WEIGHT) for _, p in TERMINAL_PATTERNS])
+
+def budget_from_env() -> int:
+    try:
+        return max(100, int(os.environ.get("FIRMAE_CONDENSE_TOKENS") or DEFAULT_BUDGET))
+    except ValueError:
+        return DEFAULT_BUDGET
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def _entries(text: str) -> tuple[list[dict], int]:
+    """
+    Distinct lines of one log in first-seen order: {text, count, pos}. Stack
+    dumps are collapsed first. Returns (entries, raw line count).
+    """
+    raw = [l.rstrip() for l in text.splitlines() if l.strip()]
+    collapsed, i = [], 0
+    while i < len(raw):
+        j = i
+        while j < len(raw) and _STACK.match(_TS_PREFIX.sub("", raw[j]).lstrip()):
+            j += 1
+        if j - i > STACK_KEEP + 1:
+            collapsed += raw[i:i + STACK_KEEP + 1]
+            collapsed.append(f"[... {j - i - STACK_KEEP - 1} more stack/register lines]")
+            i = j
+        elif j > i:
+            collapsed += raw[i:j]
+            i = j
+        else:
+            collapsed.append(raw[i])
+            i += 1
+
+    by_key, out = {}, []
+    for line in collapsed:
+        key = " ".join(_mask_log(_TS_PREFIX.sub("", line)).split())
+        if key in by_key:
+            by_key[key]["count"] += 1
+            continue
+        entry = {"text": line if len(line) <= MAX_LINE else line[:MAX_LINE] + " [...]", "count": 1, "pos": len(out)}
+        by_key[key] = entry
+        out.append(entry)
+    return out, len(raw)
+
+def _score(entries: list[dict]) -> None:
+    hits = []
+    for e in entries:
+        w = max((wt for pat, wt in _SIGNATURES if pat.search(e["text"])), default=0.0)
+        if not w and _WORDS.search(e["text"]):
+            w = WORD_WEIGHT
+        if w:
+            hits.append((e["pos"], w))
+    n = max(1, len(entries))
+    for e in entries:
+        near = max((w * 0.5 ** (abs(e["pos"] - p) / DECAY) for p, w in hits), default=0.0)
+        e["score"] = near + 0.5 * (e["pos"] + 1) / n
+
+def _pack(texts: dict[str, str], reasons: list[str] | None, budget: int) -> tuple[str, list[str], dict, int]:
+    """
+    Score every distinct line and keep the best that fit in `budget` tokens.
+    Returns (header, log names, {name: {entries, raw, kept}}, raw line count).
+    """
+    names = [n for n in LOG_NAMES if texts.get(n)] + sorted(n for n in texts if n not in LOG_NAMES and texts[n])
+    header = "Reasons: " + (", ".join(reasons) if reasons else "no signature matched")
+    used = estimate_tokens(header) + 1
+    per_log, pool, lines_in = {}, [], 0
+    for name in names:
+        entries, raw = _entries(texts[name])
+        lines_in += raw
+        _score(entries)
+        per_log[name] = {"entries": entries, "raw": raw, "kept": []}
+        pool += [(e["score"], name, e) for e in entries]
+
+    for _, name, e in sorted(pool, key=lambda t: -t[0]):
+        log = per_log[name]
+        line = (f"[x{e['count']}] " if e["count"] > 1 else "") + e["text"]
+        cost = estimate_tokens(line) + 1
+        if not log["kept"]:
+            cost += 12  # section header
+        if used + cost > budget:
+            continue
+        used += cost
+        e["line"] = line
+        log["kept"].append(e)
+    return header, names, per_log, lines_in
+
+def condensed_lines(texts: dict[str, str], reasons: list[str] | None = None, budget: int | None = None) -> list[str]:
+    """
+    Just the lines condense_logs would keep (without counts or markers), best first.
+    """
+    _, names, per_log, _ = _pack(texts, reasons, budget or budget_from_env())
+    kept = [e for name in names for e in per_log[name]["kept"]]
+    return [e["text"] for e in sorted(kept, key=lambda e: -e["score"])]
+
+def condense_logs(texts: dict[str, str], reasons: list[str] | None = None, budget: int | None = None) -> tuple[str, dict]:
+    """
+    Pack failure logs into roughly `budget` tokens. Returns (text, stats).
+    """
+    budget = budget or budget_from_env()
+    header, names, per_log, lines_in = _pack(texts, reasons, budget)
+    parts = [header]
+    for name in names:
+        log = per_log[name]
+        if not log["kept"]:
+            continue
+        parts.append(f"\n=== {name}: {len(log['kept'])} of {len(log['entries'])} distinct lines ({log['raw']} total) ===")
+        prev = -1
+        for e in sorted(log["kept"], key=lambda e: e["pos"]):
+            if e["pos"] > prev + 1:
+                parts.append("...")
+            parts.append(e["line"])
+            prev = e["pos"]
+        if prev < len(log["entries"]) - 1:
+            parts.append("...")
+    text = "\n".join(parts)
+    lines_out = sum(len(l["kept"]) for l in per_log.values())
+    return text, {"budget": budget, "tokens": estimate_tokens(text), "lines_in": lines_in, "lines_out": lines_out}
+
+def _input_hash(texts: dict[str, str], reasons: list[str] | None, budget: int) -> str:
+    blob = json.dumps([budget, sorted(reasons or []), sorted((k, v) for k, v in texts.items() if v)], ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+def kb_condense_run(db_path: str, run_id: int, texts: dict[str, str], reasons: list[str] | None = None,
+                    budget: int | None = None) -> dict:
+    """
+    Condensed context for a run, reused from analyses (source 'condensed') when
+    the same logs were already condensed under the same budget.
+    Returns {text, tokens, budget, lines_in, lines_out, input_sha256, analysis_id, cached}.
+    """
+    budget = budget or budget_from_env()
+    digest = _input_hash(texts, reasons, budget)
+    kb_init(db_path)
+    con = kb_connect(db_path)
+    try:
+        rows = con.execute(
+            "SELECT id, content, reasons_json FROM analyses WHERE run_id = ? AND source = 'condensed' ORDER BY id DESC",
+            (run_id,)
+        ).fetchall()
+    finally:
+        con.close()
+    for aid, content, meta_json in rows:
+        try:
+            meta = json.loads(meta_json or "{}")
+        except ValueError:
+            continue
+        if meta.get("input_sha256") == digest:
+            return dict(meta, text=content, analysis_id=aid, cached=True)
+
+    text, stats = condense_logs(texts, reasons, budget)
+    meta = dict(stats, reasons=reasons or [], input_sha256=digest)
+    aid = kb_insert_analysis(
+        db_path, run_id=run_id, source="condensed",
+        summary=f"Condensed failure context ({stats['tokens']}/{budget} tokens, {stats['lines_out']} of {stats['lines_in']} lines)",
+        content=text, reasons_json=meta,
+    )
+    return dict(meta, text=text, analysis_id=aid, cached=False)
+
+def kb_condense_stored(db_path: str, run_id: int, budget: int | None = None) -> dict | None:
+    """
+    kb_condense_run over the logs kept in the run's latest heuristic analysis;
+    None if the run has no failure analysis.
+    """
+    kb_init(db_path)
+    con = kb_connect(db_path)
+    try:
+        row = con.execute(
+            "SELECT content, reasons_json FROM analyses WHERE run_id = ? AND source = 'heuristic' ORDER BY id DESC LIMIT 1",
+            (run_id,)
+        ).fetchone()
+    finally:
+        con.close()
+    if not row:
+        return None
+    try:
+        reasons = (json.loads(row[1] or "{}") or {}).get("reasons") or []
+    except ValueError:
+        reasons = []
+    return kb_condense_run(db_path, run_id, _texts_from_analysis(row[0] or ""), reasons, budget)
@@ -0,0 +1,173 @@
+import os, json, sqlite3, threading
+from datetime import datetime
+from firmae_lib.sqlite_helper import kb_init, kb_connect
+from firmae_lib.clusters import _init_cluster_tables
+
+# pyarrow is optional; without it only JSONL export is available
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+BATCH_ROWS = 500
+
+# Serialises exports that read/advance a watermark
+_WATERMARK_LOCK = threading.Lock()
+
+def _bool(v):
+    return None if v is None else bool(v)
+
+def _init_export_tables(con) -> None:
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS export_watermarks (
+      name    TEXT PRIMARY KEY,
+      last_id INTEGER NOT NULL,
+      at_ts   TEXT NOT NULL
+    )
+    """)
+
+def _run_batches(con, since_id: int, batch_rows: int):
+    """
+    Keyset-paginated runs (id > since_id) in batches of `batch_rows`.
+    """
+    last = since_id
+    while True:
+        rows = con.execute(
+            "SELECT * FROM runs WHERE id > ? ORDER BY id LIMIT ?", (last, batch_rows)
+        ).fetchall()
+        if not rows:
+            return
+        last = rows[-1]["id"]
+        yield rows
+
+def _records(con, batches):
+    """
+    Join each batch of runs with its analyses' reasons and failure cluster.
+    """
+    for rows in batches:
+        ids = [r["id"] for r in rows]
+        marks = ",".join("?" * len(ids))
+        reasons: dict[int, list[str]] = {}
+        for run_id, reasons_json in con.execute(
+            f"SELECT run_id, reasons_json FROM analyses WHERE run_id IN ({marks}) AND reasons_json IS NOT NULL", ids
+        ):
+            try:
+                reasons.setdefault(run_id, []).extend((json.loads(reasons_json) or {}).get("reasons") or [])
+            except Exception:
+                pass
+        clusters = dict(con.execute(
+            f"SELECT run_id, cluster_id FROM failure_fingerprints WHERE run_id IN ({marks})", ids
+        ).fetchall())
+        for r in rows:
+            yield {
+                "run_id": r["id"],
+                "ts": r["ts"],
+                "brand": r["brand"],
+                "model": r["model"],
+                "firmware": r["firmware"],
+                "architecture": r["architecture"],
+                "iid_dir": r["iid_dir"],
+                "exit_code": r["exit_code"],
+                "duration_sec": r["duration_sec"],
+                "timeout_sec": r["timeout_sec"],
+                "timeout_reason": r["timeout_reason"],
+                "phases": {
+                    "network": _bool(r["ping_bool"]),
+                    "web": _bool(r["web_bool"]),
+                    "result": _bool(r["result_bool"]),
+                },
+                "reasons": sorted(set(reasons.get(r["id"], []))),
+                "cluster_id": clusters.get(r["id"]),
+            }
+
+def _write_jsonl(records, path: str) -> tuple[int, int | None]:
+    n, last = 0, None
+    with open(path, "w", encoding="utf-8") as f:
+        for rec in records:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            n, last = n + 1, rec["run_id"]
+    return n, last
+
+def _parquet_schema():
+    return pa.schema([
+        ("run_id", pa.int64()), ("ts", pa.string()), ("brand", pa.string()), ("model", pa.string()),
+        ("firmware", pa.string()), ("architecture", pa.string()), ("iid_dir", pa.string()),
+        ("exit_code", pa.int64()), ("duration_sec", pa.float64()),
+        ("timeout_sec", pa.int64()), ("timeout_reason", pa.string()),
+        ("phases", pa.struct([("network", pa.bool_()), ("web", pa.bool_()), ("result", pa.bool_())])),
+        ("reasons", pa.list_(pa.string())), ("cluster_id", pa.int64()),
+    ])
+
+def _write_parquet(records, path: str, batch_rows: int) -> tuple[int, int | None]:
+    schema = _parquet_schema()
+    n, last, buf = 0, None, []
+    with pq.ParquetWriter(path, schema) as writer:
+        for rec in records:
+            buf.append(rec)
+            if len(buf) >= batch_rows:
+                writer.write_table(pa.Table.from_pylist(buf, schema=schema))
+                n, last, buf = n + len(buf), buf[-1]["run_id"], []
+        if buf:
+            writer.write_table(pa.Table.from_pylist(buf, schema=schema))
+            n, last = n + len(buf), buf[-1]["run_id"]
+    return n, last
+
+def kb_export_runs(
+    db_path: str,
+    out_path: str,
+    *,
+    fmt: str = "jsonl",
+    since_id: int | None = None,
+    watermark: str | None = None,
+    batch_rows: int = BATCH_ROWS
+) -> dict:
+    """
+    Stream runs (with phases, reasons and cluster) with id > since_id to `out_path`.
+    With `watermark`, since_id defaults to the stored watermark of that name, and
+    the watermark is advanced to the last exported run id afterwards.
+    Memory stays bounded by `batch_rows`. Returns {rows, since_id, last_id, path, format}.
+    """
+    fmt = (fmt or "jsonl").lower()
+    if fmt == "parquet" and pq is None:
+        raise RuntimeError("parquet export needs pyarrow (pip install pyarrow); use format=jsonl")
+    if fmt not in ("jsonl", "parquet"):
+        raise ValueError(f"unknown export format: {fmt}")
+
+    kb_init(db_path)
+    if watermark:
+        with _WATERMARK_LOCK:
+            return _export(db_path, out_path, fmt, since_id, watermark, batch_rows)
+    return _export(db_path, out_path, fmt, since_id, watermark, batch_rows)
+
+def _export(db_path: str, out_path: str, fmt: str, since_id: int | None, watermark: str | None, batch_rows: int) -> dict:
+    con = kb_connect(db_path)
+    con.row_factory = sqlite3.Row
+    try:
+        _init_export_tables(con)
+        _init_cluster_tables(con)
+        if since_id is None and watermark:
+            row = con.execute("SELECT last_id FROM export_watermarks WHERE name = ?", (watermark,)).fetchone()
+            since_id = row[0] if row else 0
+        since_id = int(since_id or 0)
+
+        os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+        tmp = out_path + ".part"
+        records = _records(con, _run_batches(con, since_id, batch_rows))
+        if fmt == "parquet":
+            n, last = _write_parquet(records, tmp, batch_rows)
+        else:
+            n, last = _write_jsonl(records, tmp)
+        os.replace(tmp, out_path)
+
+        if watermark and last is not None:
+            con.execute(
+                "INSERT INTO export_watermarks(name, last_id, at_ts) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET last_id = excluded.last_id, at_ts = excluded.at_ts",
+                (watermark, last, datetime.utcnow().isoformat(timespec="seconds") + "Z")
+            )
+            con.commit()
+        return {"rows": n, "since_id": since_id, "last_id": last if last is not None else since_id,
+                "path": out_path, "format": fmt}
+    finally:
+        con.close()
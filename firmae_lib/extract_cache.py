@@ -0,0 +1,292 @@
+import os, shutil, tarfile, hashlib, threading
+from datetime import datetime
+from firmae_lib.sqlite_helper import kb_init, kb_connect
+from firmae_lib.quota import _parse_size
+
+# ---- shared extraction cache, keyed by firmware image sha256 ----
+# <root>/<sha256>/rootfs/          located rootfs tree (read-only for consumers)
+# <root>/<sha256>/rootfs.tar.bz2   the same tree packed for EMUX
+# <root>/<sha256>/firmae.tar.gz    FirmAE's images/<iid>.tar.gz, if FirmAE extracted it
+# Holders (an EMUX firmware folder, a FirmAE scratch/<iid>) pin an entry while
+# their path exists; unpinned entries are evicted LRU under FIRMAE_EXTRACT_QUOTA.
+
+_LOCK = threading.Lock()                     # KB rows and the lock table; never held for slow file work
+_ENTRY_LOCKS: dict[str, threading.Lock] = {}  # sha256 -> lock held while that entry's files change
+_SHA_CACHE: dict[tuple[str, int, int], str] = {}
+
+def cache_root(firmae_home: str) -> str:
+    return os.environ.get("FIRMAE_EXTRACT_CACHE") or os.path.join(firmae_home, "extract-cache")
+
+def image_sha256(path: str) -> str:
+    """
+    sha256 of an image file, memoised by (path, size, mtime).
+    """
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if key not in _SHA_CACHE:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        _SHA_CACHE[key] = h.hexdigest()
+    return _SHA_CACHE[key]
+
+def _now() -> str:
+    return datetime.utcnow().isoformat(timespec="seconds") + "Z"
+
+def _link_or_copy(src: str, dst: str) -> None:
+    """Hardlink when on the same filesystem (no extra space), copy otherwise."""
+    tmp = dst + ".part"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+def _du(path: str) -> int:
+    total = 0
+    for r, _, files in os.walk(path):
+        for fn in files:
+            try:
+                total += os.lstat(os.path.join(r, fn)).st_size
+            except OSError:
+                pass
+    return total
+
+def _entry_lock(sha: str) -> threading.Lock:
+    with _LOCK:
+        return _ENTRY_LOCKS.setdefault(sha, threading.Lock())
+
+def _tar_members(tf: tarfile.TarFile, dest: str):
+    """
+    What tarfile's 'tar' filter enforces, for Pythons without extraction
+    filters: leading slashes stripped, nothing written outside `dest` (also
+    through symlinks extracted earlier), setuid/setgid/sticky and group/other
+    write bits cleared.
+    """
+    top = os.path.realpath(dest)
+    for m in tf:
+        m.name = m.name.lstrip("/")
+        target = os.path.realpath(os.path.join(top, m.name))
+        if os.path.commonpath([top, target]) != top:
+            continue
+        if m.islnk() and os.path.commonpath([top, os.path.realpath(os.path.join(top, m.linkname.lstrip("/")))]) != top:
+            continue
+        if m.isfile() or m.isdir():
+            m.mode &= 0o755
+        yield m
+
+def _extract_all(tf: tarfile.TarFile, dest: str) -> None:
+    # members are screened either way: some filter releases still extract a
+    # refused member when errorlevel is 0, which device nodes require here
+    if hasattr(tarfile, "tar_filter"):   # 3.12, 3.11.4, 3.10.12, 3.9.17, 3.8.17 and later
+        tf.extractall(dest, members=_tar_members(tf, dest), filter="tar")
+    else:
+        tf.extractall(dest, members=_tar_members(tf, dest))
+
+def _init_cache_tables(con) -> None:
+    con.executescript("""
+    CREATE TABLE IF NOT EXISTS extraction_cache (
+      sha256       TEXT PRIMARY KEY,
+      image_name   TEXT,
+      created_ts   TEXT NOT NULL,
+      last_used_ts TEXT NOT NULL,
+      hits         INTEGER NOT NULL DEFAULT 0,
+      size_bytes   INTEGER NOT NULL DEFAULT 0,
+      has_rootfs   INTEGER NOT NULL DEFAULT 0,
+      firmae_iid   INTEGER
+    );
+
+    CREATE TABLE IF NOT EXISTS extraction_refs (
+      sha256  TEXT NOT NULL REFERENCES extraction_cache(sha256) ON DELETE CASCADE,
+      holder  TEXT NOT NULL,
+      PRIMARY KEY (sha256, holder)
+    );
+    """)
+
+def _connect(db_path: str):
+    kb_init(db_path)
+    con = kb_connect(db_path)
+    con.execute("PRAGMA foreign_keys = ON")
+    _init_cache_tables(con)
+    return con
+
+def _upsert(con, sha: str, image_name: str | None, size: int, **cols) -> None:
+    now = _now()
+    con.execute("""
+      INSERT INTO extraction_cache (sha256, image_name, created_ts, last_used_ts)
+      VALUES (?, ?, ?, ?)
+      ON CONFLICT(sha256) DO UPDATE SET last_used_ts = excluded.last_used_ts,
+                                        image_name = COALESCE(extraction_cache.image_name, excluded.image_name)
+    """, (sha, image_name, now, now))
+    sets = ", ".join(f"{k} = ?" for k in cols)
+    con.execute(f"UPDATE extraction_cache SET size_bytes = ?{', ' + sets if sets else ''} WHERE sha256 = ?",
+                (size, *cols.values(), sha))
+
+def _add_ref(con, sha: str, holder: str | None) -> None:
+    if holder:
+        con.execute("INSERT OR IGNORE INTO extraction_refs (sha256, holder) VALUES (?, ?)", (sha, os.path.abspath(holder)))
+
+def cache_lookup_rootfs(db_path: str, root: str, sha: str, holder: str | None = None) -> tuple[str, str] | None:
+    """
+    (rootfs_dir, rootfs_tar_bz2) for an image, or None on a miss. An entry that
+    only has FirmAE's tarball is unpacked and re-packed once, then served.
+    `holder` pins the entry while that path exists.
+    """
+    entry = os.path.join(root, sha)
+    rootfs_dir = os.path.join(entry, "rootfs")
+    rootfs_tar = os.path.join(entry, "rootfs.tar.bz2")
+    firmae_tar = os.path.join(entry, "firmae.tar.gz")
+    with _entry_lock(sha):   # other entries (and other KB work) go on while this one is unpacked
+        with _LOCK:
+            con = _connect(db_path)
+            try:
+                row = con.execute("SELECT has_rootfs FROM extraction_cache WHERE sha256 = ?", (sha,)).fetchone()
+            finally:
+                con.close()
+        if not row:
+            return None
+        repack = not (row[0] and os.path.isdir(rootfs_dir) and os.path.isfile(rootfs_tar))
+        if repack:
+            if not os.path.isfile(firmae_tar):
+                return None
+            shutil.rmtree(rootfs_dir, ignore_errors=True)
+            os.makedirs(rootfs_dir)
+            with tarfile.open(firmae_tar, "r:*") as tf:
+                tf.errorlevel = 0  # device nodes cannot be created unprivileged; skip them
+                _extract_all(tf, rootfs_dir)
+            with tarfile.open(rootfs_tar + ".part", "w:bz2") as tf:
+                for item in sorted(os.listdir(rootfs_dir)):
+                    tf.add(os.path.join(rootfs_dir, item), arcname=item)
+            os.replace(rootfs_tar + ".part", rootfs_tar)
+        size = _du(entry) if repack else None
+        with _LOCK:
+            con = _connect(db_path)
+            try:
+                if repack:
+                    _upsert(con, sha, None, size, has_rootfs=1)
+                con.execute("UPDATE extraction_cache SET hits = hits + 1, last_used_ts = ? WHERE sha256 = ?", (_now(), sha))
+                _add_ref(con, sha, holder)
+                con.commit()
+            finally:
+                con.close()
+        return rootfs_dir, rootfs_tar
+
+def cache_store_rootfs(db_path: str, root: str, sha: str, image_name: str,
+                       rootfs_dir: str, rootfs_tar: str, holder: str | None = None) -> None:
+    """
+    Keep a located rootfs tree and its packed tarball for later builds of the same image.
+    """
+    entry = os.path.join(root, sha)
+    with _entry_lock(sha):
+        os.makedirs(entry, exist_ok=True)
+        dst = os.path.join(entry, "rootfs")
+        if not os.path.isdir(dst):
+            shutil.copytree(rootfs_dir, dst + ".part", symlinks=True, dirs_exist_ok=True)
+            os.replace(dst + ".part", dst)
+        _link_or_copy(rootfs_tar, os.path.join(entry, "rootfs.tar.bz2"))
+        size = _du(entry)
+        with _LOCK:
+            con = _connect(db_path)
+            try:
+                _upsert(con, sha, image_name, size, has_rootfs=1)
+                _add_ref(con, sha, holder)
+                con.commit()
+            finally:
+                con.close()
+
+def cache_register_firmae(db_path: str, root: str, sha: str, image_name: str,
+                          iid: int, images_dir: str, holder: str | None = None) -> bool:
+    """
+    Adopt FirmAE's images/<iid>.tar.gz after a run. False if it does not exist.
+    """
+    src = os.path.join(images_dir, f"{iid}.tar.gz")
+    if not os.path.isfile(src):
+        return False
+    entry = os.path.join(root, sha)
+    with _entry_lock(sha):
+        os.makedirs(entry, exist_ok=True)
+        dst = os.path.join(entry, "firmae.tar.gz")
+        if not os.path.isfile(dst):
+            _link_or_copy(src, dst)
+        size = _du(entry)
+        with _LOCK:
+            con = _connect(db_path)
+            try:
+                _upsert(con, sha, image_name, size, firmae_iid=iid)
+                _add_ref(con, sha, holder)
+                con.commit()
+            finally:
+                con.close()
+    return True
+
+def cache_restore_firmae(db_path: str, root: str, sha: str, images_dir: str) -> int | None:
+    """
+    Put images/<iid>.tar.gz back before a run if FirmAE's copy is gone, so its
+    extractor skips the image. Returns the IID restored, else None.
+    """
+    with _entry_lock(sha):
+        with _LOCK:
+            con = _connect(db_path)
+            try:
+                row = con.execute("SELECT firmae_iid FROM extraction_cache WHERE sha256 = ?", (sha,)).fetchone()
+            finally:
+                con.close()
+        if not row or row[0] is None:
+            return None
+        src = os.path.join(root, sha, "firmae.tar.gz")
+        dst = os.path.join(images_dir, f"{row[0]}.tar.gz")
+        if os.path.exists(dst) or not os.path.isfile(src):
+            return None
+        os.makedirs(images_dir, exist_ok=True)
+        _link_or_copy(src, dst)
+        with _LOCK:
+            con = _connect(db_path)
+            try:
+                con.execute("UPDATE extraction_cache SET hits = hits + 1, last_used_ts = ? WHERE sha256 = ?", (_now(), sha))
+                con.commit()
+            finally:
+                con.close()
+        return row[0]
+
+def enforce_extract_quota(db_path: str, root: str, max_bytes: int | None = None) -> list[dict]:
+    """
+    Drop references whose holder path is gone, then evict unreferenced entries,
+    least recently used first, until the cache fits in `max_bytes`
+    (default: FIRMAE_EXTRACT_QUOTA; no limit if unset). Returns [{sha256, bytes}].
+    """
+    if max_bytes is None:
+        max_bytes = _parse_size(os.environ.get("FIRMAE_EXTRACT_QUOTA"))
+    if max_bytes is None:
+        return []
+    evicted = []
+    with _LOCK:
+        con = _connect(db_path)
+        try:
+            dead = [(s, h) for s, h in con.execute("SELECT sha256, holder FROM extraction_refs") if not os.path.exists(h)]
+            con.executemany("DELETE FROM extraction_refs WHERE sha256 = ? AND holder = ?", dead)
+            used = con.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM extraction_cache").fetchone()[0]
+            rows = con.execute("""
+              SELECT c.sha256, c.size_bytes FROM extraction_cache c
+              WHERE NOT EXISTS (SELECT 1 FROM extraction_refs r WHERE r.sha256 = c.sha256)
+              ORDER BY c.last_used_ts
+            """).fetchall()
+            for sha, size in rows:
+                if used <= max_bytes:
+                    break
+                lock = _ENTRY_LOCKS.setdefault(sha, threading.Lock())
+                if not lock.acquire(blocking=False):
+                    continue   # being unpacked or stored right now
+                try:
+                    shutil.rmtree(os.path.join(root, sha), ignore_errors=True)
+                finally:
+                    lock.release()
+                con.execute("DELETE FROM extraction_cache WHERE sha256 = ?", (sha,))
+                used -= size
+                evicted.append({"sha256": sha, "bytes": size})
+            con.commit()
+        finally:
+            con.close()
+    return evicted
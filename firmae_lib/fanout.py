@@ -0,0 +1,304 @@
+import os, json, time, uuid, socket, sqlite3, threading
+from firmae_lib.sqlite_helper import kb_init, kb_connect, kb_insert_run, kb_insert_analysis
+from firmae_lib.clusters import kb_assign_cluster, _texts_from_analysis
+from firmae_lib.similar import kb_index_failure
+
+# ---- multi-node fan-out: a coordinator hands tool calls to worker agents ----
+# Workers are ordinary firmae_mcp.py processes started with --worker ADDR. They
+# dial the coordinator (FIRMAE_COORDINATOR_LISTEN) and speak newline-delimited JSON:
+#   worker -> coord  {"type": "hello", "name": str, "capacity": int}
+#   coord -> worker  {"type": "job", "job": id, "params": {name, arguments}}
+#   worker -> coord  {"type": "result", "job": id, "result": {...}, "kb": {run, analyses} | null}
+# The coordinator imports each returned run into the central KB.
+
+PROTOCOL = 1
+FANOUT_TOOLS = {"firmae.emulate"}
+RECONNECT_SEC = 2.0
+
+def parse_addr(addr: str) -> tuple[int, str | tuple[str, int]]:
+    """
+    'unix:/path', 'tcp://host:port' or 'host:port' -> (socket family, address).
+    """
+    if addr.startswith("unix:"):
+        return socket.AF_UNIX, addr[len("unix:"):]
+    host, _, port = addr.removeprefix("tcp://").rpartition(":")
+    if not port.isdigit():
+        raise ValueError(f"bad address '{addr}' (use unix:/path or tcp://host:port)")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+def _send(sock: socket.socket, lock: threading.Lock, msg: dict) -> None:
+    data = (json.dumps(msg, ensure_ascii=False) + "\n").encode("utf-8")
+    with lock:
+        sock.sendall(data)
+
+# ---- KB transfer ----
+
+def kb_export_run(db_path: str, run_id: int) -> dict | None:
+    """
+    A run row and its analyses as plain dicts, for shipping to the coordinator.
+    """
+    kb_init(db_path)
+    con = kb_connect(db_path)
+    con.row_factory = sqlite3.Row
+    try:
+        run = con.execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+        if not run:
+            return None
+        analyses = con.execute(
+            "SELECT source, summary, content, reasons_json FROM analyses WHERE run_id = ? ORDER BY id", (run_id,)
+        ).fetchall()
+        return {"run": dict(run), "analyses": [dict(a) for a in analyses]}
+    finally:
+        con.close()
+
+def kb_import_run(db_path: str, payload: dict, worker: str) -> int:
+    """
+    Insert a run exported by a worker into this KB. iid_dir is prefixed with the
+    worker name so scratch paths stay unambiguous. Failed runs are clustered here too.
+    """
+    run = payload["run"]
+    iid_dir = run.get("iid_dir")
+    run_id = kb_insert_run(
+        db_path,
+        brand=run.get("brand"), model=run.get("model"), firmware=run.get("firmware"),
+        iid_dir=f"{worker}:{iid_dir}" if iid_dir else None,
+        exit_code=run.get("exit_code") or 0,
+        result_bool=None if run.get("result_bool") is None else bool(run["result_bool"]),
+        duration_sec=run.get("duration_sec") or 0.0,
+        architecture=run.get("architecture"), timeout_sec=run.get("timeout_sec"),
+        timeout_reason=run.get("timeout_reason"),
+        ping_bool=None if run.get("ping_bool") is None else bool(run["ping_bool"]),
+        web_bool=None if run.get("web_bool") is None else bool(run["web_bool"]),
+    )
+    for a in payload.get("analyses") or []:
+        kb_insert_analysis(db_path, run_id=run_id, source=a["source"], summary=a.get("summary"),
+                           content=a.get("content") or "", reasons_json=a.get("reasons_json"))
+        if a["source"] == "heuristic" and run.get("result_bool") == 0:
+            texts = _texts_from_analysis(a.get("content") or "")
+            if texts:
+                try:
+                    reasons = (json.loads(a.get("reasons_json") or "{}") or {}).get("reasons") or []
+                except ValueError:
+                    reasons = []
+                kb_assign_cluster(db_path, run_id, texts, title=", ".join(reasons) or None)
+                kb_index_failure(db_path, run_id, texts, reasons)
+    return run_id
+
+# ---- coordinator ----
+
+class _Worker:
+    def __init__(self, sock: socket.socket, name: str, capacity: int):
+        self.sock = sock
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.inflight: dict[str, dict] = {}   # job id -> job
+        self.completed = 0
+        self.failed = 0
+        self.connected_at = time.time()
+        self.send_lock = threading.Lock()
+        self.alive = True
+
+class Coordinator:
+    """
+    Accepts worker registrations and dispatches jobs to the worker with the most
+    spare capacity (free slots, then lowest load ratio). submit() blocks until a
+    slot frees up; a job on a worker that disconnects is retried once elsewhere.
+    """
+
+    def __init__(self, listen_addr: str, db_path: str):
+        self.listen_addr = listen_addr
+        self.db_path = db_path
+        self.workers: dict[str, _Worker] = {}
+        self.cond = threading.Condition()
+        self._server = None
+
+    def start(self) -> "Coordinator":
+        family, addr = parse_addr(self.listen_addr)
+        if family == socket.AF_UNIX and os.path.exists(addr):
+            os.remove(addr)
+        srv = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        srv.bind(addr)
+        srv.listen(64)
+        self._server = srv
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def _accept_loop(self) -> None:
+        while True:
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve_worker, args=(sock,), daemon=True).start()
+
+    def _serve_worker(self, sock: socket.socket) -> None:
+        reader = sock.makefile("r", encoding="utf-8")
+        worker = None
+        try:
+            hello = json.loads(reader.readline() or "null")
+            if not hello or hello.get("type") != "hello":
+                return
+            name = str(hello.get("name") or f"worker-{uuid.uuid4().hex[:6]}")
+            worker = _Worker(sock, name, int(hello.get("capacity") or 1))
+            with self.cond:
+                if name in self.workers:
+                    worker.name = name = f"{name}-{uuid.uuid4().hex[:4]}"
+                self.workers[name] = worker
+                self.cond.notify_all()
+            for line in reader:
+                msg = json.loads(line)
+                if msg.get("type") != "result":
+                    continue
+                with self.cond:
+                    job = worker.inflight.pop(msg.get("job"), None)
+                    self.cond.notify_all()
+                if job is None:
+                    continue
+                job["result"] = msg.get("result")
+                job["kb"] = msg.get("kb")
+                job["worker"] = worker.name
+                job["done"].set()
+        except (OSError, ValueError):
+            pass
+        finally:
+            try:
+                sock.close()
+            except OSError:
+                pass
+            if worker:
+                with self.cond:
+                    worker.alive = False
+                    self.workers.pop(worker.name, None)
+                    orphans = list(worker.inflight.values())
+                    worker.inflight.clear()
+                    self.cond.notify_all()
+                for job in orphans:
+                    job["lost"] = worker.name
+                    job["done"].set()
+
+    def has_workers(self) -> bool:
+        with self.cond:
+            return bool(self.workers)
+
+    def _pick(self) -> _Worker | None:
+        free = [w for w in self.workers.values() if w.alive and len(w.inflight) < w.capacity]
+        if not free:
+            return None
+        return min(free, key=lambda w: (len(w.inflight) / w.capacity, -w.capacity))
+
+    def submit(self, params: dict, wait_sec: float | None = None) -> dict:
+        """
+        Run one tool call on a worker and return its MCP result. The run (if
+        any) is imported into the central KB and noted in the result text.
+        """
+        tries = 0
+        while True:
+            job = {"id": uuid.uuid4().hex, "done": threading.Event()}
+            deadline = None if wait_sec is None else time.time() + wait_sec
+            with self.cond:
+                while True:
+                    worker = self._pick()
+                    if worker:
+                        break
+                    if not self.workers:
+                        raise RuntimeError("no workers registered")
+                    left = None if deadline is None else deadline - time.time()
+                    if left is not None and left <= 0:
+                        raise RuntimeError("timed out waiting for a free worker slot")
+                    self.cond.wait(left)
+                worker.inflight[job["id"]] = job
+            try:
+                _send(worker.sock, worker.send_lock, {"type": "job", "job": job["id"], "params": params})
+            except OSError:
+                job["lost"] = worker.name
+                with self.cond:
+                    worker.inflight.pop(job["id"], None)
+            else:
+                job["done"].wait()
+            if "lost" in job:
+                tries += 1
+                if tries >= 2:
+                    raise RuntimeError(f"worker {job['lost']} disconnected during the job (retried once)")
+                continue
+            break
+
+        result = job["result"] or {"content": [{"type": "text", "text": "[coordinator] empty worker result"}], "isError": True}
+        worker.completed += 1
+        if result.get("isError"):
+            worker.failed += 1
+        note = f"[coordinator] ran on worker {job['worker']}"
+        if job.get("kb"):
+            try:
+                run_id = kb_import_run(self.db_path, job["kb"], job["worker"])
+                note += f"; imported as central KB run #{run_id}"
+                result.setdefault("_meta", {})["run_id"] = run_id
+            except Exception as e:
+                note += f"; central KB import failed: {e}"
+        result.setdefault("content", []).append({"type": "text", "text": note})
+        return result
+
+    def status(self) -> list[dict]:
+        with self.cond:
+            return [{
+                "name": w.name, "capacity": w.capacity, "running": len(w.inflight),
+                "completed": w.completed, "failed": w.failed,
+                "connected_sec": round(time.time() - w.connected_at, 1),
+            } for w in self.workers.values()]
+
+# ---- worker ----
+
+def run_worker(coordinator_addr: str, handle_call, db_path: str, capacity: int = 2, name: str | None = None) -> None:
+    """
+    Register with a coordinator and execute its jobs, at most `capacity` at a
+    time. Reconnects forever; a job's run is exported from the local KB with its result.
+    """
+    name = name or f"{socket.gethostname()}-{os.getpid()}"
+    slots = threading.Semaphore(max(1, capacity))
+    while True:
+        family, addr = parse_addr(coordinator_addr)
+        try:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.connect(addr)
+        except OSError:
+            time.sleep(RECONNECT_SEC)
+            continue
+        send_lock = threading.Lock()
+
+        def _run(job_id: str, params: dict) -> None:
+            try:
+                try:
+                    result = handle_call(params)
+                except Exception as e:
+                    result = {"content": [{"type": "text", "text": f"Internal error: {e}"}], "isError": True}
+                kb = None
+                run_id = (result.get("_meta") or {}).get("run_id")
+                if run_id:
+                    try:
+                        kb = kb_export_run(db_path, run_id)
+                    except Exception:
+                        kb = None
+                try:
+                    _send(sock, send_lock, {"type": "result", "job": job_id, "result": result, "kb": kb})
+                except OSError:
+                    pass
+            finally:
+                slots.release()
+
+        try:
+            _send(sock, send_lock, {"type": "hello", "name": name, "capacity": capacity, "protocol": PROTOCOL})
+            for line in sock.makefile("r", encoding="utf-8"):
+                msg = json.loads(line)
+                if msg.get("type") != "job":
+                    continue
+                slots.acquire()
+                threading.Thread(target=_run, args=(msg["job"], msg.get("params") or {}), daemon=True).start()
+        except (OSError, ValueError):
+            pass
+        finally:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        time.sleep(RECONNECT_SEC)
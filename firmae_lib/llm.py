@@ -0,0 +1,315 @@
+import os, re, json, time, queue, hashlib, threading, urllib.request
+from datetime import datetime
+from firmae_lib.clusters import _mask_log
+from firmae_lib.condense import estimate_tokens
+from firmae_lib.sqlite_helper import kb_init, kb_connect, kb_insert_analysis
+
+# ---- optional LLM analysis of failed runs (local OpenAI- or Ollama-compatible endpoint) ----
+# emulate hands each failure's condensed context (condense.py) to submit(), which
+# only checks the cache and enqueues, so emulation never waits on inference. One
+# background thread drains the queue: whatever has piled up while the previous
+# request ran (up to FIRMAE_LLM_BATCH runs) goes out as one request; runs whose
+# request failed go back on the queue after ERROR_BACKOFF. Answers are
+# cached in llm_cache by model + masked condensed text, so a failure that repeats
+# with different timestamps/addresses costs no request, and are stored in
+# analyses with source 'llm'.
+#   FIRMAE_LLM_URL    http://127.0.0.1:11434/api/chat (Ollama) or
+#                     http://127.0.0.1:8080/v1 (OpenAI-style, /chat/completions is appended)
+#   FIRMAE_LLM_MODEL  model name sent with each request
+
+DEFAULT_MODEL   = "llama3.1"
+DEFAULT_BATCH   = 4
+DEFAULT_QUEUE   = 100
+DEFAULT_TIMEOUT = 300
+BATCH_TOKENS    = 12000    # a batch stops growing before its prompt exceeds this
+ERROR_BACKOFF   = 30.0     # seconds to pause after a failed request
+MAX_ATTEMPTS    = 5        # failed requests per run before it is dropped
+
+SYSTEM_PROMPT = (
+    "You analyse failed FirmAE firmware emulations. You get condensed logs: repeated lines are "
+    "merged with [xN] counts and '...' marks omitted lines. For each run give, in a few lines: "
+    "the most likely root cause, the log lines that show it, and one concrete next step "
+    "(FirmAE option, timeout, architecture/kernel, network or NVRAM setup). Say so when the logs "
+    "are inconclusive."
+)
+
+_RUN_HEAD = re.compile(r"^#{1,6}\s*run\s*#?(\d+)\b.*$", re.I | re.M)
+
+def _init_llm_tables(con) -> None:
+    con.executescript("""
+    CREATE TABLE IF NOT EXISTS llm_cache (
+      digest     TEXT PRIMARY KEY,
+      model      TEXT NOT NULL,
+      response   TEXT NOT NULL,
+      created_at TEXT NOT NULL,
+      hits       INTEGER NOT NULL DEFAULT 0
+    );
+    """)
+
+def llm_digest(model: str, text: str) -> str:
+    """
+    Cache key: model plus the condensed text with timestamps, addresses and PIDs masked.
+    """
+    masked = "\n".join(" ".join(_mask_log(l).split()) for l in text.splitlines())
+    return hashlib.sha256(f"{model}\0{masked}".encode("utf-8")).hexdigest()
+
+def kb_llm_cached(db_path: str, digest: str) -> str | None:
+    kb_init(db_path)
+    con = kb_connect(db_path)
+    try:
+        _init_llm_tables(con)
+        row = con.execute("SELECT response FROM llm_cache WHERE digest = ?", (digest,)).fetchone()
+        if row:
+            con.execute("UPDATE llm_cache SET hits = hits + 1 WHERE digest = ?", (digest,))
+            con.commit()
+        return row[0] if row else None
+    finally:
+        con.close()
+
+def kb_llm_store(db_path: str, digest: str, model: str, response: str) -> None:
+    kb_init(db_path)
+    con = kb_connect(db_path)
+    try:
+        _init_llm_tables(con)
+        con.execute(
+            "INSERT OR REPLACE INTO llm_cache(digest, model, response, created_at) VALUES (?, ?, ?, ?)",
+            (digest, model, response, datetime.utcnow().isoformat(timespec="seconds") + "Z")
+        )
+        con.commit()
+    finally:
+        con.close()
+
+def kb_llm_analyses(db_path: str, run_id: int) -> list[dict]:
+    kb_init(db_path)
+    con = kb_connect(db_path)
+    try:
+        rows = con.execute(
+            "SELECT id, at_ts, content, reasons_json FROM analyses WHERE run_id = ? AND source = 'llm' ORDER BY id DESC",
+            (run_id,)
+        ).fetchall()
+    finally:
+        con.close()
+    out = []
+    for aid, ts, content, meta_json in rows:
+        try:
+            meta = json.loads(meta_json or "{}")
+        except ValueError:
+            meta = {}
+        out.append(dict(meta, id=aid, at_ts=ts, content=content or ""))
+    return out
+
+def _endpoint(url: str) -> tuple[str, str]:
+    """
+    (api, request url): 'ollama' for .../api/chat, otherwise OpenAI-style chat completions.
+    """
+    u = url.rstrip("/")
+    if u.endswith("/api/chat"):
+        return "ollama", u
+    if not u.endswith("/chat/completions"):
+        u += "/chat/completions"
+    return "openai", u
+
+def _build_prompt(items: list[dict]) -> str:
+    if len(items) == 1:
+        return f"Failed emulation, run {items[0]['label']}:\n\n{items[0]['text']}"
+    parts = [f"{len(items)} failed emulations follow. Answer each one separately, "
+             f"under its own heading '### run <id>' with the id given below."]
+    parts += [f"### run {it['label']}\n{it['text']}" for it in items]
+    return "\n\n".join(parts)
+
+def _split_batch(response: str, labels: set[int]) -> dict[int, str]:
+    """
+    Per-run sections of a batched answer, keyed by the run id in each heading.
+    """
+    heads = list(_RUN_HEAD.finditer(response))
+    out = {}
+    for i, m in enumerate(heads):
+        label = int(m.group(1))
+        body = response[m.end():heads[i + 1].start() if i + 1 < len(heads) else len(response)].strip()
+        if label in labels and body and label not in out:
+            out[label] = body
+    return out
+
+class LLMStage:
+    """
+    Background LLM analysis of failed runs. Disabled unless FIRMAE_LLM_URL is set.
+    """
+
+    def __init__(self, db_path: str, url: str | None = None, model: str | None = None):
+        self.db_path = db_path
+        url = url if url is not None else os.environ.get("FIRMAE_LLM_URL") or ""
+        self.enabled = bool(url)
+        self.api, self.url = _endpoint(url) if url else (None, None)
+        self.model = model or os.environ.get("FIRMAE_LLM_MODEL") or DEFAULT_MODEL
+        self.api_key = os.environ.get("FIRMAE_LLM_API_KEY") or ""
+        self.batch = max(1, int(os.environ.get("FIRMAE_LLM_BATCH") or DEFAULT_BATCH))
+        self.timeout = float(os.environ.get("FIRMAE_LLM_TIMEOUT") or DEFAULT_TIMEOUT)
+        self.queue: queue.Queue[str] = queue.Queue(maxsize=max(1, int(os.environ.get("FIRMAE_LLM_QUEUE") or DEFAULT_QUEUE)))
+        self.pending: dict[str, dict] = {}   # digest -> {text, runs}; queued or in flight
+        self.stats = {"queued": 0, "cached": 0, "dropped": 0, "requests": 0, "batched_runs": 0,
+                      "stored": 0, "errors": 0, "last_error": None, "last_latency_sec": None}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    # -- emulate side --
+
+    def submit(self, run_id: int, text: str) -> str:
+        """
+        Hand a failed run's condensed context to the stage without waiting.
+        Returns 'off', 'cached' (answer stored from the cache), 'queued' or 'full'.
+        """
+        if not self.enabled:
+            return "off"
+        digest = llm_digest(self.model, text)
+        hit = kb_llm_cached(self.db_path, digest)
+        if hit is not None:
+            self._record(run_id, digest, hit, cached=True)
+            with self._lock:
+                self.stats["cached"] += 1
+            return "cached"
+        with self._lock:
+            if digest in self.pending:
+                # same failure already waiting for an answer; it will be stored for this run too
+                if run_id not in self.pending[digest]["runs"]:
+                    self.pending[digest]["runs"].append(run_id)
+                return "queued"
+            try:
+                self.queue.put_nowait(digest)
+            except queue.Full:
+                self.stats["dropped"] += 1
+                return "full"
+            self.pending[digest] = {"text": text, "runs": [run_id], "attempts": 0}
+            self.stats["queued"] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="llm-analysis", daemon=True)
+                self._thread.start()
+        return "queued"
+
+    # -- worker side --
+
+    def _loop(self) -> None:
+        carry = None   # digest that did not fit in the previous batch
+        while True:
+            digests = [carry if carry is not None else self.queue.get()]
+            carry = None
+            with self._lock:
+                tokens = estimate_tokens(self.pending[digests[0]]["text"])
+                while len(digests) < self.batch:
+                    try:
+                        d = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    cost = estimate_tokens(self.pending[d]["text"])
+                    if tokens + cost > BATCH_TOKENS:
+                        carry = d
+                        break
+                    digests.append(d)
+                    tokens += cost
+                items = [{"digest": d, "text": self.pending[d]["text"], "label": self.pending[d]["runs"][0]} for d in digests]
+            try:
+                failed = self._answer(items)
+            except Exception as e:
+                self._error(e)
+                failed = items
+            failed_digests = {it["digest"] for it in failed}
+            with self._lock:
+                for d in digests:
+                    if d not in failed_digests:
+                        self.pending.pop(d, None)
+            if failed:
+                time.sleep(ERROR_BACKOFF)
+                self._requeue(failed_digests)
+
+    def _requeue(self, digests: set[str]) -> None:
+        with self._lock:
+            for d in digests:
+                entry = self.pending.get(d)
+                if entry is None:
+                    continue
+                entry["attempts"] += 1
+                try:
+                    if entry["attempts"] >= MAX_ATTEMPTS:
+                        raise queue.Full
+                    self.queue.put_nowait(d)
+                except queue.Full:
+                    self.pending.pop(d, None)
+                    self.stats["dropped"] += 1
+
+    def _error(self, e: Exception) -> None:
+        with self._lock:
+            self.stats["errors"] += 1
+            self.stats["last_error"] = f"{type(e).__name__}: {e}"
+
+    def _answer(self, items: list[dict]) -> list[dict]:
+        """
+        Ask for `items` in one request and store the answers. Returns the
+        items left unanswered by a failed request (to be retried).
+        """
+        t0 = time.time()
+        try:
+            response = self._request(_build_prompt(items))
+        except Exception as e:
+            self._error(e)
+            return items
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["last_latency_sec"] = round(time.time() - t0, 2)
+            if len(items) > 1:
+                self.stats["batched_runs"] += len(items)
+        if len(items) == 1:
+            answers = {items[0]["label"]: response.strip()}
+        else:
+            answers = _split_batch(response, {it["label"] for it in items})
+        failed = []
+        for it in items:
+            answer = answers.get(it["label"])
+            if not answer:
+                if len(items) > 1:
+                    failed += self._answer([it])   # the model skipped or mislabelled this run; ask for it alone
+                continue
+            try:
+                kb_llm_store(self.db_path, it["digest"], self.model, answer)
+                with self._lock:
+                    runs = list(self.pending.get(it["digest"], {}).get("runs") or [it["label"]])
+                for run_id in runs:
+                    self._record(run_id, it["digest"], answer, cached=False, batch=len(items))
+            except Exception as e:
+                self._error(e)
+                failed.append(it)
+        return failed
+
+    def _request(self, prompt: str) -> str:
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
+        if self.api == "ollama":
+            body = {"model": self.model, "messages": messages, "stream": False, "options": {"temperature": 0}}
+        else:
+            body = {"model": self.model, "messages": messages, "temperature": 0}
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        req = urllib.request.Request(self.url, data=json.dumps(body).encode("utf-8"), headers=headers, method="POST")
+        with urllib.request.urlopen(req, timeout=self.timeout) as r:
+            data = json.loads(r.read().decode("utf-8"))
+        if self.api == "ollama":
+            return data["message"]["content"]
+        return data["choices"][0]["message"]["content"]
+
+    def _record(self, run_id: int, digest: str, answer: str, cached: bool, batch: int = 1) -> None:
+        if any(a.get("digest") == digest for a in kb_llm_analyses(self.db_path, run_id)):
+            return
+        first = next((l.strip("#*- ").strip() for l in answer.splitlines() if l.strip("#*- ").strip()), "")
+        kb_insert_analysis(
+            self.db_path, run_id=run_id, source="llm",
+            summary=(first[:200] or "LLM failure analysis"),
+            content=answer,
+            reasons_json={"model": self.model, "digest": digest, "cached": cached, "batch": batch},
+        )
+        with self._lock:
+            self.stats["stored"] += 1
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled, "api": self.api, "url": self.url, "model": self.model,
+                "batch": self.batch, "pending": len(self.pending), "stats": dict(self.stats),
+            }
@@ -1,77 +1,165 @@
-import os, csv
+import os, io, csv, threading
+from contextlib import contextmanager
+
+# flock is POSIX-only; elsewhere we rely on the in-process lock
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from firmae_lib.scratch import scratch_index, _safe_read, _parse_bool
 
 def _to_bool_str(val: bool) -> str:
     return "true" if bool(val) else "false"
 
-def _safe_read(path: str) -> str:
-    try:
-        if os.path.exists(path):
-            with open(path, "r", encoding="utf-8") as f:
-                return f.read().strip()
-    except Exception:
-        pass
-    return ""
-
-def _parse_bool(s: str):
+def _last_line(path: str, block: int = 4096) -> str:
     """
-    Convert common truthy/falsey strings to bool.
-    Returns True/False, or None if indeterminate/empty.
+    Last non-empty line of a file, read by seeking backwards from EOF in blocks.
     """
-    if s is None:
-        return None
-    s = s.strip().lower()
-    if not s:
-        return None
-
-    # BOOLEAN PARSE LOGIC - look for these values
-    # Adjust where necessary
-    truthy = {"1", "true", "yes", "y", "ok", "success", "on", "reachable", "up"}
-    falsy  = {"0", "false", "no", "n", "fail", "failed", "off", "unreachable", "down"}
-    
-    if s in truthy:
-        return True
-    if s in falsy:
-        return False
-        
-    # Try numeric fallback
-    try:
-        return float(s) != 0.0
-    except Exception:
-        return None
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        buf = b""
+        while pos > 0:
+            step = min(block, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+            stripped = buf.rstrip(b"\r\n")
+            nl = stripped.rfind(b"\n")
+            if nl != -1 or pos == 0:
+                return stripped[nl + 1:].decode("utf-8", "replace")
+    return ""
 
 def _next_record_number(csv_path: str) -> int:
     """
     Reads the last data row’s number if file exists; else 1.
+    Only the tail of the file is read, so this is O(1) in the file size.
     """
     if not os.path.exists(csv_path):
         return 1
-    last_num = 0
+    try:
+        first_col = _last_line(csv_path).split(",")[0].strip()
+        if first_col.isdigit():
+            return int(first_col) + 1
+        if first_col in ("", "number"):  # empty file or header only
+            return 1
+    except Exception:
+        pass
+    # Unparseable tail: fall back to counting rows
     try:
         with open(csv_path, "r", encoding="utf-8") as f:
-            rows = [ln.strip() for ln in f if ln.strip()]
-        if len(rows) >= 2:
-            first_col = rows[-1].split(",")[0]
-            last_num = int(first_col)
-            return last_num + 1
+            count = sum(1 for _ in f) - 1
+        return max(1, count + 1)
     except Exception:
+        return 1
+
+RECORD_HEADER = ["number", "firmware_name", "architecture", "brand", "ping", "web", "result"]
+
+class RecordWriter:
+    """
+    Appends rows to emulation_records.csv with a per-process counter.
+    Threads are serialised by a lock and processes by flock() on the CSV, so
+    parallel emulations never reuse a number or interleave rows. Rows can be
+    buffered with `batch()` and written with one flush.
+    """
+
+    def __init__(self, csv_path: str):
+        self.csv_path = csv_path
+        self._lock = threading.Lock()
+        self._next = None      # next number to hand out
+        self._seen_size = -1   # file size after our last write
+        self._pending = []
+        self._batching = 0
+
+    def _sync_counter(self) -> None:
+        # Another process appended since our last write: re-read only the tail.
         try:
-            with open(csv_path, "r", encoding="utf-8") as f:
-                count = sum(1 for _ in f) - 1
-            return max(1, count + 1)
-        except Exception:
-            return 1
-    return last_num + 1
+            size = os.path.getsize(self.csv_path)
+        except OSError:
+            size = -1
+        if self._next is None or size != self._seen_size:
+            self._next = _next_record_number(self.csv_path)
+
+    def append(self, row: dict) -> dict:
+        """
+        Assign `row["number"]` and write it (or queue it inside `batch()`).
+        """
+        with self._lock:
+            self._pending.append(row)
+            if not self._batching:
+                self._flush_locked()
+            else:
+                row["number"] = None  # assigned at flush time
+        return row
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, []
+        with open(self.csv_path, "a", newline="", encoding="utf-8") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                self._sync_counter()
+                buf = io.StringIO()
+                writer = csv.DictWriter(buf, fieldnames=RECORD_HEADER)
+                if os.fstat(f.fileno()).st_size == 0:
+                    writer.writeheader()
+                for row in rows:
+                    row["number"] = self._next
+                    self._next += 1
+                    writer.writerow(row)
+                f.write(buf.getvalue())
+                f.flush()
+                self._seen_size = os.fstat(f.fileno()).st_size
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    @contextmanager
+    def batch(self):
+        """
+        Buffer appends until the outermost batch exits, then write them in one go.
+        """
+        with self._lock:
+            self._batching += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batching -= 1
+                if not self._batching:
+                    self._flush_locked()
+
+_WRITERS: dict[str, RecordWriter] = {}
+_WRITERS_LOCK = threading.Lock()
+
+def record_writer(csv_path: str) -> RecordWriter:
+    """
+    Shared RecordWriter for `csv_path` (one per file per process).
+    """
+    key = os.path.abspath(csv_path)
+    with _WRITERS_LOCK:
+        if key not in _WRITERS:
+            _WRITERS[key] = RecordWriter(key)
+        return _WRITERS[key]
 
 def append_emulation_record(
     firmae_home: str,
     fw_path: str,
     brand: str,
     exit_code: int,
+    iid_dir: str | None = None,
 ) -> dict:
     """
     Append one emulation result row into <FIRMAE_HOME>/emulation_records.csv.
     Columns: number, firmware_name, architecture, brand, ping, web, result
-    Values are read from latest scratch/<iid>/ files:
+    Values are read from `iid_dir` (default: latest scratch/<iid>/) files:
       - name          -> firmware_name (fallback: basename of fw_path without extension)
       - architecture  -> architecture (fallback: "")
       - brand         -> brand (fallback: function arg `brand`)
@@ -82,15 +170,9 @@ def append_emulation_record(
     scratch_root = os.path.join(firmae_home, "scratch")
     csv_path = os.path.join(firmae_home, "emulation_records.csv")
 
-    # Latest numeric scratch iid
-    latest_dir = None
-    try:
-        if os.path.exists(scratch_root):
-            nums = [int(d) for d in os.listdir(scratch_root) if d.isdigit()]
-            if nums:
-                latest_dir = os.path.join(scratch_root, str(max(nums)))
-    except Exception:
-        latest_dir = None
+    # Latest numeric scratch iid, unless the caller attributed one
+    index = scratch_index(scratch_root)
+    latest_dir = iid_dir if iid_dir and os.path.isdir(iid_dir) else index.latest()
 
     firmware_name = os.path.splitext(os.path.basename(fw_path))[0]
     architecture = ""
@@ -99,40 +181,32 @@ def append_emulation_record(
     web_bool = False
     result_bool = (exit_code == 0)  # default fallback
 
+    meta = {}
     if latest_dir:
-        name_file = _safe_read(os.path.join(latest_dir, "name"))
-        if name_file:
-            firmware_name = name_file
-
-        architecture_file = _safe_read(os.path.join(latest_dir, "architecture"))
-        if architecture_file:
-            architecture = architecture_file
-
-        brand_file = _safe_read(os.path.join(latest_dir, "brand"))
-        if brand_file:
-            brand_val = brand_file
-
-        # Boolean flags from files
-        ping_file = _parse_bool(_safe_read(os.path.join(latest_dir, "ping")))
-        if ping_file is not None:
-            ping_bool = ping_file
-        else:
-            ping_bool = False
-
-        web_file = _parse_bool(_safe_read(os.path.join(latest_dir, "web")))
-        if web_file is not None:
-            web_bool = web_file
+        base = os.path.basename(latest_dir.rstrip(os.sep))
+        if base.isdigit() and os.path.dirname(os.path.abspath(latest_dir)) == index.scratch_root:
+            meta = index.meta(int(base))
         else:
-            web_bool = False
-
-        result_file = _parse_bool(_safe_read(os.path.join(latest_dir, "result")))
-        if result_file is not None:
-            result_bool = result_file
+            meta = {f: _safe_read(os.path.join(latest_dir, f)) for f in ("name", "architecture", "brand")}
+            meta.update({f: _parse_bool(_safe_read(os.path.join(latest_dir, f))) for f in ("ping", "web", "result")})
+
+    if meta:
+        if meta.get("name"):
+            firmware_name = meta["name"]
+        if meta.get("architecture"):
+            architecture = meta["architecture"]
+        if meta.get("brand"):
+            brand_val = meta["brand"]
+
+        # Boolean flags from files (missing/indeterminate -> false)
+        ping_bool = bool(meta.get("ping"))
+        web_bool = bool(meta.get("web"))
+        if meta.get("result") is not None:
+            result_bool = meta["result"]
         # else keep fallback from exit_code
 
-    header = ["number", "firmware_name", "architecture", "brand", "ping", "web", "result"]
     row = {
-        "number": _next_record_number(csv_path),
+        "number": None,
         "firmware_name": firmware_name,
         "architecture": architecture,
         "brand": brand_val,
@@ -142,12 +216,7 @@ def append_emulation_record(
     }
 
     try:
-        write_header = not os.path.exists(csv_path)
-        with open(csv_path, "a", newline="", encoding="utf-8") as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=header)
-            if write_header:
-                writer.writeheader()
-            writer.writerow(row)
+        record_writer(csv_path).append(row)
     except Exception:
         pass
 
@@ -0,0 +1,257 @@
+import os, re, csv, sqlite3, threading
+from collections import Counter
+from datetime import datetime
+from firmae_lib.catalog import catalog_entries
+from firmae_lib.sqlite_helper import kb_init, kb_connect, _norm_brand, _norm_model
+
+# ---- model inference from firmware names, and brand/model normalization ----
+# Known models and their aliases (the kb/*.csv catalog, see catalog.py) go into a
+# character trie keyed by _norm_model(). A name is scanned from every token start and the
+# longest known model that ends on a token boundary wins, so 'Archer_C5400X_V2.bin'
+# gives 'Archer C5400X' rather than 'Archer C54'. Names of unknown models fall
+# back to the usual vendor pattern (DIR-868L, WNR2000, RT-AC68U) with hardware
+# revision suffixes dropped. runs.brand_norm/model_norm store the normalized
+# values so history filters are index lookups. Rows of emulation_records.csv
+# that predate the KB are imported into runs once (record_number set, ts '').
+
+BACKFILL_BATCH = 2000
+
+_BACKFILLING: set[str] = set()
+_BACKFILL_LOCK = threading.Lock()
+
+# prefix-letters digits suffix-letters, optionally followed by a one-digit revision (A1, v4)
+_MODEL_PATTERN = re.compile(r"(?<![A-Za-z0-9])((?:[A-Za-z]{1,4}-)?[A-Za-z]{1,5}-?\d{2,5})([A-Za-z]{0,3})(?=(\d?)(?:[^A-Za-z]|$))")
+_NOT_MODELS = {"FW", "B", "BUILD", "RC"}   # build markers
+_REVISIONS = {"V", "VER", "REV", "R"}       # version markers when a short number follows (V10, R1); R6300 is a model
+_END = "$"   # trie key of the (brand, model) entries ending at a node
+
+def _tokens(name: str) -> tuple[str, set[int]]:
+    """
+    _norm_model(name) and the positions in it where an original token starts
+    (after a separator, or at a lower->upper case change).
+    """
+    out, starts, prev = [], set(), ""
+    for ch in name:
+        if ch.isascii() and ch.isalnum():
+            if not prev or not (prev.isascii() and prev.isalnum()) or (prev.islower() and ch.isupper()):
+                starts.add(len(out))
+            out.append(ch.upper())
+        prev = ch
+    return "".join(out), starts
+
+class ModelIndex:
+    """
+    Trie over normalized model names of all brands.
+    """
+
+    def __init__(self):
+        self.root: dict = {}
+        self.count = 0
+
+    def add(self, brand: str, model: str, alias: str | None = None) -> None:
+        key = _norm_model(alias or model)
+        if not key:
+            return
+        node = self.root
+        for ch in key:
+            node = node.setdefault(ch, {})
+        entries = node.setdefault(_END, [])
+        if (_norm_brand(brand), model) not in entries:
+            entries.append((_norm_brand(brand), model))
+            self.count += 1
+
+    def find(self, name: str, brand: str | None = None) -> str | None:
+        """
+        Longest known model of `brand` (any brand if None) named in `name`.
+        """
+        s, starts = _tokens(name or "")
+        want = _norm_brand(brand) if brand else None
+        best = None
+        for i in sorted(starts):
+            node, j = self.root, i
+            while j < len(s) and s[j] in node:
+                node = node[s[j]]
+                j += 1
+                if _END in node and self._ends_token(s, j, starts) and (best is None or j - i > best[0]):
+                    model = next((m for b, m in node[_END] if want is None or b == want), None)
+                    if model:
+                        best = (j - i, model)
+        return best[1] if best else None
+
+    @staticmethod
+    def _ends_token(s: str, j: int, starts: set[int]) -> bool:
+        if j == len(s) or j in starts:
+            return True
+        if s[j - 1].isdigit():
+            return not s[j].isdigit()        # C54 must not match inside C5400
+        return s[j] == "V" and j + 1 < len(s) and s[j + 1].isdigit()   # TL-WR841NV14: V14 is the revision
+
+def _load_catalog(index: ModelIndex) -> None:
+    for brand, model, aliases in catalog_entries():
+        index.add(brand, model)
+        for alias in aliases:
+            index.add(brand, model, alias)
+
+_INDEX: ModelIndex | None = None
+_INDEX_LOCK = threading.Lock()
+
+def model_index() -> ModelIndex:
+    """
+    The known-model trie, built on first use.
+    """
+    global _INDEX
+    if _INDEX is None:
+        with _INDEX_LOCK:
+            if _INDEX is None:
+                index = ModelIndex()
+                _load_catalog(index)
+                _INDEX = index
+    return _INDEX
+
+def _pattern_model(name: str) -> str | None:
+    stem = os.path.splitext(os.path.basename(name or ""))[0]
+    for m in _MODEL_PATTERN.finditer(stem):
+        base, suffix, rev_digit = m.group(1), m.group(2), m.group(3)
+        if rev_digit and suffix:
+            suffix = suffix[:-1]   # DIR865LA1: 'A1' is the hardware revision
+        letters = re.sub(r"[^A-Za-z]", "", base).upper()
+        if letters in _NOT_MODELS or (letters in _REVISIONS and sum(c.isdigit() for c in base) <= 2 and not suffix):
+            continue
+        return (base + suffix).upper()
+    return None
+
+def guess_model(brand: str | None, *names: str | None) -> str | None:
+    """
+    Model named by the first of `names` (firmware file name, scratch `name`
+    file, ...) that contains one: a known model of `brand` first, then any
+    vendor-style model id.
+    """
+    names = [n for n in names if n]
+    index = model_index()
+    for n in names:
+        found = index.find(n, brand)
+        if found:
+            return found
+    for n in names:
+        found = _pattern_model(n)
+        if found:
+            return found
+    return None
+
+def kb_backfill_models(db_path: str, limit: int = BACKFILL_BATCH) -> int:
+    """
+    Fill brand_norm/model_norm (and a guessed model) for runs stored before
+    they existed. Returns how many rows were updated.
+    """
+    kb_init(db_path)
+    con = kb_connect(db_path)
+    try:
+        rows = con.execute(
+            "SELECT id, brand, model, firmware FROM runs WHERE model_norm IS NULL LIMIT ?", (limit,)
+        ).fetchall()
+        updates = []
+        for run_id, brand, model, firmware in rows:
+            model = model or guess_model(brand, firmware)
+            updates.append((_norm_brand(brand) or None, model, _norm_model(model), run_id))
+        con.executemany("UPDATE runs SET brand_norm = ?, model = ?, model_norm = ? WHERE id = ?", updates)
+        con.commit()
+        return len(rows)
+    finally:
+        con.close()
+
+def _firmware_key(name: str | None) -> str:
+    return _norm_model(os.path.splitext(name or "")[0])
+
+def kb_import_records(db_path: str, csv_path: str) -> int:
+    """
+    Import the emulation_records.csv rows that have no KB run, once per CSV.
+    Rows pair with KB runs of the same firmware and brand, newest rows first,
+    so only the surplus (rows written before the KB existed) is imported.
+    Returns how many rows were imported.
+    """
+    if not os.path.exists(csv_path):
+        return 0
+    kb_init(db_path)
+    con = kb_connect(db_path)
+    try:
+        con.execute("""
+          CREATE TABLE IF NOT EXISTS record_imports (
+            path     TEXT PRIMARY KEY,
+            rows     INTEGER NOT NULL,
+            imported INTEGER NOT NULL,
+            at_ts    TEXT NOT NULL
+          )
+        """)
+        key_path = os.path.abspath(csv_path)
+        if con.execute("SELECT 1 FROM record_imports WHERE path = ?", (key_path,)).fetchone():
+            return 0
+        with open(csv_path, "r", encoding="utf-8", newline="") as f:
+            rows = [r for r in csv.DictReader(f) if (r.get("number") or "").strip().isdigit()]
+        recorded = Counter(
+            (_firmware_key(fw), _norm_brand(brand))
+            for fw, brand in con.execute("SELECT firmware, brand FROM runs WHERE record_number IS NULL")
+        )
+        known = {k for k, _ in recorded}
+
+        def key(r: dict) -> tuple[str, str]:
+            name = (r.get("firmware_name") or "").strip()
+            whole = _norm_model(name)   # `name` files usually hold the stem already
+            return (whole if whole in known else _firmware_key(name)), _norm_brand(r.get("brand"))
+
+        todo = []
+        for r in sorted(rows, key=lambda r: -int(r["number"])):
+            k = key(r)
+            if recorded[k] > 0:
+                recorded[k] -= 1
+            else:
+                todo.append(r)
+
+        def flag(v: str | None):
+            v = (v or "").strip().lower()
+            return 1 if v == "true" else (0 if v == "false" else None)
+
+        inserts = []
+        for r in sorted(todo, key=lambda r: int(r["number"])):
+            brand, name = (r.get("brand") or "").strip() or None, (r.get("firmware_name") or "").strip()
+            model = guess_model(brand, name)
+            inserts.append(("", brand, model, name, flag(r.get("result")), (r.get("architecture") or "").strip() or None,
+                            flag(r.get("ping")), flag(r.get("web")), _norm_brand(brand) or None, _norm_model(model),
+                            int(r["number"])))
+        con.executemany("""
+          INSERT INTO runs(ts, brand, model, firmware, result_bool, architecture, ping_bool, web_bool,
+                           brand_norm, model_norm, record_number)
+          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, inserts)
+        con.execute(
+            "INSERT INTO record_imports(path, rows, imported, at_ts) VALUES (?, ?, ?, ?)",
+            (key_path, len(rows), len(inserts), datetime.utcnow().isoformat(timespec="seconds") + "Z")
+        )
+        con.commit()
+        return len(inserts)
+    finally:
+        con.close()
+
+def start_backfill(db_path: str, records_csv: str | None = None) -> None:
+    """
+    Import emulation_records.csv (once, before returning, so the caller's
+    next query sees its rows), then fill brand_norm/model_norm of older runs
+    in a background thread (once per KB and process).
+    """
+    with _BACKFILL_LOCK:
+        if db_path in _BACKFILLING:
+            return
+        if records_csv:
+            try:
+                kb_import_records(db_path, records_csv)
+            except (OSError, csv.Error, sqlite3.Error):
+                return   # retried on the next call
+        _BACKFILLING.add(db_path)
+
+    def _run():
+        try:
+            while kb_backfill_models(db_path) > 0:
+                pass
+        except Exception:
+            with _BACKFILL_LOCK:
+                _BACKFILLING.discard(db_path)   # let a later call try again
+    threading.Thread(target=_run, name="models-backfill", daemon=True).start()
@@ -0,0 +1,107 @@
+import os, re, time, shutil, threading
+from firmae_lib.analysis import LOG_NAMES
+from firmae_lib.scratch import scratch_index
+from firmae_lib.archive import kb_archive_logs
+
+# ---- scratch disk quota: LRU eviction of finished IIDs before a new run ----
+# Limits come from the environment (both optional, sizes accept K/M/G/T suffixes):
+#   FIRMAE_SCRATCH_QUOTA     max bytes used by scratch/<iid> dirs
+#   FIRMAE_SCRATCH_MIN_FREE  free-space watermark on the scratch filesystem
+
+_EVICT_LOCK = threading.Lock()
+UNFINISHED_GRACE = 3600   # seconds an IID without a `result` file counts as possibly running
+
+def _parse_size(s: str | int | None) -> int | None:
+    if s is None or s == "":
+        return None
+    if isinstance(s, int):
+        return s
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", str(s), re.I)
+    if not m:
+        return None
+    mult = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}[m.group(2).upper()]
+    return int(float(m.group(1)) * mult)
+
+def quota_limits() -> tuple[int | None, int | None]:
+    """
+    (max_bytes, min_free_bytes) from the environment.
+    """
+    return _parse_size(os.environ.get("FIRMAE_SCRATCH_QUOTA")), _parse_size(os.environ.get("FIRMAE_SCRATCH_MIN_FREE"))
+
+def _last_used(path: str) -> float:
+    """
+    Newest mtime of the IID dir and its logs.
+    """
+    newest = 0.0
+    for p in (path, *(os.path.join(path, n) for n in LOG_NAMES)):
+        try:
+            newest = max(newest, os.stat(p).st_mtime)
+        except OSError:
+            pass
+    return newest
+
+def enforce_scratch_quota(
+    db_path: str,
+    scratch_root: str,
+    *,
+    max_bytes: int | None = None,
+    min_free_bytes: int | None = None,
+    protected: set[int] | None = None
+) -> list[dict]:
+    """
+    Evict least-recently-used scratch IIDs until usage is under `max_bytes`
+    (leaving room for one more average-sized IID) and the filesystem has at
+    least `min_free_bytes` free. IIDs in `protected` (running emulations) are
+    never evicted, nor are unfinished IIDs (no `result` file) used within
+    UNFINISHED_GRACE seconds, which may belong to a run nobody has claimed
+    yet. Logs are archived to the KB before an IID is deleted.
+    Returns [{iid, bytes, archived}] for evicted IIDs.
+    """
+    if max_bytes is None and min_free_bytes is None:
+        return []
+    if not os.path.isdir(scratch_root):
+        return []
+    protected = protected or set()
+    index = scratch_index(scratch_root)
+
+    with _EVICT_LOCK:
+        ids = index.ids()
+        usage = {iid: index.disk_usage(iid) for iid in ids}
+        used = sum(usage.values())
+        reserve = used // len(ids) if ids else 0
+
+        def _free() -> int:
+            try:
+                return shutil.disk_usage(scratch_root).free
+            except OSError:
+                return 0
+
+        def _over() -> bool:
+            if max_bytes is not None and used + reserve > max_bytes:
+                return True
+            return min_free_bytes is not None and _free() < min_free_bytes
+
+        evicted = []
+        now = time.time()
+        last_used = {i: _last_used(index.path(i)) for i in ids if i not in protected}
+        candidates = sorted(
+            (i for i in last_used
+             if os.path.exists(os.path.join(index.path(i), "result")) or now - last_used[i] > UNFINISHED_GRACE),
+            key=last_used.get
+        )
+        for iid in candidates:
+            if not _over():
+                break
+            path = index.path(iid)
+            try:
+                archived = len(kb_archive_logs(db_path, path))
+            except Exception:
+                archived = 0
+            try:
+                shutil.rmtree(path)
+            except Exception:
+                continue
+            index.forget(iid)
+            used -= usage[iid]
+            evicted.append({"iid": iid, "bytes": usage[iid], "archived": archived})
+        return evicted
@@ -0,0 +1,243 @@
+import os, json, time, uuid, shutil, threading
+from urllib.parse import urlsplit, parse_qs, quote, unquote
+from firmae_lib.archive import kb_list_archived_logs, kb_read_archived_log
+
+# ---- server-side store for large tool output, exposed as MCP resources ----
+# Tool responses carry a short excerpt plus affirm:// URIs; clients fetch the
+# rest with resources/read, optionally ranged (offset/length in bytes, as
+# params or as a ?offset=&length= query on the URI).
+#   affirm://out/<group>/<name>         text stored by a tool call
+#   affirm://runs/<run_id>/logs/<name>  full log archived in the KB for a run
+# <root>/<group>/meta.json lists a group's items; groups beyond
+# FIRMAE_RESOURCE_KEEP (default 200) are dropped oldest first.
+
+SCHEME = "affirm"
+INLINE_MAX = 8000       # characters of one output kept inline before it becomes a resource
+READ_MAX = 256_000      # default/maximum bytes per resources/read
+RUN_LOG_TEMPLATE = f"{SCHEME}://runs/{{run_id}}/logs/{{name}}"
+
+class ResourceNotFound(KeyError):
+    pass
+
+def _excerpt(text: str, limit: int) -> str:
+    """The last whole lines of `text` fitting in `limit` characters."""
+    tail = text[-limit:]
+    cut = tail.find("\n")
+    return tail[cut + 1:] if 0 <= cut < len(tail) - 1 else tail
+
+def _char_cut(data: bytes, n: int) -> int:
+    """
+    `n`, moved back so that data[:n] does not end inside a UTF-8 character
+    (forward to the end of the first character if that would leave nothing).
+    """
+    if n >= len(data):
+        return len(data)
+    back = 0
+    while back < 4 and back < n and data[n - back] & 0xC0 == 0x80:
+        back += 1
+    if back == 4 or data[n - back] & 0xC0 == 0x80:
+        return n   # not UTF-8 here; keep the byte range as asked
+    if back < n:
+        return n - back
+    while n < len(data) and data[n] & 0xC0 == 0x80:
+        n += 1
+    return n
+
+def run_log_uri(run_id: int, name: str) -> str:
+    return RUN_LOG_TEMPLATE.format(run_id=run_id, name=quote(name))
+
+class ResourceStore:
+    def __init__(self, root: str, db_path: str, inline_max: int | None = INLINE_MAX, keep: int | None = None):
+        self.root = root
+        self.db_path = db_path
+        self.inline_max = inline_max
+        self.keep = keep if keep is not None else int(os.environ.get("FIRMAE_RESOURCE_KEEP") or 200)
+        self._lock = threading.Lock()
+
+    # -- writing --
+
+    def new_group(self, label: str) -> str:
+        """A fresh group id for one tool call, e.g. 'emulate-20250101T120000-1a2b3c'."""
+        return f"{label}-{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+    def _write_meta(self, group: str, item: dict) -> None:
+        gdir = os.path.join(self.root, group)
+        meta_path = os.path.join(gdir, "meta.json")
+        with self._lock:
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = {"group": group, "created": time.time(), "items": {}}
+            meta["items"][item["name"]] = item
+            with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(meta_path + ".tmp", meta_path)
+
+    def put(self, group: str, name: str, text: str, description: str = "", mime: str = "text/plain") -> str:
+        """
+        Store `text` as group/name and return its URI.
+        """
+        gdir = os.path.join(self.root, group)
+        os.makedirs(gdir, exist_ok=True)
+        path = os.path.join(gdir, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        self._write_meta(group, {"name": name, "file": name, "description": description, "mimeType": mime})
+        self._prune()
+        return f"{SCHEME}://out/{group}/{quote(name)}"
+
+    def link(self, group: str, name: str, path: str, description: str = "", mime: str = "text/plain") -> str:
+        """
+        Expose an existing file (e.g. a build log that is still growing) without copying it.
+        """
+        os.makedirs(os.path.join(self.root, group), exist_ok=True)
+        self._write_meta(group, {"name": name, "path": os.path.abspath(path), "description": description, "mimeType": mime})
+        self._prune()
+        return f"{SCHEME}://out/{group}/{quote(name)}"
+
+    def clip(self, group: str, name: str, text: str, limit: int | None = None, description: str = "") -> str:
+        """
+        `text` itself when short enough; otherwise store it and return its last
+        lines plus a pointer to the full resource.
+        """
+        limit = limit if limit is not None else self.inline_max
+        if limit is None or len(text) <= limit:
+            return text
+        uri = self.put(group, name, text, description or name)
+        size = len(text.encode("utf-8"))
+        return (f"[... {size} bytes, showing the end; full {name}: {uri} (resources/read, ranged)]\n"
+                + _excerpt(text, max(200, limit // 2)))
+
+    def compact_result(self, result: dict, label: str) -> dict:
+        """
+        Clip every oversized text item of a tool result (used for results that
+        were produced elsewhere, e.g. by fan-out workers).
+        """
+        if self.inline_max is None:
+            return result
+        group = None
+        for i, item in enumerate(result.get("content") or []):
+            text = item.get("text") if item.get("type") == "text" else None
+            if text is None or len(text) <= self.inline_max:
+                continue
+            group = group or self.new_group(label)
+            head = text[:self.inline_max // 4]
+            item["text"] = head + "\n" + self.clip(group, f"content-{i}.txt", text, description=f"{label} output item {i}")
+        return result
+
+    def _prune(self) -> None:
+        if not self.keep:
+            return
+        try:
+            groups = [os.path.join(self.root, g) for g in os.listdir(self.root)]
+        except OSError:
+            return
+        groups = [g for g in groups if os.path.isdir(g)]
+        if len(groups) <= self.keep:
+            return
+        groups.sort(key=lambda g: os.path.getmtime(g))
+        for g in groups[:len(groups) - self.keep]:
+            shutil.rmtree(g, ignore_errors=True)
+
+    # -- reading --
+
+    def list(self, cursor: str | None = None, limit: int = 100) -> dict:
+        """
+        resources/list result, newest group first, paged by an opaque cursor.
+        """
+        items = []
+        try:
+            groups = sorted((g for g in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, g))),
+                            key=lambda g: os.path.getmtime(os.path.join(self.root, g)), reverse=True)
+        except OSError:
+            groups = []
+        for g in groups:
+            try:
+                with open(os.path.join(self.root, g, "meta.json"), "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for it in meta.get("items", {}).values():
+                path = it.get("path") or os.path.join(self.root, g, it["file"])
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    continue
+                items.append({
+                    "uri": f"{SCHEME}://out/{g}/{quote(it['name'])}",
+                    "name": f"{g}/{it['name']}",
+                    "description": it.get("description") or "",
+                    "mimeType": it.get("mimeType") or "text/plain",
+                    "size": size,
+                })
+        start = int(cursor or 0)
+        page = {"resources": items[start:start + limit]}
+        if start + limit < len(items):
+            page["nextCursor"] = str(start + limit)
+        return page
+
+    def templates(self) -> dict:
+        return {"resourceTemplates": [{
+            "uriTemplate": RUN_LOG_TEMPLATE,
+            "name": "Archived run log",
+            "description": "Full makeImage/makeNetwork/serial/emulation log of a KB run (see firmae.logs for names)",
+            "mimeType": "text/plain",
+        }]}
+
+    def _run_log(self, run_id: int, name: str) -> bytes:
+        for a in kb_list_archived_logs(self.db_path, run_id=run_id):
+            if a["name"] == name:
+                return kb_read_archived_log(self.db_path, a["id"]).encode("utf-8")
+        raise ResourceNotFound(f"run {run_id} log {name}")
+
+    def _out_path(self, group: str, name: str) -> tuple[str, str]:
+        try:
+            with open(os.path.join(self.root, group, "meta.json"), "r", encoding="utf-8") as f:
+                it = json.load(f)["items"][name]
+        except (OSError, ValueError, KeyError):
+            raise ResourceNotFound(f"{group}/{name}")
+        return it.get("path") or os.path.join(self.root, group, it["file"]), it.get("mimeType") or "text/plain"
+
+    def read(self, uri: str, offset: int | None = None, length: int | None = None) -> dict:
+        """
+        resources/read result for `uri`. A byte range comes from the arguments
+        or the URI query; `_meta` reports it with the total size and next offset,
+        which is always on a UTF-8 character boundary.
+        """
+        parts = urlsplit(uri)
+        q = parse_qs(parts.query)
+        offset = max(0, int(offset if offset is not None else (q.get("offset") or [0])[0]))
+        length = int(length if length is not None else (q.get("length") or [READ_MAX])[0])
+        length = max(1, min(length, READ_MAX))
+        base = parts._replace(query="").geturl()
+
+        segs = [unquote(s) for s in parts.path.strip("/").split("/")]
+        if parts.scheme != SCHEME or ".." in segs:
+            raise ResourceNotFound(uri)
+        if parts.netloc == "out" and len(segs) == 2:
+            path, mime = self._out_path(*segs)
+            try:
+                total = os.path.getsize(path)
+                with open(path, "rb") as f:
+                    f.seek(offset)
+                    data = f.read(length + 3)   # room to finish a character cut by `length`
+            except OSError:
+                raise ResourceNotFound(uri)
+        elif parts.netloc == "runs" and len(segs) == 3 and segs[0].isdigit() and segs[1] == "logs":
+            blob, mime = self._run_log(int(segs[0]), segs[2]), "text/plain"
+            total = len(blob)
+            data = blob[offset:offset + length + 3]
+        else:
+            raise ResourceNotFound(uri)
+        # ranges stay byte offsets, but a chunk never ends inside a character,
+        # so following next_offset decodes every chunk cleanly
+        data = data[:_char_cut(data, length)]
+        end = offset + len(data)
+        meta = {"offset": offset, "length": len(data), "total": total}
+        if end < total:
+            meta["next_offset"] = end
+        return {
+            "contents": [{"uri": base, "mimeType": mime, "text": data.decode("utf-8", "replace")}],
+            "_meta": meta,
+        }
@@ -0,0 +1,180 @@
+import os, threading, time
+
+# ---- scratch/<iid> metadata index ----
+# One listdir of scratch/ per change of its mtime, and one read of each IID's
+# small status files per change of that IID dir's mtime. Finished IIDs (with a
+# `result` file) are effectively immutable, so thousands of them cost nothing.
+
+META_FILES = ("name", "architecture", "brand", "ping", "web", "result")
+
+def _safe_read(path: str) -> str:
+    try:
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read().strip()
+    except Exception:
+        pass
+    return ""
+
+def _parse_bool(s: str):
+    """
+    Convert common truthy/falsey strings to bool.
+    Returns True/False, or None if indeterminate/empty.
+    """
+    if s is None:
+        return None
+    s = s.strip().lower()
+    if not s:
+        return None
+
+    # BOOLEAN PARSE LOGIC - look for these values
+    # Adjust where necessary
+    truthy = {"1", "true", "yes", "y", "ok", "success", "on", "reachable", "up"}
+    falsy  = {"0", "false", "no", "n", "fail", "failed", "off", "unreachable", "down"}
+    
+    if s in truthy:
+        return True
+    if s in falsy:
+        return False
+        
+    # Try numeric fallback
+    try:
+        return float(s) != 0.0
+    except Exception:
+        return None
+
+def _dir_usage(path: str) -> int:
+    total = 0
+    stack = [path]
+    while stack:
+        d = stack.pop()
+        try:
+            with os.scandir(d) as it:
+                for e in it:
+                    try:
+                        if e.is_dir(follow_symlinks=False):
+                            stack.append(e.path)
+                        else:
+                            total += e.stat(follow_symlinks=False).st_blocks * 512
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+    return total
+
+class ScratchIndex:
+    """
+    Cached IID -> metadata map for one scratch root, refreshed by mtime.
+    """
+
+    def __init__(self, scratch_root: str, usage_ttl: float = 30.0):
+        self.scratch_root = scratch_root
+        self.usage_ttl = usage_ttl
+        self._lock = threading.Lock()
+        self._root_mtime = None
+        self._ids: list[int] = []
+        self._meta: dict[int, tuple[int, dict]] = {}            # iid -> (dir mtime_ns, meta)
+        self._usage: dict[int, tuple[int, float, int]] = {}     # iid -> (dir mtime_ns, computed at, bytes)
+
+    def _refresh_locked(self) -> None:
+        try:
+            mtime = os.stat(self.scratch_root).st_mtime_ns
+        except OSError:
+            self._root_mtime, self._ids = None, []
+            self._meta.clear()
+            self._usage.clear()
+            return
+        if mtime == self._root_mtime:
+            return
+        try:
+            ids = sorted(int(d) for d in os.listdir(self.scratch_root) if d.isdigit())
+        except OSError:
+            ids = []
+        self._root_mtime, self._ids = mtime, ids
+        live = set(ids)
+        for cache in (self._meta, self._usage):
+            for iid in [i for i in cache if i not in live]:
+                del cache[iid]
+
+    def ids(self) -> list[int]:
+        with self._lock:
+            self._refresh_locked()
+            return list(self._ids)
+
+    def path(self, iid: int) -> str:
+        return os.path.join(self.scratch_root, str(iid))
+
+    def latest(self) -> str | None:
+        ids = self.ids()
+        return self.path(ids[-1]) if ids else None
+
+    def meta(self, iid: int) -> dict:
+        """
+        Parsed status files of one IID:
+        {iid, path, mtime, name, architecture, brand, ping, web, result}
+        (ping/web/result are True/False/None; text fields are "" if missing).
+        """
+        d = self.path(iid)
+        try:
+            mtime = os.stat(d).st_mtime_ns
+        except OSError:
+            return {}
+        with self._lock:
+            cached = self._meta.get(iid)
+        # Unfinished IIDs may rewrite files in place, which doesn't bump the dir mtime
+        if cached and cached[0] == mtime and cached[1]["result"] is not None:
+            return dict(cached[1])
+
+        raw = {f: _safe_read(os.path.join(d, f)) for f in META_FILES}
+        meta = {
+            "iid": iid,
+            "path": d,
+            "mtime": mtime / 1e9,
+            "name": raw["name"],
+            "architecture": raw["architecture"],
+            "brand": raw["brand"],
+            "ping": _parse_bool(raw["ping"]),
+            "web": _parse_bool(raw["web"]),
+            "result": _parse_bool(raw["result"]),
+        }
+        with self._lock:
+            self._meta[iid] = (mtime, meta)
+        return dict(meta)
+
+    def disk_usage(self, iid: int) -> int:
+        """
+        Bytes used by scratch/<iid> (cached; recomputed when the dir changes or after usage_ttl).
+        """
+        d = self.path(iid)
+        try:
+            mtime = os.stat(d).st_mtime_ns
+        except OSError:
+            return 0
+        now = time.time()
+        with self._lock:
+            cached = self._usage.get(iid)
+        if cached and cached[0] == mtime and now - cached[1] < self.usage_ttl:
+            return cached[2]
+        size = _dir_usage(d)
+        with self._lock:
+            self._usage[iid] = (mtime, now, size)
+        return size
+
+    def forget(self, iid: int) -> None:
+        with self._lock:
+            self._meta.pop(iid, None)
+            self._usage.pop(iid, None)
+            self._root_mtime = None
+
+_INDEXES: dict[str, ScratchIndex] = {}
+_INDEXES_LOCK = threading.Lock()
+
+def scratch_index(scratch_root: str) -> ScratchIndex:
+    """
+    Shared ScratchIndex for `scratch_root` (one per directory per process).
+    """
+    key = os.path.abspath(scratch_root)
+    with _INDEXES_LOCK:
+        if key not in _INDEXES:
+            _INDEXES[key] = ScratchIndex(key)
+        return _INDEXES[key]
@@ -0,0 +1,226 @@
+import json, math, sqlite3, hashlib, threading
+from collections import defaultdict
+from firmae_lib.clusters import _mask_log, _texts_from_analysis, _init_cluster_tables
+from firmae_lib.condense import condensed_lines
+from firmae_lib.sqlite_helper import kb_init, kb_connect
+
+# ---- similar past failures, from hashed line vectors with an inverted index ----
+# Each failed run is reduced to a small sparse vector: the masked log lines the
+# condenser ranks closest to the failure (FEATURE_BUDGET tokens' worth) plus its
+# reason titles, each hashed to 64 bits. failure_postings (term, run_id) is the
+# inverted index and failure_terms keeps each term's document frequency, so a
+# query is one PK lookup for the weights plus a bounded range scan per term
+# (newest POSTINGS_PER_TERM runs); nothing scans the analyses. Candidates score
+# by the idf-weighted share of the query's terms they contain.
+# Each hit carries its outcome: reasons, cluster, LLM verdict, and the first
+# later run of the same firmware that succeeded (the fix that worked).
+
+FEATURE_BUDGET    = 300     # condensed tokens per run turned into features (~20-30 lines)
+MIN_LINE          = 8       # masked lines shorter than this are too generic to be features
+MAX_TERMS         = 24      # rarest query terms looked up
+POSTINGS_PER_TERM = 500     # newest runs read per term
+MIN_SIMILARITY    = 0.15
+BACKFILL_BATCH    = 500
+N_DOCS_TERM       = 0       # failure_terms row whose df counts indexed runs
+
+_BACKFILLING: set[str] = set()
+_BACKFILL_LOCK = threading.Lock()
+
+def _init_similar_tables(con) -> None:
+    con.executescript("""
+    CREATE TABLE IF NOT EXISTS failure_terms (
+      term INTEGER PRIMARY KEY,
+      df   INTEGER NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS failure_postings (
+      term   INTEGER NOT NULL,
+      run_id INTEGER NOT NULL,
+      PRIMARY KEY (term, run_id)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS failure_vectors (
+      run_id  INTEGER PRIMARY KEY REFERENCES runs(id) ON DELETE CASCADE,
+      n_terms INTEGER NOT NULL
+    );
+    """)
+
+def _term(key: str) -> int:
+    h = int.from_bytes(hashlib.blake2b(key.encode("utf-8", "replace"), digest_size=8).digest(), "big", signed=True)
+    return h or 1   # 0 is the document counter
+
+def failure_terms(texts: dict[str, str], reasons: list[str] | None = None) -> set[int]:
+    """
+    Hashed features of one failure: masked condensed lines and reason titles.
+    """
+    terms = {_term(f"reason:{r}") for r in reasons or []}
+    for line in condensed_lines(texts, reasons, FEATURE_BUDGET):
+        key = " ".join(_mask_log(line).split())
+        if len(key) >= MIN_LINE and not key.startswith("[... "):
+            terms.add(_term(key))
+    return terms
+
+def _index(con, run_id: int, terms: set[int]) -> bool:
+    if not terms or con.execute("SELECT 1 FROM failure_vectors WHERE run_id = ?", (run_id,)).fetchone():
+        return False
+    con.execute("INSERT INTO failure_vectors(run_id, n_terms) VALUES (?, ?)", (run_id, len(terms)))
+    con.executemany("INSERT OR IGNORE INTO failure_postings(term, run_id) VALUES (?, ?)", [(t, run_id) for t in terms])
+    con.executemany(
+        "INSERT INTO failure_terms(term, df) VALUES (?, 1) ON CONFLICT(term) DO UPDATE SET df = df + 1",
+        [(t,) for t in terms | {N_DOCS_TERM}]
+    )
+    return True
+
+def kb_index_failure(db_path: str, run_id: int, texts: dict[str, str], reasons: list[str] | None = None) -> set[int]:
+    """
+    Add a failed run to the similarity index. Returns its terms (for kb_similar_failures).
+    """
+    terms = failure_terms(texts, reasons)
+    kb_init(db_path)
+    con = kb_connect(db_path)
+    try:
+        _init_similar_tables(con)
+        _index(con, run_id, terms)
+        con.commit()
+    finally:
+        con.close()
+    return terms
+
+def kb_backfill_similar(db_path: str, limit: int = BACKFILL_BATCH) -> int:
+    """
+    Index failed runs that predate the similarity index, from their stored
+    heuristic analysis text. Returns how many runs were indexed.
+    """
+    kb_init(db_path)
+    con = kb_connect(db_path)
+    try:
+        _init_similar_tables(con)
+        rows = con.execute("""
+          SELECT r.id, a.content, a.reasons_json
+          FROM runs r
+          JOIN analyses a ON a.run_id = r.id AND a.source = 'heuristic'
+          LEFT JOIN failure_vectors v ON v.run_id = r.id
+          WHERE r.result_bool = 0 AND v.run_id IS NULL
+          GROUP BY r.id
+          ORDER BY r.id
+          LIMIT ?
+        """, (limit,)).fetchall()
+        done = 0
+        for run_id, content, reasons_json in rows:
+            try:
+                reasons = (json.loads(reasons_json or "{}") or {}).get("reasons") or []
+            except ValueError:
+                reasons = []
+            texts = _texts_from_analysis(content or "") or {"analysis": content or ""}
+            terms = failure_terms(texts, reasons)
+            # runs without usable text still get a (sentinel) row so they are not retried forever
+            if not _index(con, run_id, terms or {_term("empty")}):
+                continue
+            done += 1
+        con.commit()
+        return done
+    finally:
+        con.close()
+
+def start_backfill(db_path: str) -> None:
+    """
+    Index all older failures in a background thread (once per KB and process).
+    """
+    with _BACKFILL_LOCK:
+        if db_path in _BACKFILLING:
+            return
+        _BACKFILLING.add(db_path)
+
+    def _run():
+        try:
+            while kb_backfill_similar(db_path) > 0:
+                pass
+        except Exception:
+            with _BACKFILL_LOCK:
+                _BACKFILLING.discard(db_path)   # let a later failure try again
+    threading.Thread(target=_run, name="similar-backfill", daemon=True).start()
+
+def _outcome(con, run: sqlite3.Row) -> dict:
+    """
+    Reasons, cluster, LLM verdict and the first later success of the same firmware.
+    """
+    out = {"reasons": [], "cluster_id": None, "llm": None, "fixed_by": None}
+    row = con.execute(
+        "SELECT reasons_json FROM analyses WHERE run_id = ? AND source = 'heuristic' ORDER BY id DESC LIMIT 1",
+        (run["id"],)
+    ).fetchone()
+    if row and row[0]:
+        try:
+            out["reasons"] = (json.loads(row[0]) or {}).get("reasons") or []
+        except ValueError:
+            pass
+    row = con.execute("SELECT cluster_id FROM failure_fingerprints WHERE run_id = ?", (run["id"],)).fetchone()
+    out["cluster_id"] = row[0] if row else None
+    row = con.execute(
+        "SELECT summary FROM analyses WHERE run_id = ? AND source = 'llm' ORDER BY id DESC LIMIT 1", (run["id"],)
+    ).fetchone()
+    out["llm"] = row[0] if row else None
+    if run["firmware"]:
+        fix = con.execute("""
+          SELECT id, ts, architecture, timeout_sec, brand FROM runs
+          WHERE firmware = ? AND result_bool = 1 AND id > ? ORDER BY id LIMIT 1
+        """, (run["firmware"], run["id"])).fetchone()
+        if fix:
+            changed = []
+            if fix["timeout_sec"] and fix["timeout_sec"] != run["timeout_sec"]:
+                changed.append(f"timeout {run['timeout_sec'] or 'default'}s -> {fix['timeout_sec']}s")
+            if fix["architecture"] and fix["architecture"] != run["architecture"]:
+                changed.append(f"architecture {run['architecture'] or '?'} -> {fix['architecture']}")
+            if (fix["brand"] or "") != (run["brand"] or ""):
+                changed.append(f"brand {run['brand'] or '?'} -> {fix['brand'] or '?'}")
+            out["fixed_by"] = {"run_id": fix["id"], "ts": fix["ts"], "changed": changed}
+    return out
+
+def kb_similar_failures(db_path: str, terms: set[int], *, exclude_run: int | None = None, k: int = 3) -> list[dict]:
+    """
+    The k indexed failures sharing the most idf-weighted terms with `terms`
+    (best first), each with {run_id, ts, brand, firmware, architecture,
+    similarity, reasons, cluster_id, llm, fixed_by}.
+    """
+    if not terms:
+        return []
+    kb_init(db_path)
+    con = kb_connect(db_path)
+    con.row_factory = sqlite3.Row
+    try:
+        _init_similar_tables(con)
+        _init_cluster_tables(con)
+        wanted = list(terms | {N_DOCS_TERM})
+        df = dict(con.execute(
+            f"SELECT term, df FROM failure_terms WHERE term IN ({','.join('?' * len(wanted))})", wanted
+        ).fetchall())
+        n_docs = df.pop(N_DOCS_TERM, 0)
+        own = 1 if exclude_run is not None else 0   # exclude_run is expected to be indexed already
+        idf = {t: math.log(1 + n_docs / max(1, df.get(t, 0) - own)) for t in terms}
+        weights = {t: idf[t] for t in terms if df.get(t, 0) > own}
+        total = sum(idf.values()) or 1.0
+        scores: dict[int, float] = defaultdict(float)
+        for t, w in sorted(weights.items(), key=lambda kv: -kv[1])[:MAX_TERMS]:
+            for (run_id,) in con.execute(
+                "SELECT run_id FROM failure_postings WHERE term = ? ORDER BY run_id DESC LIMIT ?", (t, POSTINGS_PER_TERM)
+            ):
+                if run_id != exclude_run:
+                    scores[run_id] += w
+        best = sorted(scores.items(), key=lambda kv: (-kv[1], -kv[0]))
+        out = []
+        for run_id, score in best:
+            similarity = score / total
+            if similarity < MIN_SIMILARITY or len(out) >= k:
+                break
+            run = con.execute(
+                "SELECT id, ts, brand, firmware, architecture, timeout_sec FROM runs WHERE id = ?", (run_id,)
+            ).fetchone()
+            if not run:
+                continue
+            out.append(dict(
+                run_id=run_id, ts=run["ts"], brand=run["brand"], firmware=run["firmware"],
+                architecture=run["architecture"], similarity=round(min(similarity, 1.0), 2), **_outcome(con, run),
+            ))
+        return out
+    finally:
+        con.close()
@@ -1,11 +1,75 @@
 # firmae_lib/kb.py
 import os
+import re
 import json
 import sqlite3
+import threading
 from datetime import datetime
 
+# Databases already initialised/migrated by this process
+_KB_READY: set[str] = set()
+_KB_INIT_LOCK = threading.Lock()
+
+# Columns added after the first release; kb_init adds them to older databases
+_RUNS_EXTRA_COLUMNS = {
+    "architecture":   "TEXT",
+    "timeout_sec":    "INTEGER",
+    "timeout_reason": "TEXT",
+    "ping_bool":      "INTEGER",
+    "web_bool":       "INTEGER",
+    "brand_norm":     "TEXT",   # _norm_brand(brand)
+    "model_norm":     "TEXT",   # _norm_model(model); '' when no model could be inferred
+    "record_number":  "INTEGER",   # emulation_records.csv number of a row imported from the CSV
+}
+
+# Keep the external-content FTS index in step with analyses
+_ANALYSES_FTS_TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS analyses_fts_ai AFTER INSERT ON analyses BEGIN
+  INSERT INTO analyses_fts(rowid, summary, content) VALUES (new.id, new.summary, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS analyses_fts_ad AFTER DELETE ON analyses BEGIN
+  INSERT INTO analyses_fts(analyses_fts, rowid, summary, content) VALUES ('delete', old.id, old.summary, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS analyses_fts_au AFTER UPDATE ON analyses BEGIN
+  INSERT INTO analyses_fts(analyses_fts, rowid, summary, content) VALUES ('delete', old.id, old.summary, old.content);
+  INSERT INTO analyses_fts(rowid, summary, content) VALUES (new.id, new.summary, new.content);
+END;
+"""
+
+# Parallel emulations all write to the KB as they finish; wait for the lock
+# instead of failing with "database is locked" after sqlite's 5s default.
+KB_BUSY_TIMEOUT = 30.0
+
+def kb_connect(db_path: str) -> sqlite3.Connection:
+    return sqlite3.connect(db_path, timeout=KB_BUSY_TIMEOUT)
+
+def _norm_brand(brand: str | None) -> str:
+    return (brand or "").upper().replace("-", "").replace(" ", "")
+
+def _norm_model(model: str | None) -> str:
+    """
+    'Archer AX73', 'archer_ax73' and 'ARCHER-AX73' all become 'ARCHERAX73'.
+    """
+    return re.sub(r"[^A-Z0-9]", "", (model or "").upper())
+
+# SQL twin of _norm_brand, to fill brand_norm of runs stored before it existed
+_BRAND_NORM_SQL = "REPLACE(REPLACE(UPPER({col}), '-', ''), ' ', '')"
+
+def _ensure_columns(cur, table: str, columns: dict[str, str]) -> None:
+    have = {row[1] for row in cur.execute(f"PRAGMA table_info({table})")}
+    for col, decl in columns.items():
+        if col not in have:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {col} {decl}")
+
 def kb_init(db_path: str) -> None:
-    con = sqlite3.connect(db_path)
+    if db_path in _KB_READY:
+        return
+    with _KB_INIT_LOCK:
+        if db_path not in _KB_READY:
+            _kb_init_locked(db_path)
+
+def _kb_init_locked(db_path: str) -> None:
+    con = kb_connect(db_path)
     cur = con.cursor()
     cur.executescript("""
     PRAGMA journal_mode=WAL;
@@ -36,8 +100,30 @@ def kb_init(db_path: str) -> None:
       summary, content, content='analyses', content_rowid='id'
     );
     """)
+    _ensure_columns(cur, "runs", _RUNS_EXTRA_COLUMNS)
+    had_triggers = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'analyses_fts_ai'"
+    ).fetchone()
+    cur.executescript(_ANALYSES_FTS_TRIGGERS)
+    if not had_triggers:
+        # Rows indexed by hand before the triggers existed may be stale
+        cur.execute("INSERT INTO analyses_fts(analyses_fts) VALUES ('rebuild')")
+    # runs stored before brand_norm existed; the index makes this a no-op afterwards
+    cur.execute("CREATE INDEX IF NOT EXISTS runs_brand_model ON runs(brand_norm, model_norm)")
+    cur.execute(
+        f"UPDATE runs SET brand_norm = NULLIF({_BRAND_NORM_SQL.format(col='brand')}, '') "
+        "WHERE brand_norm IS NULL AND brand IS NOT NULL"
+    )
+    # timeout advice filters successful runs by brand_norm and architecture
+    cur.execute("DROP INDEX IF EXISTS runs_brand_arch")
+    cur.execute("CREATE INDEX IF NOT EXISTS runs_brand_norm_arch ON runs(brand_norm, architecture)")
+    cur.execute("CREATE INDEX IF NOT EXISTS runs_firmware_result ON runs(firmware, result_bool)")
+    cur.execute("CREATE INDEX IF NOT EXISTS analyses_run_source ON analyses(run_id, source)")
+    cur.execute("CREATE INDEX IF NOT EXISTS runs_model ON runs(model_norm)")
+    cur.execute("CREATE INDEX IF NOT EXISTS runs_record ON runs(record_number) WHERE record_number IS NOT NULL")
     con.commit()
     con.close()
+    _KB_READY.add(db_path)
 
 def kb_insert_run(
     db_path: str,
@@ -48,19 +134,32 @@ def kb_insert_run(
     iid_dir: str | None,
     exit_code: int,
     result_bool: bool | None,
-    duration_sec: float
+    duration_sec: float,
+    architecture: str | None = None,
+    timeout_sec: int | None = None,
+    timeout_reason: str | None = None,
+    ping_bool: bool | None = None,
+    web_bool: bool | None = None
 ) -> int:
     kb_init(db_path)
-    con = sqlite3.connect(db_path)
+    con = kb_connect(db_path)
     cur = con.cursor()
     cur.execute("""
-      INSERT INTO runs(ts, brand, model, firmware, iid_dir, exit_code, result_bool, duration_sec)
-      VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+      INSERT INTO runs(ts, brand, model, firmware, iid_dir, exit_code, result_bool, duration_sec,
+                       architecture, timeout_sec, timeout_reason, ping_bool, web_bool, brand_norm, model_norm)
+      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     """, (
       datetime.utcnow().isoformat(timespec="seconds") + "Z",
       brand, model, firmware, iid_dir, int(exit_code),
       None if result_bool is None else (1 if result_bool else 0),
       float(duration_sec),
+      architecture or None,
+      None if timeout_sec is None else int(timeout_sec),
+      timeout_reason,
+      None if ping_bool is None else (1 if ping_bool else 0),
+      None if web_bool is None else (1 if web_bool else 0),
+      _norm_brand(brand) or None,
+      _norm_model(model),
     ))
     run_id = cur.lastrowid
     con.commit()
@@ -79,7 +178,7 @@ def kb_insert_analysis(
 ) -> int:
     kb_init(db_path)
     bounded = content if len(content) <= max_content else (content[:max_content] + "\n\n[truncated]")
-    con = sqlite3.connect(db_path)
+    con = kb_connect(db_path)
     cur = con.cursor()
     cur.execute("""
       INSERT INTO analyses(run_id, at_ts, source, summary, content, reasons_json)
@@ -93,8 +192,75 @@ def kb_insert_analysis(
       json.dumps(reasons_json, ensure_ascii=False) if isinstance(reasons_json, dict) else reasons_json
     ))
     rowid = cur.lastrowid
-    cur.execute("INSERT INTO analyses_fts(rowid, summary, content) VALUES (?, ?, ?)",
-                (rowid, summary or "", bounded))
     con.commit()
     con.close()
     return rowid
+
+def _fts_query(text: str, match_any: bool = False) -> str:
+    """
+    Quote each word of free text so FTS5 operators/punctuation can't break the MATCH.
+    """
+    words = [w for w in text.replace('"', " ").split() if w]
+    return (" OR " if match_any else " ").join(f'"{w}"' for w in words)
+
+def kb_search(
+    db_path: str,
+    query: str,
+    *,
+    brand: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    source: str | None = None,
+    match_any: bool = False,
+    limit: int = 10,
+    offset: int = 0
+) -> tuple[int, list[dict]]:
+    """
+    Ranked (bm25) full-text search over analyses.
+    Returns (total_matches, rows); rows carry run metadata, a highlighted
+    summary and a content snippet ([match] markers). `since`/`until` compare
+    against runs.ts (ISO dates, e.g. 2025-11-01). Condensed copies of failure
+    logs (source 'condensed') repeat the heuristic analysis and are left out
+    unless asked for by `source`.
+    """
+    kb_init(db_path)
+    where = ["analyses_fts MATCH ?"]
+    params: list = [_fts_query(query, match_any)]
+    if brand:
+        where.append("r.brand_norm = ?")
+        params.append(_norm_brand(brand))
+    if since:
+        where.append("r.ts >= ?")
+        params.append(since)
+    if until:
+        where.append("r.ts < ?")
+        params.append(until)
+    if source:
+        where.append("a.source = ?")
+        params.append(source)
+    else:
+        where.append("a.source <> 'condensed'")
+    base = f"""
+      FROM analyses_fts
+      JOIN analyses a ON a.id = analyses_fts.rowid
+      JOIN runs r ON r.id = a.run_id
+      WHERE {' AND '.join(where)}
+    """
+
+    con = kb_connect(db_path)
+    con.row_factory = sqlite3.Row
+    try:
+        total = con.execute("SELECT COUNT(*) " + base, params).fetchone()[0]
+        rows = con.execute(f"""
+          SELECT a.id AS analysis_id, r.id AS run_id, r.ts, r.brand, r.firmware, r.result_bool,
+                 a.source, a.reasons_json,
+                 bm25(analyses_fts, 2.0, 1.0) AS score,
+                 highlight(analyses_fts, 0, '[', ']') AS summary_hl,
+                 snippet(analyses_fts, 1, '[', ']', '...', 24) AS snippet
+          {base}
+          ORDER BY score
+          LIMIT ? OFFSET ?
+        """, params + [int(limit), int(offset)]).fetchall()
+    finally:
+        con.close()
+    return total, [dict(r) for r in rows]
@@ -0,0 +1,86 @@
+import math
+from firmae_lib.sqlite_helper import kb_init, _norm_brand, kb_connect
+
+# Timeout advisor: picks a per-class emulation timeout from KB history.
+# A class is (brand, architecture); narrower classes win when they have
+# enough successful samples, otherwise we fall back to DEFAULT_TIMEOUT.
+DEFAULT_TIMEOUT = 1800
+MIN_TIMEOUT     = 300
+MIN_SAMPLES     = 5
+PERCENTILE      = 95
+HEADROOM        = 1.5
+
+def _percentile(values: list[float], pct: float) -> float:
+    """
+    Linear-interpolated percentile of a non-empty list.
+    """
+    vals = sorted(values)
+    if len(vals) == 1:
+        return vals[0]
+    k = (len(vals) - 1) * (pct / 100.0)
+    lo, hi = math.floor(k), math.ceil(k)
+    if lo == hi:
+        return vals[lo]
+    return vals[lo] + (vals[hi] - vals[lo]) * (k - lo)
+
+def _known_architecture(con, firmware: str) -> str | None:
+    """
+    Architecture recorded by an earlier run of the same firmware file, if any.
+    """
+    row = con.execute(
+        "SELECT architecture FROM runs WHERE firmware = ? AND architecture IS NOT NULL "
+        "ORDER BY id DESC LIMIT 1", (firmware,)
+    ).fetchone()
+    return row[0] if row else None
+
+def _success_durations(con, brand: str | None, architecture: str | None) -> list[float]:
+    where = ["result_bool = 1", "duration_sec IS NOT NULL"]
+    params = []
+    if brand:
+        where.append("brand_norm = ?")
+        params.append(_norm_brand(brand))
+    if architecture:
+        where.append("architecture = ?")
+        params.append(architecture)
+    rows = con.execute(f"SELECT duration_sec FROM runs WHERE {' AND '.join(where)}", params)
+    return [float(r[0]) for r in rows]
+
+def advise_timeout(db_path: str, brand: str | None, firmware: str, requested: int | None = None) -> tuple[int, str]:
+    """
+    Returns (timeout_sec, reason).
+    An explicit `requested` timeout always wins. Otherwise the timeout is
+    HEADROOM x the PERCENTILE-th duration of successful runs in the narrowest
+    class with at least MIN_SAMPLES samples, clamped to [MIN_TIMEOUT, DEFAULT_TIMEOUT].
+    """
+    if requested:
+        return int(requested), "requested by caller"
+
+    try:
+        kb_init(db_path)
+        con = kb_connect(db_path)
+        try:
+            arch = _known_architecture(con, firmware)
+            classes = []
+            if arch:
+                classes.append((brand, arch))
+                classes.append((None, arch))
+            classes.append((brand, None))
+
+            for cls_brand, cls_arch in classes:
+                durations = _success_durations(con, cls_brand, cls_arch)
+                if len(durations) < MIN_SAMPLES:
+                    continue
+                p = _percentile(durations, PERCENTILE)
+                timeout = int(math.ceil(p * HEADROOM))
+                timeout = max(MIN_TIMEOUT, min(DEFAULT_TIMEOUT, timeout))
+                label = "/".join(x for x in (_norm_brand(cls_brand) if cls_brand else "", cls_arch or "") if x)
+                return timeout, (
+                    f"p{PERCENTILE} of {len(durations)} successful {label} runs "
+                    f"({p:.0f}s) x{HEADROOM}"
+                )
+        finally:
+            con.close()
+    except Exception as e:
+        return DEFAULT_TIMEOUT, f"default (KB unavailable: {e})"
+
+    return DEFAULT_TIMEOUT, "default (not enough history for this brand/architecture)"
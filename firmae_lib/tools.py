@@ -20,7 +20,7 @@ def list_tools():
                     "properties": {
                         "brand": {"type": "string", "description": "Brand name (e.g., DLINK)"},
                         "firmware_file": {"type": "string", "description": "Firmware filename or full path"},
-                        "timeout": {"type": "integer", "description": "Timeout (seconds). Default 1800."}
+                        "timeout": {"type": "integer", "description": "Timeout (seconds). Default: learned per brand/architecture from KB history (fallback 1800)."}
                     },
                     "required": ["brand", "firmware_file"]
                 }
@@ -34,6 +34,20 @@ def list_tools():
                     "required": []
                 }
             },
+            {
+                "name": "firmae.scratch",
+                "description": "List scratch IIDs with status (running/ok/failed/incomplete), metadata and disk usage.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "status": {"type": "string", "description": "Only IIDs with this status: running | ok | failed | incomplete"},
+                        "disk_usage": {"type": "boolean", "description": "Include per-IID disk usage. Default true."},
+                        "limit": {"type": "integer", "description": "IIDs per page. Default 50."},
+                        "offset": {"type": "integer", "description": "IIDs to skip (paging). Default 0."}
+                    },
+                    "required": []
+                }
+            },
             {
                 "name": "firmae.search",
                 "description": "Search and download firmware images by brand and model.",
@@ -49,26 +63,122 @@ def list_tools():
             },
             {
                 "name": "firmae.lookupKB",
-                "description": "Display a list of known  router models available for firmware lookup.",
+                "description": "Look up known router models (brands, models, aliases) in the KB by prefix, substring or fuzzy match. No args: list brands with model counts.",
                 "inputSchema": {
                     "type": "object",
-                    "properties": {},
+                    "properties": {
+                        "brand": {"type": "string", "description": "Restrict to a brand (e.g., DLINK, TPLINK, NETGEAR)"},
+                        "query": {"type": "string", "description": "Model or alias, full or partial (e.g., dir86, archer ax7, AC1750); case, spaces and dashes ignored"},
+                        "limit": {"type": "integer", "description": "Maximum models returned. Default 20"}
+                    },
                     "required": []
                 }
             },
             {
                 "name": "firmae.history",
-                "description": "View past emulation records from emulation_records.csv with optional filters.",
+                "description": "View past emulation runs from the KB, newest first, filtered by normalized brand/model (indexed).",
                 "inputSchema": {
                     "type": "object",
                     "properties": {
                     "brand": {"type": "string", "description": "Filter by brand (e.g., DLINK, TPLINK)"},
-                        "model": {"type": "string", "description": "Substring match against firmware_name"},
+                        "model": {"type": "string", "description": "Model (e.g. DIR-868L, archer ax73); matched exactly after normalization, else by prefix, else anywhere in the model id, else anywhere in the firmware file name"},
                         "success_only": {"type": "boolean", "description": "Show only successful runs"},
-                        "last_n": {"type": "integer", "description": "Limit to the most-recent N rows (by number). Default 20"}
+                        "last_n": {"type": "integer", "description": "Limit to the most-recent N runs. Default 20"}
                         }
                 }
             },
+            {
+                "name": "firmae.kbsearch",
+                "description": "Ranked full-text search over KB failure analyses (bm25) with brand/date filters, snippets and paging.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "query": {"type": "string", "description": "Words to search for (e.g., Kernel panic VFS)"},
+                        "brand": {"type": "string", "description": "Filter by brand (e.g., DLINK, TPLINK)"},
+                        "since": {"type": "string", "description": "Only runs at/after this ISO date (e.g., 2025-11-01)"},
+                        "until": {"type": "string", "description": "Only runs before this ISO date"},
+                        "source": {"type": "string", "description": "Filter by analysis source: heuristic | llm | summary | condensed (condensed is only searched when asked for)"},
+                        "match_any": {"type": "boolean", "description": "Match any word instead of all words. Default false."},
+                        "limit": {"type": "integer", "description": "Results per page. Default 10 (max 100)."},
+                        "offset": {"type": "integer", "description": "Results to skip (paging). Default 0."}
+                    },
+                    "required": ["query"]
+                }
+            },
+            {
+                "name": "firmae.clusters",
+                "description": "List clusters of near-duplicate failed runs (masked log fingerprints) with counts and representative runs.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "brand": {"type": "string", "description": "Only count member runs of this brand"},
+                        "limit": {"type": "integer", "description": "Clusters per page. Default 20."},
+                        "offset": {"type": "integer", "description": "Clusters to skip (paging). Default 0."}
+                    },
+                    "required": []
+                }
+            },
+            {
+                "name": "firmae.workers",
+                "description": "List worker agents registered with this server in coordinator mode, with capacity and running/completed jobs.",
+                "inputSchema": {"type": "object", "properties": {}, "required": []}
+            },
+            {
+                "name": "firmae.metrics",
+                "description": "Show host CPU/memory load, running and queued emulations with their sampled RSS/CPU, and the per-architecture costs admission control has learned.",
+                "inputSchema": {"type": "object", "properties": {}, "required": []}
+            },
+            {
+                "name": "firmae.condense",
+                "description": "Condensed failure context of a KB run for LLM analysis: repeated lines merged with counts, stack dumps collapsed, lines near failure signatures kept first, packed into a token budget. Cached in the KB.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "run_id": {"type": "integer", "description": "KB run id of a failed run"},
+                        "budget": {"type": "integer", "description": "Approximate token budget. Default FIRMAE_CONDENSE_TOKENS or 2000."}
+                    },
+                    "required": ["run_id"]
+                }
+            },
+            {
+                "name": "firmae.llm",
+                "description": "Background LLM analysis of failed runs (local OpenAI/Ollama-compatible endpoint, FIRMAE_LLM_URL). Without run_id: queue, batching, cache and error counters. With run_id: the run's stored LLM analysis, queuing the run if it has none yet.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "run_id": {"type": "integer", "description": "KB run id of a failed run (optional)"}
+                    },
+                    "required": []
+                }
+            },
+            {
+                "name": "firmae.logs",
+                "description": "List or read the full logs of a past run, archived compressed in the KB.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "run_id": {"type": "integer", "description": "KB run id"},
+                        "name": {"type": "string", "description": "Log to read (e.g., qemu.final.serial.log). Omit to list archived logs."},
+                        "offset": {"type": "integer", "description": "Character offset to start reading from. Default 0."},
+                        "max_bytes": {"type": "integer", "description": "Max characters to return. Default 64000."}
+                    },
+                    "required": ["run_id"]
+                }
+            },
+            {
+                "name": "firmae.export",
+                "description": "Export KB runs with phases, failure reasons and clusters to JSONL (or Parquet if pyarrow is installed), optionally only runs newer than a watermark.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "format": {"type": "string", "description": "jsonl (default) or parquet"},
+                        "output": {"type": "string", "description": "Output file path. Default: <FIRMAE_HOME>/exports/runs-<timestamp>.<format>"},
+                        "since_id": {"type": "integer", "description": "Export only runs with id greater than this"},
+                        "watermark": {"type": "string", "description": "Named watermark: export runs after the stored id, then advance it (incremental export)"}
+                    },
+                    "required": []
+                }
+            },
             {
                 "name": "emux.emuxbuild",
                 "description": "Scaffold an EMUX device folder from template, copy a firmware image, tar the extracted rootfs, and set the kernel (from template or a custom path). Optionally set nvram.",
@@ -85,7 +195,7 @@ def list_tools():
                     },
                     "kernel_choice": {
                         "type": "string",
-                        "description": "Filename from EMUX template/kernel (e.g., zImage-2.6.31.14-realview-rv130-nothumb). Provide this OR kernel_path."
+                        "description": "Filename from EMUX template/kernel (e.g., zImage-2.6.31.14-realview-rv130-nothumb), or \"auto\" to pick the kernel matching the rootfs ELF binaries. Provide this OR kernel_path."
                     },
                     "kernel_path": {
                         "type": "string",
@@ -94,14 +204,21 @@ def list_tools():
                     "nvram_path": {
                         "type": "string",
                         "description": "Optional path to nvram.ini. If omitted, the nvram line in config is commented."
-                    }
+                    },
+                    "sweep": {
+                        "type": "boolean",
+                        "description": "Instead of a kernel: boot-test the template kernels compatible with the rootfs (arch/endianness) in parallel and keep the best. The winner is recorded in the KB and reused for the same rootfs."
+                    },
+                    "sweep_max": {"type": "integer", "description": "Max candidate kernels to boot (default 4)"},
+                    "sweep_timeout": {"type": "integer", "description": "Per-candidate boot timeout in seconds (default 60)"},
+                    "sweep_workers": {"type": "integer", "description": "Candidates booted concurrently (default 2)"}
                     },
                     "required": ["firmware_model", "firmware_image"]
                 }
             },
             {
                 "name": "emux.applyconfig",
-                "description": "Append or update a device row in EMUX files/emux/devices (or devices-extra). Accepts a full CSV row or structured fields.",
+                "description": "Append or update device rows in EMUX files/emux/devices (or devices-extra). Accepts a full CSV row, structured fields, or a batch of rows.",
                 "inputSchema": {
                     "type": "object",
                     "properties": {
@@ -128,6 +245,11 @@ def list_tools():
                             "description": { "type": "string" }
                             }
                         },
+                        "rows": {
+                            "type": "array",
+                            "description": "Batch mode: many rows (CSV strings or field objects), applied with one backup and one atomic write.",
+                            "items": {}
+                        },
                         "allow_update": {
                             "type": "boolean",
                             "description": "If true (default), update existing row with same ID; otherwise always append."
@@ -135,13 +257,17 @@ def list_tools():
                         "create_backup": {
                             "type": "boolean",
                             "description": "If true (default), create a timestamped .bak before writing."
+                        },
+                        "backup_retention": {
+                            "type": "integer",
+                            "description": "Keep only this many newest .bak.* files. Default 10."
                         }
                     }
                 }
             },
             {
                 "name": "emux.rebuild",
-                "description": "Rebuild the EMUX environment by running build-emux-volume and build-emux-docker inside EMUX_HOME. Waits for both steps to finish and returns full logs.",
+                "description": "Rebuild the EMUX environment (build-emux-volume / build-emux-docker inside EMUX_HOME) as a background job. Steps whose inputs are unchanged since the last successful rebuild are skipped.",
                 "inputSchema": {
                     "type": "object",
                     "properties": {
@@ -152,7 +278,27 @@ def list_tools():
                     "no_sudo": {
                         "type": "boolean",
                         "description": "Run without sudo (set true if your environment doesn’t require sudo). Default: false."
+                    },
+                    "force": {
+                        "type": "boolean",
+                        "description": "Run both steps even if nothing changed. Default: false."
+                    },
+                    "wait": {
+                        "type": "boolean",
+                        "description": "Block until the rebuild finishes and return the full log. Default: false (returns a job id)."
+                    }
                     }
+                }
+            },
+            {
+                "name": "emux.rebuildstatus",
+                "description": "Show status and streamed output of a background emux.rebuild job.",
+                "inputSchema": {
+                    "type": "object",
+                    "properties": {
+                        "job_id": {"type": "string", "description": "Job id from emux.rebuild. Default: most recent job."},
+                        "offset": {"type": "integer", "description": "Log byte offset to read from (use the returned next offset). Default 0."},
+                        "max_bytes": {"type": "integer", "description": "Max log bytes to return. Default 64000."}
                     }
                 }
             }
@@ -0,0 +1,197 @@
+import os, time, signal, subprocess, threading
+from firmae_lib.analysis import LOG_NAMES, _numeric_dirs, _terminal_signature
+from firmae_lib.scratch import scratch_index
+
+# IIDs already attributed to a running emulation, so parallel runs don't share one
+_CLAIMED: set[int] = set()
+# watchers whose run has started but whose IID is not claimed yet
+_PENDING: set["LogWatcher"] = set()
+_CLAIM_LOCK = threading.Lock()
+CLOCK_SLACK = 1.0   # seconds; file mtimes may trail time.time() slightly
+
+def kill_process_group(proc, grace: float = 5.0) -> None:
+    """
+    SIGTERM the process group of `proc`, then SIGKILL it after `grace` seconds.
+    run.sh spawns QEMU children, so killing only the shell would leak guests.
+    """
+    try:
+        pgid = os.getpgid(proc.pid)
+    except Exception:
+        pgid = None
+    for sig, wait in ((signal.SIGTERM, grace), (signal.SIGKILL, None)):
+        try:
+            if pgid is not None:
+                os.killpg(pgid, sig)
+            else:
+                proc.send_signal(sig)
+        except ProcessLookupError:
+            return
+        except Exception:
+            pass
+        if wait is None:
+            return
+        try:
+            proc.wait(timeout=wait)
+            return
+        except subprocess.TimeoutExpired:
+            continue
+
+def active_iids() -> set[int]:
+    """
+    IIDs currently attributed to a running emulation, plus any IID whose
+    `name` matches the firmware of a run that has not claimed its IID yet
+    (FirmAE reuses the IID when the same firmware is run again).
+    """
+    with _CLAIM_LOCK:
+        out, pending = set(_CLAIMED), list(_PENDING)
+    for w in pending:
+        index = scratch_index(w.scratch_root)
+        for i in index.ids():
+            if _name_matches(index.meta(i).get("name", ""), w.fw_name):
+                out.add(i)
+    return out
+
+def _name_matches(recorded: str, fw_name: str | None) -> bool:
+    """
+    True if scratch/<iid>/name (`recorded`) refers to `fw_name`. An empty
+    `name` (not written yet) never matches.
+    """
+    if not recorded:
+        return False
+    if not fw_name:
+        return True
+    stem = os.path.splitext(fw_name)[0]
+    return recorded in (fw_name, stem) or stem.startswith(recorded) or recorded.startswith(stem)
+
+def _mtime(path: str) -> float | None:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+class LogWatcher(threading.Thread):
+    """
+    Follows scratch/<iid>/ logs of one running emulation by polling file offsets
+    and kills the run's process group as soon as a terminal signature appears.
+
+    The IID is the first unclaimed scratch dir whose `name` file matches the
+    firmware and is either new or was rewritten after the run started: FirmAE
+    reuses the IID (and its scratch dir) when a firmware is run again. Logs a
+    reused dir still holds from the previous run are skipped.
+    """
+
+    def __init__(self, scratch_root: str, fw_name: str | None = None, poll_sec: float = 1.0, carry: int = 4096):
+        super().__init__(daemon=True)
+        self.scratch_root = scratch_root
+        self.fw_name = fw_name
+        self.poll_sec = poll_sec
+        self.carry = carry
+        self.pre_ids = set(_numeric_dirs(scratch_root))
+        self.started_at = time.time()
+        self.iid = None
+        self.iid_dir = None
+        self.reason = None
+        self._proc = None
+        self._halt = threading.Event()
+        self._offsets: dict[str, int] = {}
+        self._windows: dict[str, str] = {}
+
+    def register(self) -> None:
+        """
+        Mark the run as started, so active_iids() protects its IID (new or
+        reused) before the watcher has claimed it.
+        """
+        self.started_at = time.time()
+        with _CLAIM_LOCK:
+            _PENDING.add(self)
+
+    def attach(self, proc) -> None:
+        self._proc = proc
+        self.start()
+
+    def stop(self) -> None:
+        self._halt.set()
+        if self.is_alive():
+            self.join(timeout=self.poll_sec * 2)
+        if self.iid_dir is None:
+            # short runs can finish before the first poll
+            self._discover()
+        with _CLAIM_LOCK:
+            _CLAIMED.discard(self.iid)
+            _PENDING.discard(self)
+
+    def _discover(self) -> None:
+        since = self.started_at - CLOCK_SLACK
+        with _CLAIM_LOCK:
+            for i in _numeric_dirs(self.scratch_root):
+                if i in _CLAIMED:
+                    continue
+                path = os.path.join(self.scratch_root, str(i))
+                name_path = os.path.join(path, "name")
+                reused = i in self.pre_ids
+                if reused and (_mtime(name_path) or 0) < since:
+                    continue
+                try:
+                    with open(name_path, "r", encoding="utf-8") as f:
+                        recorded = f.read().strip()
+                except OSError:
+                    continue
+                if not _name_matches(recorded, self.fw_name):
+                    continue
+                _CLAIMED.add(i)
+                _PENDING.discard(self)
+                self.iid, self.iid_dir = i, path
+                if reused:
+                    # the previous run's logs: start past them, re-read once they are rewritten
+                    for fname in LOG_NAMES:
+                        p = os.path.join(path, fname)
+                        if (_mtime(p) or since) < since:
+                            self._offsets[fname] = os.path.getsize(p)
+                return
+
+    def _read_new(self, fname: str) -> str:
+        path = os.path.join(self.iid_dir, fname)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return ""
+        off = self._offsets.get(fname, 0)
+        if size < off:  # truncated / rewritten
+            off = 0
+            self._windows[fname] = ""
+        if size == off:
+            return ""
+        with open(path, "rb") as f:
+            f.seek(off)
+            data = f.read(size - off)
+        self._offsets[fname] = off + len(data)
+        return data.decode("utf-8", "replace")
+
+    def _scan(self) -> str | None:
+        for fname in LOG_NAMES:
+            chunk = self._read_new(fname)
+            if not chunk:
+                continue
+            # keep a tail of the previous chunk so matches spanning reads are found
+            window = self._windows.get(fname, "") + chunk
+            sig = _terminal_signature(window)
+            if sig:
+                return f"{fname} shows terminal signature: {sig}"
+            self._windows[fname] = window[-self.carry:]
+        return None
+
+    def run(self) -> None:
+        while not self._halt.wait(self.poll_sec):
+            if self.iid_dir is None:
+                self._discover()
+                if self.iid_dir is None:
+                    continue
+            try:
+                reason = self._scan()
+            except Exception:
+                reason = None
+            if reason:
+                self.reason = reason
+                if self._proc is not None and self._proc.poll() is None:
+                    kill_process_group(self._proc)
+                return
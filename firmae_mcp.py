@@ -4,13 +4,47 @@ from firmae_lib.tools import list_tools
 from firmae_lib.logger import append_emulation_record
 from firmae_lib.help import _load_help_md
 from firmae_lib.analysis import _numeric_dirs, _latest_iid_dir, _safe_tail, _analyze_logs, _collect_failure_context
-from firmae_lib.sqlite_helper import kb_insert_run, kb_insert_analysis
+from firmae_lib.watcher import LogWatcher, kill_process_group, active_iids
+from firmae_lib.scratch import scratch_index, _safe_read
+from firmae_lib.quota import enforce_scratch_quota, quota_limits
+from firmae_lib.export import kb_export_runs
+from firmae_lib.extract_cache import (cache_root, image_sha256, cache_lookup_rootfs, cache_store_rootfs,
+                                      cache_register_firmae, cache_restore_firmae, enforce_extract_quota, _link_or_copy)
+from firmae_lib.timeouts import advise_timeout, _known_architecture
+from firmae_lib.sqlite_helper import kb_init, kb_connect, kb_insert_run, kb_insert_analysis, kb_search, _norm_brand, _norm_model
+from firmae_lib.clusters import kb_assign_cluster, kb_backfill_clusters, kb_list_clusters
+from firmae_lib.archive import kb_archive_logs, kb_list_archived_logs, kb_read_archived_log
 from emux_lib.tar_helper import _find_rootfs_dir, _make_rootfs_tar_bz2
 from emux_lib.emux_detect import _infer_device_suggestion
+from emux_lib.elf_infer import infer_config, inspect_kernel, describe_profile, CACHE_FILE as INFER_CACHE_FILE
+from emux_lib.devices import DevicesFile, DEVICES_HEADER, _build_row_from_fields, _parse_row
+from emux_lib.sweep import (build_initramfs, boot_command, run_sweep, kb_record_sweep, kb_previous_winner,
+                            SWEEP_DIR, MAX_SCORE as SWEEP_MAX_SCORE)
+from emux_lib.rebuild import start_rebuild, get_rebuild_job
+from firmae_lib.fanout import Coordinator, run_worker, FANOUT_TOOLS
+from firmae_lib.admission import Admission
+from firmae_lib.resources import ResourceStore, ResourceNotFound, run_log_uri, _excerpt
+from firmae_lib.condense import kb_condense_run, kb_condense_stored, budget_from_env
+from firmae_lib.llm import LLMStage, kb_llm_analyses
+from firmae_lib.similar import kb_index_failure, kb_similar_failures, start_backfill
+from firmae_lib.models import guess_model, start_backfill as start_models_backfill
+from firmae_lib.catalog import kb_catalog_brands, kb_lookup_models
 
 SUPPORTED = {"2025-03-26", "2024-11-05"}
+OUT_INLINE  = 4000   # chars of run.sh stdout kept in the emulate response
+TAIL_INLINE = 1500   # chars of each failure log tail kept in the emulate response
+TAIL_STORE  = 8000   # chars of each failure log tail kept in the KB analysis (full logs are archived)
+SIMILAR_K   = 3      # similar past failures listed with a failed emulation
 WRITE_LOCK = threading.Lock()
-KB_DB_PATH  = os.path.join(os.path.dirname(os.path.abspath(__file__)), "firmae_kb.sqlite")
+KB_DB_PATH  = os.environ.get("FIRMAE_KB_DB") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "firmae_kb.sqlite")
+COORDINATOR = None  # set in main() when FIRMAE_COORDINATOR_LISTEN is configured
+ADMISSION   = Admission(KB_DB_PATH)
+LLM         = LLMStage(KB_DB_PATH)  # off unless FIRMAE_LLM_URL is set
+LLM_STATES  = {
+    "cached": "answer reused from the cache",
+    "queued": "queued, runs in the background",
+    "full":   "skipped, queue full",
+}
 
 def jwrite(obj):
     with WRITE_LOCK:
@@ -27,6 +61,27 @@ def expand_home(path: str) -> str:
 
 # default to /home/ubuntu-server/FirmAE
 FIRMAE_HOME = expand_home(os.environ.get("FIRMAE_HOME", "/home/ubuntu-server/FirmAE"))
+# Large tool output is kept here and served through resources/read
+RESOURCES = ResourceStore(os.environ.get("FIRMAE_RESOURCE_DIR") or os.path.join(FIRMAE_HOME, ".affirm", "resources"), KB_DB_PATH)
+
+def _similar_line(h: dict) -> str:
+    """
+    One similar past failure, with what became of it.
+    """
+    parts = [f"  - run #{h['run_id']} ({h['brand'] or '?'} {h['firmware'] or '?'}, {h['architecture'] or '?'}, {h['ts']}) "
+             f"similarity {h['similarity']:.2f}"]
+    if h["reasons"]:
+        parts.append("reasons: " + ", ".join(h["reasons"]))
+    if h["cluster_id"]:
+        parts.append(f"cluster #{h['cluster_id']}")
+    if h["llm"]:
+        parts.append(f"LLM: {h['llm']}")
+    fix = h["fixed_by"]
+    if fix:
+        parts.append(f"later succeeded as run #{fix['run_id']}" + (f" ({'; '.join(fix['changed'])})" if fix["changed"] else ""))
+    else:
+        parts.append("no later success of that firmware")
+    return " | ".join(parts)
 
 def safe_cwd():
     try:
@@ -36,14 +91,20 @@ def safe_cwd():
 
 safe_cwd()
 
-def run_cmd(cmd: str, args: list[str] | None, timeout_sec: int | None):
+def run_cmd(cmd: str, args: list[str] | None, timeout_sec: int | None, watcher=None, on_spawn=None, placement=None):
     """
     Execute within FIRMAE_HOME. Returns (exit_code, stdout, stderr, duration).
     Always returns stdout/stderr as str (never bytes).
+    If a LogWatcher is given it follows the run and may kill it early; the
+    exit code is then 125 and the watcher's reason is appended to stderr.
+    on_spawn(proc) is called once the process group exists. A placement (an
+    admission Job) pins the group to its cores and NUMA node.
     """
     safe_cwd()
     args = args or []
     full = cmd if not args else cmd + " " + " ".join(shlex.quote(str(a)) for a in args)
+    if placement is not None and placement.pin_prefix():
+        full = shlex.join(placement.pin_prefix()) + " " + full
 
     start = time.time()
     ANSI_ESCAPE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
@@ -62,35 +123,51 @@ def run_cmd(cmd: str, args: list[str] | None, timeout_sec: int | None):
             return x
 
     try:
-        proc = subprocess.run(
+        proc = subprocess.Popen(
             full,
             shell=True,
             cwd=FIRMAE_HOME,
-            capture_output=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
             text=True,              # request text, but we'll still normalize defensively
-            timeout=timeout_sec
+            start_new_session=True  # own process group so QEMU children die with us
         )
-        dur = time.time() - start
-
-        out = _strip_ansi(_to_str(proc.stdout))
-        err = _strip_ansi(_to_str(proc.stderr))
-        return proc.returncode, out, err, dur
-
-    except subprocess.TimeoutExpired as e:
-        dur = time.time() - start
-        out = _strip_ansi(_to_str(getattr(e, "stdout", "")))
-        err = _strip_ansi(_to_str(getattr(e, "stderr", ""))) + "\n[timeout]"
-        return 124, out, err, dur
-
     except FileNotFoundError as e:
+        if watcher is not None:
+            watcher.stop()
         dur = time.time() - start
         return 127, "", f"[error] {e}", dur
-
     except Exception as e:
+        if watcher is not None:
+            watcher.stop()
         dur = time.time() - start
         # Surface the actual exception text in stderr for diagnostics
         return 1, "", f"[error] {e}", dur
 
+    if on_spawn is not None:
+        on_spawn(proc)
+    if watcher is not None:
+        watcher.attach(proc)
+    timed_out = False
+    try:
+        out, err = proc.communicate(timeout=timeout_sec)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        kill_process_group(proc)
+        out, err = proc.communicate()
+    finally:
+        if watcher is not None:
+            watcher.stop()
+
+    dur = time.time() - start
+    out = _strip_ansi(_to_str(out))
+    err = _strip_ansi(_to_str(err))
+    if timed_out:
+        return 124, out, err + "\n[timeout]", dur
+    if watcher is not None and watcher.reason:
+        return 125, out, err + f"\n[aborted] {watcher.reason}", dur
+    return proc.returncode, out, err, dur
+
 def handle_call(params):
     name = params.get("name")
     arguments = params.get("arguments") or {}
@@ -104,7 +181,6 @@ def handle_call(params):
     elif name == "firmae.emulate":
         brand = arguments.get("brand")
         fw = arguments.get("firmware_file")
-        timeout = arguments.get("timeout") or 1800
         if not brand or not fw:
             return {
                 "content": [{"type": "text", "text": "Missing brand or firmware_file"}],
@@ -124,18 +200,89 @@ def handle_call(params):
         args = ["-c", brand, fw_path]
         emulate_ctx = {"fw_path": fw_path, "brand": brand}
         scratch_root = os.path.join(FIRMAE_HOME, "scratch")
+        timeout, timeout_reason = advise_timeout(
+            KB_DB_PATH, brand, os.path.basename(fw_path), arguments.get("timeout")
+        )
+
+        # Follow this run's IID (new, or reused by a re-run) and stop the run early on a
+        # terminal signature; registered now so quota eviction never touches that IID
+        watcher = LogWatcher(scratch_root, fw_name=os.path.basename(fw_path))
+        watcher.register()
+
+        # Make room in scratch/ before the run (no-op unless a quota is configured)
+        quota_note = ""
+        try:
+            max_bytes, min_free = quota_limits()
+            evicted = enforce_scratch_quota(
+                KB_DB_PATH, scratch_root, max_bytes=max_bytes, min_free_bytes=min_free, protected=active_iids()
+            )
+            if evicted:
+                quota_note = (
+                    f"\n[quota] Evicted {len(evicted)} scratch IID(s) "
+                    f"({sum(e['bytes'] for e in evicted)} bytes, logs archived to KB): "
+                    + ", ".join(str(e["iid"]) for e in evicted)
+                )
+        except Exception as e:
+            quota_note = f"\n[quota] Scratch quota check failed: {e}"
+
+        # Hand FirmAE back its own extraction if images/<iid>.tar.gz was removed
+        extract_root = cache_root(FIRMAE_HOME)
+        images_dir = os.path.join(FIRMAE_HOME, "images")
+        image_sha = None
+        try:
+            image_sha = image_sha256(fw_path)
+            restored = cache_restore_firmae(KB_DB_PATH, extract_root, image_sha, images_dir)
+            if restored is not None:
+                quota_note += f"\n[extract-cache] Restored images/{restored}.tar.gz; FirmAE skips extraction"
+        except Exception as e:
+            quota_note += f"\n[extract-cache] Restore failed: {e}"
+
+        # Wait for the host to have room for another guest (cost learned per architecture)
+        arch_guess = None
+        try:
+            kb_init(KB_DB_PATH)
+            con = kb_connect(KB_DB_PATH)
+            try:
+                arch_guess = _known_architecture(con, os.path.basename(fw_path))
+            finally:
+                con.close()
+        except Exception:
+            pass
+        try:
+            job = ADMISSION.acquire("firmae", arch_guess, label=os.path.basename(fw_path))
+        except RuntimeError as e:
+            watcher.stop()
+            return {"content": [{"type": "text", "text": f"[admission] {e}"}], "isError": True}
+        if job.started_at - job.queued_at >= 1:
+            quota_note += f"\n[admission] Queued {job.started_at - job.queued_at:.0f}s for {job.est_rss >> 20}M / {job.est_cores} core(s) ({job.basis})"
+        if job.cpus:
+            quota_note += (f"\n[placement] {'Pinned to' if job.pin_prefix() else 'Reserved (numactl/taskset not found, not pinned)'} "
+                           f"CPU(s) {','.join(map(str, job.cpus))}" + (f" on NUMA node {job.node}" if job.node is not None else ""))
 
-        rc, out, err, dur = run_cmd(cmd, args, timeout)
+        try:
+            rc, out, err, dur = run_cmd(cmd, args, timeout, watcher=watcher,
+                                        on_spawn=lambda p: ADMISSION.attach(job, p.pid), placement=job)
+        finally:
+            ADMISSION.release(job, (_safe_read(os.path.join(watcher.iid_dir, "architecture")) or None) if watcher.iid_dir else None)
+        if image_sha and watcher.iid_dir:
+            try:
+                if cache_register_firmae(KB_DB_PATH, extract_root, image_sha, os.path.basename(fw_path),
+                                         int(os.path.basename(watcher.iid_dir)), images_dir, holder=watcher.iid_dir):
+                    enforce_extract_quota(KB_DB_PATH, extract_root)
+            except Exception as e:
+                quota_note += f"\n[extract-cache] Register failed: {e}"
         result_truth = None  # set this if you have logic to read scratch/<iid>/result (true/false)
         is_error = (result_truth is False) if (result_truth is not None) else (rc != 0)
 
         csv_note = ""
+        row = {}
         try:
             row = append_emulation_record(
                 firmae_home=FIRMAE_HOME,
                 fw_path=fw_path,
                 brand=brand,
                 exit_code=rc,
+                iid_dir=watcher.iid_dir,
             )
             csv_note = "\n[+] Emulation record appended to emulation_records.csv"
         except Exception as e:
@@ -145,9 +292,12 @@ def handle_call(params):
         iid_dir = None
         reasons = []
         analysis_block = ""
+        analysis_view = ""  # analysis_block with long tails moved to resources
         texts = {}
+        kept = {}   # texts clipped to TAIL_STORE: stored, clustered and indexed
+        res_group = RESOURCES.new_group("emulate")
         if is_error:
-            iid_dir, texts = _collect_failure_context(scratch_root)
+            iid_dir, texts = _collect_failure_context(scratch_root, iid_dir=watcher.iid_dir)
             have_any_logs = any(texts.get(k) for k in ("makeImage.log", "makeNetwork.log", "qemu.final.serial.log", "emulation.log"))
             if not iid_dir or not have_any_logs:
                 analysis_block = "\n[analysis] Emulation appears to have failed before logs were produced in scratch/."
@@ -158,38 +308,48 @@ def handle_call(params):
                 else:
                     analysis_block = "**Failure analysis:**\n- No specific signature matched; review logs below."
 
-                parts = [analysis_block]
+                kept = {n: t if len(t) <= TAIL_STORE else _excerpt(t, TAIL_STORE) for n, t in texts.items() if t}
+                parts, view = [analysis_block], [analysis_block]
                 for name in ("makeImage.log", "makeNetwork.log", "qemu.final.serial.log", "emulation.log"):
                     content_tail = texts.get(name, "")
                     if content_tail:
-                        parts.append(f"\n--- {name} (tail) ---\n{content_tail}")
+                        parts.append(f"\n--- {name} (tail) ---\n{kept[name]}")
+                        view.append(f"\n--- {name} (tail) ---\n" + RESOURCES.clip(res_group, f"{name}.tail", content_tail, limit=TAIL_INLINE))
                 analysis_block = "\n".join(parts)
+                analysis_view = "\n".join(view)
 
-        # Build final output
+        # Build final output (long stdout/stderr go to resources; the excerpt keeps the end)
         lines = []
         if out:
-            lines.append(out)
+            lines.append(RESOURCES.clip(res_group, "stdout.txt", out, limit=OUT_INLINE))
         if err:
-            lines.append(f"[stderr]\n{err}")
+            lines.append("[stderr]\n" + RESOURCES.clip(res_group, "stderr.txt", err, limit=OUT_INLINE // 2))
         if analysis_block:
-            lines.append(analysis_block)
-        lines.append(f"[exit={rc}] [duration={dur:.2f}s] [cwd={FIRMAE_HOME}]{csv_note}")
+            lines.append(analysis_view or analysis_block)
+        lines.append(f"[exit={rc}] [duration={dur:.2f}s] [timeout={timeout}s: {timeout_reason}] [cwd={FIRMAE_HOME}]{csv_note}{quota_note}")
 
         # --- Persist run + analysis to SQLite KB ---
+        run_id = None
         try:
             db_path = KB_DB_PATH
             firmware_name = os.path.basename(fw_path)
-            model_guess = None  # derive if you want
+            scratch_dir = watcher.iid_dir or iid_dir
+            model_guess = guess_model(brand, firmware_name, _safe_read(os.path.join(scratch_dir, "name")) if scratch_dir else None)
 
             run_id = kb_insert_run(
                 db_path,
                 brand=brand,
                 model=model_guess,
                 firmware=firmware_name,
-                iid_dir=iid_dir if is_error else None,
+                iid_dir=watcher.iid_dir or iid_dir,
                 exit_code=rc,
                 result_bool=(False if is_error else True) if result_truth is None else bool(result_truth),
                 duration_sec=dur,
+                architecture=row.get("architecture"),
+                timeout_sec=timeout,
+                timeout_reason=timeout_reason,
+                ping_bool=(row["ping"] == "true") if row else None,
+                web_bool=(row["web"] == "true") if row else None,
             )
 
             reasons_payload = {"reasons": reasons or []} if is_error else None
@@ -201,13 +361,45 @@ def handle_call(params):
                 content=(analysis_block or (out.strip()[:2000] if out else "[no analysis text]")),
                 reasons_json=reasons_payload
             )
+
+            archived = kb_archive_logs(db_path, watcher.iid_dir or iid_dir, run_id=run_id)
+            if archived:
+                raw = sum(a["raw_size"] for a in archived)
+                packed = sum(a["stored_size"] for a in archived)
+                lines.append(f"[KB] Archived {len(archived)} log(s) for run #{run_id}: {raw} -> {packed} bytes (see firmae.logs)")
+                lines.extend(f"  {a['name']}: {run_log_uri(run_id, a['name'])}" for a in archived)
+
+            if is_error and any(texts.values()):
+                cluster_id, is_new = kb_assign_cluster(
+                    db_path, run_id, kept, title=(", ".join(reasons) or None)
+                )
+                lines.append(
+                    f"[KB] Failure cluster #{cluster_id}" + (" (new)" if is_new else " (seen before; see firmae.clusters)")
+                )
+                condensed = kb_condense_run(db_path, run_id, texts, reasons)
+                lines.append(
+                    f"[KB] Condensed failure context: {condensed['tokens']}/{condensed['budget']} tokens "
+                    f"from {condensed['lines_in']} log lines (firmae.condense run_id={run_id})"
+                )
+                terms = kb_index_failure(db_path, run_id, kept, reasons)
+                similar = kb_similar_failures(db_path, terms, exclude_run=run_id, k=SIMILAR_K)
+                start_backfill(db_path)  # older failures join the index in the background
+                if similar:
+                    lines.append("[KB] Similar past failures:")
+                    lines.extend(_similar_line(h) for h in similar)
+                state = LLM.submit(run_id, condensed["text"])
+                if state in LLM_STATES:
+                    lines.append(f"[KB] LLM analysis: {LLM_STATES[state]} (firmae.llm run_id={run_id})")
         except Exception as e:
             lines.append(f"\n[KB] Failed to persist analysis: {e}")
 
-        return {
+        result = {
             "content": [{"type": "text", "text": "\n".join(lines)}],
             "isError": is_error
         }
+        if run_id is not None:
+            result["_meta"] = {"run_id": run_id}  # lets a coordinator pull this run into the central KB
+        return result
     # firmae.clean — remove folders inside scratch/
     elif name == "firmae.clean":
         scratch_dir = os.path.join(FIRMAE_HOME, "scratch")
@@ -238,6 +430,58 @@ def handle_call(params):
             "content": [{"type": "text", "text": f"Cleared {removed} items from {scratch_dir}."}],
             "isError": False
         }
+    # firmae.scratch — IIDs in scratch/ with status and disk usage
+    elif name == "firmae.scratch":
+        scratch_dir = os.path.join(FIRMAE_HOME, "scratch")
+        if not os.path.isdir(scratch_dir):
+            return {"content": [{"type": "text", "text": f"Scratch folder not found: {scratch_dir}"}], "isError": True}
+        limit = max(1, int(arguments.get("limit") or 50))
+        offset = max(0, int(arguments.get("offset") or 0))
+        status_q = (arguments.get("status") or "").strip().lower()
+        with_usage = bool(arguments.get("disk_usage") if arguments.get("disk_usage") is not None else True)
+
+        index = scratch_index(scratch_dir)
+        running = active_iids()
+
+        def _status(meta: dict) -> str:
+            if meta["iid"] in running:
+                return "running"
+            if meta["result"] is None:
+                return "incomplete"
+            return "ok" if meta["result"] else "failed"
+
+        def _human(n: int) -> str:
+            for unit in ("B", "K", "M", "G"):
+                if n < 1024 or unit == "G":
+                    return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+                n /= 1024
+
+        ids = index.ids()
+        rows = []
+        for iid in reversed(ids):
+            meta = index.meta(iid)
+            if not meta:
+                continue
+            meta["status"] = _status(meta)
+            if status_q and meta["status"] != status_q:
+                continue
+            rows.append(meta)
+        page = rows[offset:offset + limit]
+
+        total_usage = sum(index.disk_usage(m["iid"]) for m in page) if with_usage else 0
+        lines = [f"**Scratch IIDs (newest first)** — {len(rows)} match, {len(ids)} total in {scratch_dir}"]
+        for m in page:
+            usage = f" | {_human(index.disk_usage(m['iid']))}" if with_usage else ""
+            flags = f"ping={'✓' if m['ping'] else '✗'} web={'✓' if m['web'] else '✗'}"
+            lines.append(
+                f"- {m['iid']} | {m['status']} | {m['brand'] or '?'} | {m['name'] or '?'} "
+                f"| arch={m['architecture'] or '?'} | {flags}{usage}"
+            )
+        if with_usage:
+            lines.append(f"\nShown IIDs use {_human(total_usage)}.")
+        if offset + len(page) < len(rows):
+            lines.append(f"More: call again with offset={offset + len(page)}")
+        return {"content": [{"type": "text", "text": "\n".join(lines)}], "isError": False}
     # firmae.search — list or download firmware for a given brand and model
     elif name == "firmae.search":
         import requests, re
@@ -341,100 +585,92 @@ def handle_call(params):
                 return {"content": [{"type": "text", "text": msg}], "isError": True}
 
             return {"content": [{"type": "text", "text": msg}], "isError": False}
-    # firmae.lookupKB — checks against tplink-kb
+    # firmae.lookupKB — models from the brand/model/alias catalog (kb/*.csv, indexed in the KB)
     elif name == "firmae.lookupKB":
-        kb_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "kb", "tplink-kb")
-        if not os.path.exists(kb_path):
-            return {
-                "content": [{"type": "text", "text": f"Knowledge base file not found: {kb_path}"}],
-                "isError": True
-            }
-
+        brand_q = (arguments.get("brand") or "").strip()
+        query = (arguments.get("query") or arguments.get("model") or "").strip()
+        limit = max(1, min(200, int(arguments.get("limit") or 20)))
         try:
-            with open(kb_path, "r", encoding="utf-8") as f:
-                lines = [line.strip() for line in f if line.strip()]
+            if not brand_q and not query:
+                brands = kb_catalog_brands(KB_DB_PATH)
+                listing = "\n".join(f"- {b}: {n} models" for b, n in brands) or "(empty — add brand,model,aliases rows to kb/*.csv)"
+                msg = (
+                    "**Model KB — brands**\n\n"
+                    f"{listing}\n\n"
+                    "Look up models with `brand` and/or `query` (prefix, substring or fuzzy), e.g.\n"
+                    "`brand: DLINK, query: dir86`"
+                )
+                return {"content": [{"type": "text", "text": msg}], "isError": False}
+            total, rows = kb_lookup_models(KB_DB_PATH, brand=brand_q or None, query=query or None, limit=limit)
         except Exception as e:
-            return {
-                "content": [{"type": "text", "text": f"Error reading tplink-kb: {e}"}],
-                "isError": True
-            }
-
-        if not lines:
-            return {
-                "content": [{"type": "text", "text": "No models found in tplink-kb."}],
-                "isError": False
-            }
+            return {"content": [{"type": "text", "text": f"Model KB lookup failed: {e}"}], "isError": True}
 
-        listing = "\n".join(f"{i+1}. {line}" for i, line in enumerate(lines))
+        what = ", ".join(x for x in (f"brand {brand_q}" if brand_q else "", f"query '{query}'" if query else "") if x)
+        if not rows:
+            return {"content": [{"type": "text", "text": f"No models in the KB for {what}."}], "isError": False}
+        count = f"{len(rows)} of {total}" if total is not None else f"{len(rows)}"
+        lines = []
+        for i, r in enumerate(rows, 1):
+            extra = f" (aliases: {r['aliases']})" if r["aliases"] else ""
+            tag = f" [{r['match']}]" if r["match"] != "list" else ""
+            lines.append(f"{i}. {r['brand']} {r['model']}{extra}{tag}")
         msg = (
-            "**TP-Link Knowledge Base — Available Models**\n\n"
-            f"{listing}\n\n"
-            "You can search for firmware using:\n"
-            "→ `brand: TPLINK, model: <ModelName>`\n\n"
-            "Example:\n"
-            "`brand: TPLINK, model: Archer AX73`\n"
+            f"**Model KB — {what}: {count} models**\n\n"
+            + "\n".join(lines) + "\n\n"
+            "Search for firmware with `firmae.search`:\n"
+            f"→ `brand: {rows[0]['brand']}, model: {rows[0]['model']}`\n"
         )
-
         return {"content": [{"type": "text", "text": msg}], "isError": False}
     # firmae.history — view past emulation records with filters
     elif name == "firmae.history":
-        import csv, re
-
         brand_q = (arguments.get("brand") or "").strip()
         model_q = (arguments.get("model") or "").strip()
         success_only = bool(arguments.get("success_only") or False)
-        last_n = int(arguments.get("last_n") or 20)
-
-        def norm(s: str) -> str:
-            return re.sub(r"[^a-z0-9]+", "", (s or "").lower())
-
-        def contains_loose(hay: str, needle: str) -> bool:
-            if not (needle or "").strip():
-                return True
-            return norm(needle) in norm(hay)
-
-        csv_path = os.path.join(FIRMAE_HOME, "emulation_records.csv")
-        if not os.path.exists(csv_path):
-            return {
-                "content": [{"type": "text", "text": f"No records yet. CSV not found at {csv_path}"}],
-                "isError": False
-            }
-
-        rows = []
+        last_n = max(1, int(arguments.get("last_n") or 20))
+
+        # brand_norm/model_norm are indexed; a model matches exactly, then by prefix, then
+        # anywhere in the model id, and last anywhere in the firmware name (runs whose
+        # model could not be inferred have model_norm '')
+        brand_n = _norm_brand(brand_q) if brand_q else None
+        model_n = _norm_model(guess_model(brand_q or None, model_q) or model_q) if model_q else None
+        start_models_backfill(KB_DB_PATH, os.path.join(FIRMAE_HOME, "emulation_records.csv"))
         try:
-            with open(csv_path, "r", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                for r in reader:
-                    rows.append(r)
+            kb_init(KB_DB_PATH)
+            con = kb_connect(KB_DB_PATH)
+            try:
+                rows, how = [], None
+                for how, cond, vals in (("exact", "model_norm = ?", [model_n]),
+                                        ("prefix", "model_norm >= ? AND model_norm < ?", [model_n, f"{model_n}~"]),
+                                        ("loose", "model_norm LIKE ?", [f"%{model_n}%"]),
+                                        ("firmware name", "firmware LIKE ?", [f"%{model_q}%"])):
+                    where, params = [], []
+                    if brand_n:
+                        where.append("brand_norm = ?")
+                        params.append(brand_n)
+                    if model_n:
+                        where.append(cond)
+                        params += vals
+                    if success_only:
+                        where.append("result_bool = 1")
+                    # runs recorded by emulate, newest first; then rows imported from emulation_records.csv
+                    rows = []
+                    for extra, order in (("record_number IS NULL", "id"), ("record_number IS NOT NULL", "record_number")):
+                        if len(rows) >= last_n:
+                            break
+                        rows += con.execute(f"""
+                          SELECT id, ts, brand, model, firmware, architecture, ping_bool, web_bool, result_bool, record_number
+                          FROM runs WHERE {" AND ".join(where + [extra])}
+                          ORDER BY {order} DESC LIMIT ?
+                        """, params + [last_n - len(rows)]).fetchall()
+                    if rows or not model_n:
+                        break
+            finally:
+                con.close()
         except Exception as e:
-            return {
-                "content": [{"type": "text", "text": f"Failed to read emulation_records.csv: {e}"}],
-                "isError": True
-            }
-
-        # Sort newest first by numeric 'number'
-        def num(r): 
-            try: return int(r.get("number") or 0)
-            except: return 0
-        rows.sort(key=num, reverse=True)
+            return {"content": [{"type": "text", "text": f"Failed to read run history from the KB: {e}"}], "isError": True}
 
-        # Apply filters
-        out = []
-        for r in rows:
-            if brand_q and norm(brand_q) != norm(r.get("brand") or ""):
-                continue
-            if model_q and not contains_loose(r.get("firmware_name") or "", model_q):
-                continue
-            if success_only:
-                v = (r.get("result") or "").strip().lower()
-                if v not in ("1","true","yes","ok","success","on","reachable","up"):
-                    continue
-            out.append(r)
-            if len(out) >= last_n:
-                break
-
-        if not out:
-            msg = "No matching emulation records."
+        if not rows:
+            msg = "No matching emulation runs."
             hints = []
             if brand_q: hints.append(f"brand={brand_q}")
             if model_q: hints.append(f"model~{model_q}")
@@ -442,25 +678,257 @@ def handle_call(params):
             if hints: msg += " Filters: " + ", ".join(hints)
             return {"content": [{"type": "text", "text": msg}], "isError": False}
 
-        # Pretty print
         def tick(v):
-            v = (v or "").strip().lower()
-            return "✓" if v in ("1","true","yes","ok","success","on","reachable","up") else "✗"
+            return "✓" if v == 1 else ("?" if v is None else "✗")
 
-        lines = ["**Emulation History (most recent first)**"]
-        for r in out:
+        lines = ["**Emulation History (most recent first)**"
+                 + (f" — model {model_n} ({how} match)" if model_n else "")]
+        for r in rows:
             lines.append(
-                f"- #{r.get('number','')} | {r.get('brand','')} | {r.get('firmware_name','')} "
-                f"| arch={r.get('architecture','')} | ping={tick(r.get('ping'))} "
-                f"web={tick(r.get('web'))} result={tick(r.get('result'))}"
+                f"- run #{r[0]} | {r[1] or f'emulation_records.csv #{r[9]}'} | {r[2] or ''} | {r[3] or '?'} | {r[4] or ''} "
+                f"| arch={r[5] or ''} | ping={tick(r[6])} web={tick(r[7])} result={tick(r[8])}"
             )
 
         # Tiny footer with how to refine
         lines.append(
-            "\nFilters: brand=<DLINK|TPLINK> model=<substring> success_only=<true|false> last_n=<N>\n"
+            "\nFilters: brand=<DLINK|TPLINK> model=<model or prefix> success_only=<true|false> last_n=<N>\n"
             "Example: brand=DLINK model=DIR-868L success_only=true last_n=10"
         )
         return {"content": [{"type": "text", "text": "\n".join(lines)}], "isError": False}
+    # firmae.kbsearch — ranked full-text search over KB analyses
+    elif name == "firmae.kbsearch":
+        query = (arguments.get("query") or "").strip()
+        if not query:
+            return {"content": [{"type": "text", "text": "Missing query. Example: query=\"Kernel panic\""}], "isError": True}
+        limit = max(1, min(int(arguments.get("limit") or 10), 100))
+        offset = max(0, int(arguments.get("offset") or 0))
+
+        try:
+            total, hits = kb_search(
+                KB_DB_PATH, query,
+                brand=(arguments.get("brand") or "").strip() or None,
+                since=(arguments.get("since") or "").strip() or None,
+                until=(arguments.get("until") or "").strip() or None,
+                source=(arguments.get("source") or "").strip() or None,
+                match_any=bool(arguments.get("match_any") or False),
+                limit=limit,
+                offset=offset,
+            )
+        except Exception as e:
+            return {"content": [{"type": "text", "text": f"KB search failed: {e}"}], "isError": True}
+
+        if not hits:
+            return {"content": [{"type": "text", "text": f"No analyses match '{query}' ({total} total)."}], "isError": False}
+
+        lines = [f"**KB search: '{query}'** — {offset + 1}-{offset + len(hits)} of {total} (best first)"]
+        for h in hits:
+            outcome = {1: "ok", 0: "failed"}.get(h["result_bool"], "?")
+            lines.append(
+                f"- run #{h['run_id']} | {h['ts']} | {h['brand'] or ''} | {h['firmware'] or ''} | {outcome} "
+                f"| {h['source']} | score={abs(h['score']):.3g}\n"
+                f"  {h['summary_hl'] or ''}\n"
+                f"  {(h['snippet'] or '').replace(chr(10), ' ')}"
+            )
+        if offset + len(hits) < total:
+            lines.append(f"\nMore results: call again with offset={offset + len(hits)}")
+        return {"content": [{"type": "text", "text": "\n".join(lines)}], "isError": False}
+    # firmae.clusters — failed runs grouped by log fingerprint
+    elif name == "firmae.clusters":
+        limit = max(1, min(int(arguments.get("limit") or 20), 200))
+        offset = max(0, int(arguments.get("offset") or 0))
+        brand_q = (arguments.get("brand") or "").strip() or None
+
+        try:
+            backfilled = kb_backfill_clusters(KB_DB_PATH)
+            clusters = kb_list_clusters(KB_DB_PATH, brand=brand_q, limit=limit, offset=offset)
+        except Exception as e:
+            return {"content": [{"type": "text", "text": f"Failed to read failure clusters: {e}"}], "isError": True}
+
+        if not clusters:
+            return {"content": [{"type": "text", "text": "No failure clusters yet."}], "isError": False}
+
+        lines = ["**Failure clusters (largest first)**"]
+        for c in clusters:
+            lines.append(
+                f"- cluster #{c['id']} | {c['members']} run(s) | {c['title'] or 'no signature matched'}\n"
+                f"  representative: run #{c['representative_run_id']} {c['rep_brand'] or ''} {c['rep_firmware'] or ''}\n"
+                f"  recent runs: {', '.join(f'#{r}' for r in c['recent_runs'])} | last seen {c['last_ts']}"
+            )
+        if backfilled:
+            lines.append(f"\n(fingerprinted {backfilled} older failed run(s) from stored analyses)")
+        return {"content": [{"type": "text", "text": "\n".join(lines)}], "isError": False}
+    # firmae.workers — worker agents registered with this coordinator
+    elif name == "firmae.workers":
+        if COORDINATOR is None:
+            return {"content": [{"type": "text", "text": "Coordinator mode is off (set FIRMAE_COORDINATOR_LISTEN to enable it)."}], "isError": False}
+        workers = COORDINATOR.status()
+        lines = [f"**Workers** (listening on {COORDINATOR.listen_addr})"]
+        if not workers:
+            lines.append("No workers registered; emulations run locally.")
+        for w in workers:
+            lines.append(
+                f"- {w['name']} | {w['running']}/{w['capacity']} running | "
+                f"{w['completed']} done ({w['failed']} failed) | connected {w['connected_sec']}s"
+            )
+        return {"content": [{"type": "text", "text": "\n".join(lines)}], "isError": False}
+    # firmae.metrics — host load and admission-control state
+    elif name == "firmae.metrics":
+        m = ADMISSION.metrics()
+        host, lim, st = m["host"], m["limits"], m["stats"]
+        mb = lambda b: f"{(b or 0) >> 20}M"
+        lines = [
+            "**Host**",
+            f"- CPUs {host['cpus']} | busy {host['busy_cores']} | load {host['load1']:.2f} {host['load5']:.2f} {host['load15']:.2f}",
+            f"- Memory available {mb(host['mem_available'])} of {mb(host['mem_total'])}",
+            "",
+            f"**Admission** ({'on' if m['enabled'] else 'off (FIRMAE_ADMISSION=0)'})",
+            f"- Limits: keep {mb(lim['min_free'])} free | {lim['cpu_budget']:g} cores"
+            + (f" | max {lim['max_jobs']} jobs" if lim["max_jobs"] else "") + f" | wait up to {lim['max_wait_sec']:.0f}s",
+            f"- Admitted {st['admitted']} | had to queue {st['queued']} | rejected {st['rejected']}"
+            + (f" | mean wait {st['wait_sec_total'] / st['admitted']:.1f}s" if st["admitted"] else ""),
+        ]
+        pin = m["pinning"]
+        if pin["cores_per_job"]:
+            lines.append(f"- Pinning {pin['cores_per_job']} core(s) per job; free by NUMA node: " + "; ".join(
+                f"{'node ' + n if n != 'None' else 'all'} {len(v['free'])}/{len(v['cpus'])}" for n, v in pin["nodes"].items()))
+        else:
+            lines.append("- Pinning off (set FIRMAE_PIN_CPUS)")
+        for title, jobs in (("Running", m["running"]), ("Waiting", m["waiting"])):
+            lines.append(f"\n**{title}** ({len(jobs)})")
+            for j in jobs:
+                lines.append(
+                    f"- {j['kind']} {j['label'] or ''} [{j['architecture'] or '?'}] | rss {mb(j['rss'])} (peak {mb(j['peak_rss'])}, "
+                    f"est {mb(j['est_rss'])}) | cpu {j['cores']} (est {j['est_cores']}) | {j['age_sec']}s"
+                    + (f" | CPUs {','.join(map(str, j['cpus']))}" + (f" node {j['node']}" if j["node"] is not None else "") if j["cpus"] else "")
+                )
+        if m["learned"]:
+            lines.append("\n**Learned cost (p90 of recent jobs)**")
+            for cls, c in m["learned"].items():
+                lines.append(f"- {cls}: {mb(c['rss'])}, {c['cores']} core(s) (n={c['n']})")
+        return {"content": [{"type": "text", "text": "\n".join(lines)}], "isError": False}
+    # firmae.condense — token-budgeted failure context of a KB run
+    elif name == "firmae.condense":
+        try:
+            run_id = int(arguments.get("run_id"))
+        except Exception:
+            return {"content": [{"type": "text", "text": "Missing or invalid run_id (see firmae.history / firmae.kbsearch)."}], "isError": True}
+        budget = int(arguments.get("budget") or 0) or budget_from_env()
+        try:
+            c = kb_condense_stored(KB_DB_PATH, run_id, budget)
+        except Exception as e:
+            return {"content": [{"type": "text", "text": f"Failed to condense run #{run_id}: {e}"}], "isError": True}
+        if c is None:
+            return {"content": [{"type": "text", "text": f"Run #{run_id} has no failure analysis to condense."}], "isError": True}
+        head = (f"**Condensed failure context, run #{run_id}** | {c['tokens']}/{c['budget']} tokens | "
+                f"{c['lines_out']} of {c['lines_in']} lines" + (" | cached" if c["cached"] else ""))
+        return {"content": [{"type": "text", "text": head + "\n\n" + c["text"]}], "isError": False}
+    # firmae.llm — background LLM analysis: stage status, or one run's answers
+    elif name == "firmae.llm":
+        st = LLM.status()
+        if arguments.get("run_id") in (None, ""):
+            if not st["enabled"]:
+                return {"content": [{"type": "text", "text": "LLM analysis is off (set FIRMAE_LLM_URL to a local OpenAI- or Ollama-compatible endpoint)."}], "isError": False}
+            c = st["stats"]
+            lines = [
+                f"**LLM analysis** ({st['api']} {st['url']}, model {st['model']})",
+                f"- Pending {st['pending']} | up to {st['batch']} runs per request",
+                f"- Queued {c['queued']} | cache hits {c['cached']} | dropped {c['dropped']}",
+                f"- Requests {c['requests']} ({c['batched_runs']} runs sent in batches) | analyses stored {c['stored']} | errors {c['errors']}"
+                + (f" | last request {c['last_latency_sec']}s" if c["last_latency_sec"] is not None else ""),
+            ]
+            if c["last_error"]:
+                lines.append(f"- Last error: {c['last_error']}")
+            return {"content": [{"type": "text", "text": "\n".join(lines)}], "isError": False}
+        try:
+            run_id = int(arguments.get("run_id"))
+        except Exception:
+            return {"content": [{"type": "text", "text": "Invalid run_id (see firmae.history / firmae.kbsearch)."}], "isError": True}
+        try:
+            found = kb_llm_analyses(KB_DB_PATH, run_id)
+            if not found and st["enabled"]:
+                condensed = kb_condense_stored(KB_DB_PATH, run_id)
+                if condensed is None:
+                    return {"content": [{"type": "text", "text": f"Run #{run_id} has no failure analysis to send."}], "isError": True}
+                state = LLM.submit(run_id, condensed["text"])
+                found = kb_llm_analyses(KB_DB_PATH, run_id)
+                if not found:
+                    return {"content": [{"type": "text", "text": f"Run #{run_id}: {LLM_STATES.get(state, state)}; ask again later."}], "isError": False}
+        except Exception as e:
+            return {"content": [{"type": "text", "text": f"Failed to read LLM analysis of run #{run_id}: {e}"}], "isError": True}
+        if not found:
+            return {"content": [{"type": "text", "text": f"Run #{run_id} has no LLM analysis (LLM analysis is off)."}], "isError": False}
+        a = found[0]
+        head = (f"**LLM analysis, run #{run_id}** | {a.get('model') or '?'} | {a['at_ts']}"
+                + (" | from cache" if a.get("cached") else "") + (f" | batch of {a['batch']}" if (a.get("batch") or 1) > 1 else ""))
+        return {"content": [{"type": "text", "text": head + "\n\n" + a["content"]}], "isError": False}
+    # firmae.logs — full run logs archived in the KB (decompressed on demand)
+    elif name == "firmae.logs":
+        try:
+            run_id = int(arguments.get("run_id"))
+        except Exception:
+            return {"content": [{"type": "text", "text": "Missing or invalid run_id (see firmae.history / firmae.kbsearch)."}], "isError": True}
+        log_name = (arguments.get("name") or "").strip()
+        offset = max(0, int(arguments.get("offset") or 0))
+        max_bytes = max(1, int(arguments.get("max_bytes") or 64_000))
+
+        try:
+            archives = kb_list_archived_logs(KB_DB_PATH, run_id=run_id)
+        except Exception as e:
+            return {"content": [{"type": "text", "text": f"Failed to read log archive: {e}"}], "isError": True}
+        if not archives:
+            return {"content": [{"type": "text", "text": f"No archived logs for run #{run_id}."}], "isError": False}
+
+        if not log_name:
+            lines = [f"**Archived logs for run #{run_id}** ({archives[0]['iid_dir'] or 'unknown IID'})"]
+            for a in archives:
+                ratio = a["raw_size"] / a["stored_size"] if a["stored_size"] else 0
+                lines.append(f"- {a['name']} | {a['raw_size']} bytes | {a['codec']} {ratio:.1f}x")
+            lines.append("\nRead one with: run_id=<id> name=<log name> [offset] [max_bytes]")
+            return {"content": [{"type": "text", "text": "\n".join(lines)}], "isError": False}
+
+        match = [a for a in archives if a["name"] == log_name]
+        if not match:
+            return {"content": [{"type": "text", "text": f"Run #{run_id} has no archived {log_name}. Available: {', '.join(a['name'] for a in archives)}"}], "isError": True}
+        try:
+            text = kb_read_archived_log(KB_DB_PATH, match[-1]["id"])
+        except Exception as e:
+            return {"content": [{"type": "text", "text": f"Failed to decompress {log_name}: {e}"}], "isError": True}
+        chunk = text[offset:offset + max_bytes]
+        footer = f"\n[{log_name}: chars {offset}-{offset + len(chunk)} of {len(text)}]"
+        if offset + len(chunk) < len(text):
+            footer += f" next offset={offset + len(chunk)}"
+        return {"content": [{"type": "text", "text": chunk + footer}], "isError": False}
+    # firmae.export — stream KB runs to JSONL/Parquet for offline analytics
+    elif name == "firmae.export":
+        import time
+
+        fmt = (arguments.get("format") or "jsonl").strip().lower()
+        watermark = (arguments.get("watermark") or "").strip() or None
+        since_id = arguments.get("since_id")
+        out_path = (arguments.get("output") or "").strip()
+        if not out_path:
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            out_path = os.path.join(FIRMAE_HOME, "exports", f"runs-{stamp}.{fmt}")
+        out_path = expand_home(out_path)
+        if not os.path.isabs(out_path):
+            out_path = os.path.join(FIRMAE_HOME, out_path)
+
+        try:
+            res = kb_export_runs(
+                KB_DB_PATH, out_path, fmt=fmt,
+                since_id=(int(since_id) if since_id is not None else None),
+                watermark=watermark,
+            )
+        except Exception as e:
+            return {"content": [{"type": "text", "text": f"Export failed: {e}"}], "isError": True}
+
+        msg = (
+            f"[export] {res['rows']} run(s) with id > {res['since_id']} -> {res['path']} ({res['format']})\n"
+            f"Last exported run id: {res['last_id']}"
+        )
+        if watermark:
+            msg += f"\nWatermark '{watermark}' advanced; next call with watermark={watermark} exports only newer runs."
+        return {"content": [{"type": "text", "text": msg}], "isError": False}
     # emux.emuxbuild — create emux firmware folder from template
     elif name == "emux.emuxbuild":
         import shutil, re, zipfile, glob, subprocess, tarfile
@@ -469,9 +937,13 @@ def handle_call(params):
 
         firmware_model     = (arguments.get("firmware_model") or "").strip()
         firmware_image_arg = (arguments.get("firmware_image") or "").strip()
-        kernel_choice      = (arguments.get("kernel_choice") or "").strip()   # filename under template/kernel
+        kernel_choice      = (arguments.get("kernel_choice") or "").strip()   # filename under template/kernel, or "auto"
         kernel_path_arg    = (arguments.get("kernel_path") or "").strip()     # absolute/relative file path
         nvram_path_arg     = (arguments.get("nvram_path") or "").strip()      # optional
+        sweep_mode         = bool(arguments.get("sweep"))                       # boot-test shortlisted kernels
+        sweep_max          = int(arguments.get("sweep_max") or 4)
+        sweep_timeout      = int(arguments.get("sweep_timeout") or 60)
+        sweep_workers      = int(arguments.get("sweep_workers") or 2)
 
         # Validate required
         if not firmware_model:
@@ -552,12 +1024,16 @@ def handle_call(params):
             [f for f in os.listdir(template_kernel_dir)
             if os.path.isfile(os.path.join(template_kernel_dir, f))]
         )
-        if not kernel_choice and not kernel_path_arg:
+        if sweep_mode and (kernel_choice or kernel_path_arg):
+            return {"content":[{"type":"text","text":"sweep picks the kernel itself; omit kernel_choice/kernel_path."}], "isError": True}
+        if not kernel_choice and not kernel_path_arg and not sweep_mode:
             listing = "\n".join(f"- {k}" for k in available_kernels) or "(no kernels found in template/kernel)"
             guide = (
                 "**Kernel required**\n\n"
                 "Pick ONE and call again with:\n"
                 "  • `kernel_choice`: a filename from the list below\n"
+                "  • OR `kernel_choice`: \"auto\" to pick the kernel matching the rootfs ELF binaries\n"
+                "  • OR `sweep`: true to boot-test the compatible kernels and keep the best one\n"
                 "  • OR `kernel_path`: an absolute path to your own kernel file\n\n"
                 f"Available kernels:\n{listing}\n"
             )
@@ -567,7 +1043,10 @@ def handle_call(params):
         if kernel_choice and kernel_path_arg:
             return {"content":[{"type":"text","text":"Provide only one of: kernel_choice OR kernel_path."}], "isError": True}
 
-        if kernel_choice:
+        auto_kernel = kernel_choice.lower() == "auto"
+        if auto_kernel or sweep_mode:
+            chosen_kernel_src = None  # resolved once the rootfs is extracted
+        elif kernel_choice:
             if kernel_choice not in available_kernels:
                 return {"content":[{"type":"text","text":f"kernel_choice '{kernel_choice}' not found. Available: {', '.join(available_kernels) or '(none)'}"}], "isError": True}
             chosen_kernel_src = os.path.join(template_kernel_dir, kernel_choice)
@@ -656,9 +1135,20 @@ def handle_call(params):
         except Exception as e:
             return {"content":[{"type":"text","text":f"Failed to copy firmware image: {e}"}], "isError": True}
 
+        # Reuse an earlier extraction of the same image (by EMUX or FirmAE)
+        extract_root = cache_root(FIRMAE_HOME)
+        image_sha, cached, cache_note = None, None, "miss"
+        try:
+            image_sha = image_sha256(fw_src)
+            cached = cache_lookup_rootfs(KB_DB_PATH, extract_root, image_sha, holder=dest_dir)
+            if cached:
+                cache_note = f"hit {image_sha[:12]} (binwalk skipped)"
+        except Exception as e:
+            cache_note = f"lookup failed: {e}"
+
         # If ZIP, safely extract into dest
         extracted_note = ""
-        if fw_dst.lower().endswith(".zip"):
+        if fw_dst.lower().endswith(".zip") and not cached:
             try:
                 _safe_extract_zip(fw_dst, dest_dir)
                 extracted_note = f"Extracted ZIP into {dest_dir}"
@@ -673,7 +1163,7 @@ def handle_call(params):
                 paths.extend(glob.glob(os.path.join(root, pat)))
             return sorted(set(paths))
 
-        fw_bins = _find_fw_bins(dest_dir)
+        fw_bins = [] if cached else _find_fw_bins(dest_dir)
         binwalk_runs = 0
         bw_errors = []
         for fwf in fw_bins:
@@ -691,23 +1181,129 @@ def handle_call(params):
                 if sub_ed.endswith(".extracted") and sub_ed not in search_roots:
                     search_roots.append(sub_ed)
 
-        rootfs_dir = None
-        for root in [*search_roots, dest_dir]:
+        rootfs_dir = cached[0] if cached else None
+        for root in ([] if cached else [*search_roots, dest_dir]):
             rootfs_dir = _find_rootfs_dir(root)
             if rootfs_dir:
                 break
 
         # Tar the rootfs directory into rootfs.tar.bz2 at dest_dir
-        if rootfs_dir:
+        if cached:
+            tar_path = os.path.join(dest_dir, "rootfs.tar.bz2")
+            try:
+                _link_or_copy(cached[1], tar_path)
+                tar_note = f"Reused cached rootfs {cached[1]} -> {tar_path}"
+            except Exception as e:
+                return {"content":[{"type":"text","text":f"Failed to place cached rootfs.tar.bz2: {e}"}], "isError": True}
+        elif rootfs_dir:
             tar_path = os.path.join(dest_dir, "rootfs.tar.bz2")
             try:
                 _make_rootfs_tar_bz2(rootfs_dir, tar_path)
                 tar_note = f"Packed rootfs from {rootfs_dir} -> {tar_path}"
             except Exception as e:
                 return {"content":[{"type":"text","text":f"Found rootfs at {rootfs_dir}, but failed to create rootfs.tar.bz2: {e}"}], "isError": True}
+            if image_sha:
+                try:
+                    cache_store_rootfs(KB_DB_PATH, extract_root, image_sha, os.path.basename(fw_src),
+                                       rootfs_dir, tar_path, holder=dest_dir)
+                    evicted = enforce_extract_quota(KB_DB_PATH, extract_root)
+                    cache_note = f"stored {image_sha[:12]}" + (f", evicted {len(evicted)} old entr(ies)" if evicted else "")
+                except Exception as e:
+                    cache_note = f"store failed: {e}"
         else:
             tar_note = "No rootfs directory found after binwalk extraction."
 
+        # Profile the rootfs binaries and rank template kernels against them
+        inferred = None
+        sweep_lines = []
+        infer_note = "no rootfs to inspect"
+        if rootfs_dir:
+            try:
+                inferred = infer_config(rootfs_dir, template_kernel_dir,
+                                        cache_path=os.path.join(EMUX_HOME, INFER_CACHE_FILE))
+            except Exception as e:
+                infer_note = f"ELF inspection failed: {e}"
+            if inferred:
+                infer_note = describe_profile(inferred["profile"])
+                if inferred["preset"]:
+                    infer_note += f" -> {inferred['preset']['qemuopts']}"
+                if inferred.get("cached"):
+                    infer_note += " (cached)"
+            elif not infer_note.startswith("ELF"):
+                infer_note = "no ELF binaries found in rootfs"
+
+        if auto_kernel:
+            if not inferred or not inferred["kernels"]:
+                listing = ", ".join(available_kernels) or "(none)"
+                return {"content":[{"type":"text","text":(
+                    f"kernel_choice=auto: could not match a template kernel ({infer_note}). "
+                    f"Call again with an explicit kernel_choice. Available: {listing}. Dest kept at {dest_dir}")}], "isError": True}
+            chosen_kernel_src = os.path.join(template_kernel_dir, inferred["kernels"][0])
+        elif sweep_mode:
+            if not rootfs_dir:
+                return {"content":[{"type":"text","text":f"sweep needs a rootfs, but none was found after extraction. Dest kept at {dest_dir}"}], "isError": True}
+            prev = kb_previous_winner(KB_DB_PATH, inferred["rootfs_hash"]) if inferred else None
+            if prev and prev["kernel"] in available_kernels:
+                chosen_kernel_src = os.path.join(template_kernel_dir, prev["kernel"])
+                sweep_lines.append(f"- Sweep     : reused winner of sweep at {prev['sweep_ts']} (score {prev['score']}/{SWEEP_MAX_SCORE})")
+            else:
+                shortlist = (inferred["kernels"] if inferred else available_kernels)[:max(1, sweep_max)]
+                work_dir = os.path.join(EMUX_HOME, SWEEP_DIR, os.path.basename(dest_dir))
+                try:
+                    initrd = build_initramfs(tar_path, os.path.join(work_dir, "rootfs.cpio"))
+                except Exception as e:
+                    return {"content":[{"type":"text","text":f"sweep: failed to build initramfs from {tar_path}: {e}"}], "isError": True}
+                candidates, skipped = [], []
+                for kname in shortlist:
+                    variant_dir = os.path.join(work_dir, kname)
+                    os.makedirs(variant_dir, exist_ok=True)
+                    kernel_src = os.path.join(template_kernel_dir, kname)
+                    # Variants are links: one packed rootfs, one kernel each
+                    for link, target in (("rootfs.tar.bz2", tar_path), ("kernel", kernel_src)):
+                        lp = os.path.join(variant_dir, link)
+                        if os.path.lexists(lp):
+                            os.remove(lp)
+                        os.symlink(target, lp)
+                    _, cols = _parse_row(_infer_device_suggestion(variant_dir, kname, "sweep", inferred))
+                    row = dict(zip(DEVICES_HEADER, cols))
+                    if not row["qemu-binary"]:
+                        skipped.append(kname)
+                        continue
+                    candidates.append({
+                        "kernel": kname, "row": row,
+                        "cmd": boot_command(row, kernel_src, initrd, inferred["profile"] if inferred else None),
+                        "log": os.path.join(variant_dir, "serial.log"),
+                    })
+                results = run_sweep(candidates, timeout_sec=sweep_timeout, workers=sweep_workers, admission=ADMISSION)
+                best = results[0] if results and results[0]["error"] is None and results[0]["score"] > 0 else None
+                winner = best["kernel"] if best else (shortlist[0] if shortlist else None)
+                if not winner:
+                    return {"content":[{"type":"text","text":f"sweep: no candidate kernels in {template_kernel_dir}. Dest kept at {dest_dir}"}], "isError": True}
+                try:
+                    kb_record_sweep(KB_DB_PATH, firmware_model, dest_dir,
+                                    inferred["rootfs_hash"] if inferred else None, results, best and winner)
+                except Exception as e:
+                    sweep_lines.append(f"- Sweep     : KB record failed: {e}")
+                chosen_kernel_src = os.path.join(template_kernel_dir, winner)
+                sweep_lines.append(f"- Sweep     : {len(candidates)} candidate(s), {sweep_workers} worker(s), {sweep_timeout}s each; logs in {work_dir}")
+                for r in results:
+                    status = r["error"] or ", ".join(r["milestones"]) or "no output"
+                    sweep_lines.append(f"    {'*' if r['kernel'] == winner else ' '} {r['score']:>3}/{SWEEP_MAX_SCORE} {r['kernel']} ({r['elapsed_sec']}s): {status}")
+                for kname in skipped:
+                    sweep_lines.append(f"      skipped {kname}: no QEMU preset")
+                if not best:
+                    sweep_lines.append("    no candidate booted; fell back to the best-ranked kernel")
+                try:
+                    os.remove(initrd)
+                except OSError:
+                    pass
+        elif inferred:
+            kinfo = inspect_kernel(chosen_kernel_src)
+            prof = inferred["profile"]
+            if (kinfo["arch"] and kinfo["arch"] != prof["arch"]) or (kinfo["endian"] and kinfo["endian"] != prof["endian"]):
+                infer_note += (f"; WARNING: kernel is {kinfo['arch']}/{kinfo['endian'] or '?'}-endian, "
+                               f"best match would be {', '.join(inferred['kernels'][:3]) or '(none)'}")
+
         # Set the chosen kernel into dest/kernel (replace whatever template copied)
         dest_kernel_dir = os.path.join(dest_dir, "kernel")
         os.makedirs(dest_kernel_dir, exist_ok=True)
@@ -744,7 +1340,7 @@ def handle_call(params):
             row = f"{device_id},{qemu_binary},{machine_type},{cpu_type},{dtb},{memory},{kernel_image},{qemuopts},{description}"
             return row
 
-        suggestion_row = _infer_device_suggestion(dest_dir, final_kernel_name, firmware_model)
+        suggestion_row = _infer_device_suggestion(dest_dir, final_kernel_name, firmware_model, inferred)
 
         # Build final message
         lines = [
@@ -758,7 +1354,10 @@ def handle_call(params):
             f"- Firmware  : {fw_dst}",
             f"- Binwalk   : ran on {binwalk_runs} file(s)" + (f" (errors: {', '.join(bw_errors)})" if bw_errors else ""),
             f"- RootFS    : {tar_note}",
-            f"- Kernel    : {kernel_msg}",
+            f"- Extract   : {cache_note}",
+            f"- Kernel    : {kernel_msg}" + (" (auto)" if auto_kernel else ""),
+            f"- Profile   : {infer_note}",
+            *sweep_lines,
             "",
             "Additionally, the device suggestion for this configuration is:",
             "",
@@ -771,142 +1370,94 @@ def handle_call(params):
             lines.insert(6, f"- Action    : {extracted_note}")
 
         return {"content":[{"type":"text","text":"\n".join(lines)}], "isError": False}
-    # emux.applyconfig — add or update a device row in devices/devices-extra
+    # emux.applyconfig — add or update device rows in devices/devices-extra
     elif name == "emux.applyconfig":
-        import re, csv, time, shutil
-
         EMUX_HOME = os.environ.get("EMUX_HOME", "/home/ubuntu-server/emux")
 
         # Inputs:
         #   devices_target: "devices" (default) or "devices-extra"
         #   row: a full CSV row string (as printed by emuxbuild suggestion)
         #   fields: optional dict with columns to build the row if 'row' not provided
+        #   rows: batch of CSV row strings and/or field dicts, applied with one write
         devices_target = (arguments.get("devices_target") or "devices").strip()
         row_str        = (arguments.get("row") or "").strip()
         fields         = arguments.get("fields") or None  # dict or None
+        batch          = arguments.get("rows") or []
         allow_update   = bool(arguments.get("allow_update") if arguments.get("allow_update") is not None else True)
         create_backup  = bool(arguments.get("create_backup") if arguments.get("create_backup") is not None else True)
+        retention      = int(arguments.get("backup_retention") if arguments.get("backup_retention") is not None else 10)
 
         # Resolve path
         devices_path = os.path.join(EMUX_HOME, "files", "emux", "firmware", devices_target)
         os.makedirs(os.path.dirname(devices_path), exist_ok=True)
 
-        # Expected header columns
-        header = ["ID","qemu-binary","machine-type","cpu-type","dtb","memory","kernel-image","qemuopts","description"]
-
-        # If no row provided, try building from fields
-        def build_row_from_fields(fields: dict) -> str:
-            missing = [c for c in header if c not in fields]
-            if missing:
-                raise ValueError(f"Missing fields for CSV build: {', '.join(missing)}")
-            return ",".join(fields.get(c, "") or "" for c in header)
-
-        if not row_str:
-            if not isinstance(fields, dict):
-                return {"content":[{"type":"text","text":"Provide either 'row' (CSV line) or 'fields' (object with all columns)."}], "isError": True}
+        # Collect rows: single row/fields first, then the batch
+        items = []
+        if row_str:
+            items.append(row_str)
+        elif isinstance(fields, dict):
+            items.append(fields)
+        if not isinstance(batch, list):
+            return {"content":[{"type":"text","text":"'rows' must be a list of CSV strings or field objects."}], "isError": True}
+        items.extend(batch)
+        if not items:
+            return {"content":[{"type":"text","text":"Provide either 'row' (CSV line), 'fields' (object with all columns) or 'rows' (list)."}], "isError": True}
+
+        row_strs = []
+        for n, item in enumerate(items, 1):
             try:
-                row_str = build_row_from_fields(fields)
+                rs = _build_row_from_fields(item) if isinstance(item, dict) else str(item).strip()
+                _parse_row(rs)
             except Exception as e:
-                return {"content":[{"type":"text","text":f"Could not build CSV row from fields: {e}"}], "isError": True}
+                where = f" (row {n})" if len(items) > 1 else ""
+                return {"content":[{"type":"text","text":f"Could not use CSV row{where}: {e}"}], "isError": True}
+            row_strs.append(rs)
 
-        # Parse ID from row (first column)
+        # Read existing contents once (if any)
         try:
-            row_cols = [c.strip() for c in next(csv.reader([row_str]))]
+            devices = DevicesFile(devices_path)
         except Exception as e:
-            return {"content":[{"type":"text","text":f"Invalid CSV row format: {e}"}], "isError": True}
-
-        if len(row_cols) != len(header):
-            return {"content":[{"type":"text","text":f"CSV row must have {len(header)} columns, got {len(row_cols)}"}], "isError": True}
-
-        row_id = row_cols[0]
-        if not row_id:
-            return {"content":[{"type":"text","text":"First column (ID) cannot be empty."}], "isError": True}
+            return {"content":[{"type":"text","text":f"Failed to read {devices_path}: {e}"}], "isError": True}
 
-        # Read existing contents (if any)
-        existing_lines = []
-        had_header = False
-        if os.path.exists(devices_path):
-            try:
-                with open(devices_path, "r", encoding="utf-8") as f:
-                    existing_lines = [ln.rstrip("\n") for ln in f.readlines()]
-                if existing_lines and re.sub(r"\s+", "", existing_lines[0]) == re.sub(r"\s+", "", ",".join(header)):
-                    had_header = True
-            except Exception as e:
-                return {"content":[{"type":"text","text":f"Failed to read {devices_path}: {e}"}], "isError": True}
-
-        # Backup
+        # One backup per call, old ones pruned
         backup_note = ""
-        if create_backup and os.path.exists(devices_path):
-            ts = time.strftime("%Y%m%d-%H%M%S")
-            backup_path = devices_path + f".bak.{ts}"
+        if create_backup and devices.existed:
             try:
-                shutil.copy2(devices_path, backup_path)
-                backup_note = f"Backup created: {backup_path}"
+                backup_note = f"Backup created: {devices.backup(retention)}"
             except Exception as e:
                 backup_note = f"Backup failed: {e}"
 
-        # Build new content: ensure header, then add/update row
-        new_lines = []
-        if had_header:
-            new_lines.append(",".join(header))
-            body = existing_lines[1:]
-        else:
-            # If file existed but no valid header, we’ll keep its lines but prepend our header
-            body = existing_lines[:]
-            new_lines.append(",".join(header))
-
-        # Search for existing ID
-        replaced = False
-        if allow_update:
-            for i, ln in enumerate(body):
-                if not ln.strip() or ln.strip().startswith("#"):
-                    continue
-                try:
-                    cols = next(csv.reader([ln]))
-                except Exception:
-                    continue
-                if cols and cols[0].strip() == row_id:
-                    body[i] = row_str
-                    replaced = True
-                    break
+        results = [devices.upsert(rs, allow_update) for rs in row_strs]
 
-        if not replaced:
-            body.append(row_str)
-
-        new_lines.extend(body)
-
-        # Write back
+        # Write back atomically
         try:
-            with open(devices_path, "w", encoding="utf-8") as f:
-                for ln in new_lines:
-                    f.write(ln + "\n")
+            devices.save()
         except Exception as e:
             return {"content":[{"type":"text","text":f"Failed to write {devices_path}: {e}"}], "isError": True}
 
-        action = "updated existing row" if replaced else "appended new row"
-        notes = [f"[emuxapplyconfig] {action} in {devices_path} for ID='{row_id}'."]
+        if len(results) == 1:
+            row_id, action = results[0]
+            action = "updated existing row" if action == "updated" else "appended new row"
+            notes = [f"[emuxapplyconfig] {action} in {devices_path} for ID='{row_id}'."]
+        else:
+            updated = sum(1 for _, a in results if a == "updated")
+            notes = [f"[emuxapplyconfig] {len(results)} row(s) in {devices_path}: {updated} updated, {len(results) - updated} appended."]
         if backup_note:
             notes.append(backup_note)
 
         # Echo final file tail for quick confirmation
-        tail_preview = []
-        try:
-            with open(devices_path, "r", encoding="utf-8") as f:
-                all_lines = [ln.rstrip("\n") for ln in f.readlines()]
-            tail_preview = all_lines[-5:]
-        except Exception:
-            pass
+        tail_preview = devices.lines()[-5:]
 
         msg = "\n".join(notes) + ("\n\nLast lines:\n" + "\n".join(tail_preview) if tail_preview else "")
         return {"content":[{"type":"text","text":msg}], "isError": False}
 
-    # emux.rebuild — run EMUX rebuild scripts inside EMUX_HOME
+    # emux.rebuild — run EMUX rebuild scripts inside EMUX_HOME (only the steps whose inputs changed)
     elif name == "emux.rebuild":
-        import shlex, subprocess, time
-
         EMUX_HOME   = os.environ.get("EMUX_HOME", "/home/ubuntu-server/emux")
         timeout_sec = int(arguments.get("timeout_sec") or 7200)   # 2h default
         no_sudo     = bool(arguments.get("no_sudo") or False)     # set True to avoid sudo
+        force       = bool(arguments.get("force") or False)       # ignore the manifest, rebuild both
+        wait        = bool(arguments.get("wait") or False)        # block until done (old behaviour)
 
         if not os.path.isdir(EMUX_HOME):
             return {
@@ -914,78 +1465,42 @@ def handle_call(params):
                 "isError": True
             }
 
-        def _run_in(cwd_dir: str, cmd_list: list[str], timeout: int):
-            start = time.time()
-            try:
-                proc = subprocess.run(
-                    cmd_list,
-                    cwd=cwd_dir,
-                    capture_output=True,
-                    text=True,
-                    timeout=timeout
-                )
-                dur = time.time() - start
-                return proc.returncode, (proc.stdout or ""), (proc.stderr or ""), dur
-            except subprocess.TimeoutExpired as e:
-                dur = time.time() - start
-                return 124, (e.stdout or ""), ((e.stderr or "") + "\n[timeout]"), dur
-            except FileNotFoundError as e:
-                dur = time.time() - start
-                return 127, "", f"[error] {e}", dur
-            except Exception as e:
-                dur = time.time() - start
-                return 1, "", f"[error] {e}", dur
-
-        def _sudo_hint(stderr: str) -> str:
-            s = (stderr or "").lower()
-            if "a terminal is required" in s or "no tty present" in s:
-                return "\n[hint] sudo may require a TTY. Configure NOPASSWD or run without sudo (no_sudo=true) if permitted."
-            if "may not run sudo" in s or "password" in s:
-                return "\n[hint] sudo denied or needs a password. Configure NOPASSWD or set no_sudo=true."
-            return ""
-
-        # Build commands
-        vol_cmd  = ["./build-emux-volume"]
-        dock_cmd = ["./build-emux-docker"]
-        if not no_sudo:
-            vol_cmd  = ["sudo", "-n"] + vol_cmd
-            dock_cmd = ["sudo", "-n"] + dock_cmd
-
-        # Step 1: volume
-        rc1, out1, err1, dur1 = _run_in(EMUX_HOME, vol_cmd, timeout_sec)
-        if rc1 != 0:
-            text = []
-            text.append("[emux.rebuild] build-emux-volume failed.")
-            text.append(f"[cmd] {' '.join(shlex.quote(c) for c in vol_cmd)}")
-            if out1: text.append(out1)
-            if err1: text.append(f"[stderr]\n{err1}{_sudo_hint(err1)}")
-            text.append(f"[exit={rc1}] [duration={dur1:.2f}s] [cwd={EMUX_HOME}]")
-            return {"content":[{"type":"text","text":"\n".join(text)}], "isError": True}
-
-        # Step 2: docker
-        rc2, out2, err2, dur2 = _run_in(EMUX_HOME, dock_cmd, timeout_sec)
-
-        # Report
-        lines = []
-        lines.append("[emux.rebuild] Completed EMUX rebuild sequence.")
-
-        lines.append("\n--- build-emux-volume ---")
-        lines.append(f"[cmd] {' '.join(shlex.quote(c) for c in vol_cmd)}")
-        if out1: lines.append(out1)
-        if err1: lines.append(f"[stderr]\n{err1}{_sudo_hint(err1)}")
-        lines.append(f"[exit={rc1}] [duration={dur1:.2f}s] [cwd={EMUX_HOME}]")
-
-        lines.append("\n--- build-emux-docker ---")
-        lines.append(f"[cmd] {' '.join(shlex.quote(c) for c in dock_cmd)}")
-        if out2: lines.append(out2)
-        if err2: lines.append(f"[stderr]\n{err2}{_sudo_hint(err2)}")
-        lines.append(f"[exit={rc2}] [duration={dur2:.2f}s] [cwd={EMUX_HOME}]")
+        try:
+            job = start_rebuild(EMUX_HOME, timeout_sec=timeout_sec, no_sudo=no_sudo, force=force)
+        except Exception as e:
+            return {"content": [{"type": "text", "text": f"[emux.rebuild] {e}. Check it with emux.rebuildstatus."}], "isError": True}
 
-        is_error = (rc2 != 0)
-        if is_error:
-            lines.append("\nOne or more steps failed. Check stderr above.")
+        if not wait:
+            msg = (
+                f"[emux.rebuild] Started in background: {job.summary()}\n"
+                f"Log: {job.log_path}\n"
+                f"Follow progress with emux.rebuildstatus job_id={job.id} (pass offset to read only new output)."
+            )
+            return {"content": [{"type": "text", "text": msg}], "isError": False}
 
-        return {"content":[{"type":"text","text":"\n".join(lines)}], "isError": is_error}
+        job.wait()
+        text, _, _ = job.read_log(0, max_bytes=None)
+        if RESOURCES.inline_max is not None and len(text) > RESOURCES.inline_max:
+            uri = RESOURCES.link(RESOURCES.new_group("rebuild"), "build.log", job.log_path, f"emux rebuild job {job.id}")
+            text = (f"[... {len(text.encode('utf-8'))} bytes of build output; full log: {uri} (resources/read, ranged)]\n"
+                    + text[-(RESOURCES.inline_max // 2):])
+        lines = [f"[emux.rebuild] {job.summary()}", text]
+        if job.status == "failed":
+            lines.append("\nOne or more steps failed. Check output above.")
+        return {"content":[{"type":"text","text":"\n".join(lines)}], "isError": job.status == "failed"}
+
+    # emux.rebuildstatus — progress and streamed output of a background rebuild
+    elif name == "emux.rebuildstatus":
+        job = get_rebuild_job((arguments.get("job_id") or "").strip() or None)
+        if job is None:
+            return {"content": [{"type": "text", "text": "No rebuild job found (start one with emux.rebuild)."}], "isError": True}
+        offset = max(0, int(arguments.get("offset") or 0))
+        max_bytes = max(1, int(arguments.get("max_bytes") or 64_000))
+        chunk, next_offset, total = job.read_log(offset, max_bytes)
+        msg = f"[emux.rebuildstatus] {job.summary()}\n--- log bytes {offset}-{next_offset} of {total} ---\n{chunk}"
+        if job.status in ("queued", "running") or next_offset < total:
+            msg += f"\n[next offset={next_offset}]"
+        return {"content": [{"type": "text", "text": msg}], "isError": job.status == "failed"}
 
     else:
         return {
@@ -1020,76 +1535,135 @@ def handle_call(params):
         "isError": is_error
     }
 
-for line in sys.stdin:
-    line = line.strip()
-    if not line:
-        continue
-    busy = True
+def dispatch_call(params: dict) -> dict:
+    """
+    handle_call, except that fan-out tools go to a worker while any are registered.
+    """
+    if COORDINATOR is not None and (params or {}).get("name") in FANOUT_TOOLS and COORDINATOR.has_workers():
+        try:
+            result = COORDINATOR.submit(params)
+            run_id = (result.get("_meta") or {}).get("run_id")
+            if LLM.enabled and run_id and result.get("isError"):
+                # Workers skip LLM analysis; failures are analysed against the central KB
+                try:
+                    condensed = kb_condense_stored(KB_DB_PATH, run_id)
+                    if condensed:
+                        LLM.submit(run_id, condensed["text"])
+                except Exception:
+                    pass
+            # Workers return full text; oversized items become resources here, where clients can read them
+            return RESOURCES.compact_result(result, params["name"].split(".")[-1])
+        except RuntimeError as e:
+            if "no workers" not in str(e):
+                return {"content": [{"type": "text", "text": f"[coordinator] {e}"}], "isError": True}
+    return handle_call(params)
+
+def main():
+    global COORDINATOR
+    argv = sys.argv[1:]
+    if argv and argv[0] == "--worker":
+        # Worker agent: take jobs from a coordinator instead of reading stdin
+        if len(argv) < 2:
+            sys.exit("usage: firmae_mcp.py --worker unix:/path|tcp://host:port [--capacity N] [--name NAME]")
+        opts = dict(zip(argv[2::2], argv[3::2]))
+        RESOURCES.inline_max = None
+        LLM.enabled = False
+        run_worker(argv[1], handle_call, KB_DB_PATH,
+                   capacity=int(opts.get("--capacity") or os.environ.get("FIRMAE_WORKER_CAPACITY") or 2),
+                   name=opts.get("--name"))
+        return
+    listen = os.environ.get("FIRMAE_COORDINATOR_LISTEN")
+    if listen:
+        COORDINATOR = Coordinator(listen, KB_DB_PATH).start()
     try:
-        msg = json.loads(line)
-        mid = msg.get("id")
-        m = msg.get("method")
-        params = msg.get("params", {})
-
-        if m == "ping":
-            # If host sent a request, echo its id; if it's a notification, use a dummy id.
-            jwrite({"jsonrpc": "2.0", "id": mid if mid is not None else 0, "result": {"ok": True}})
-            continue
+        # CSV-only records get a KB run now; older runs get normalized brand/model in the background
+        start_models_backfill(KB_DB_PATH, os.path.join(FIRMAE_HOME, "emulation_records.csv"))
+    except Exception:
+        pass
 
-        if mid is None and m:
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
             continue
+        busy = True
+        try:
+            msg = json.loads(line)
+            mid = msg.get("id")
+            m = msg.get("method")
+            params = msg.get("params", {})
+
+            if m == "ping":
+                # If host sent a request, echo its id; if it's a notification, use a dummy id.
+                jwrite({"jsonrpc": "2.0", "id": mid if mid is not None else 0, "result": {"ok": True}})
+                continue
 
-        if m == "initialize":
-            agreed = choose_version(params.get("protocolVersion") or "2024-11-05")
-            jwrite({
-                "jsonrpc": "2.0",
-                "id": mid,
-                "result": {
-                    "protocolVersion": agreed,
-                    "serverInfo": {"name": "firmae-adapter", "version": "0.2.0"},
-                    "capabilities": {}
-                }
-            })
-        elif m == "shutdown":
-            jwrite({"jsonrpc": "2.0", "id": mid, "result": None})
-        elif m == "ping":
-            jwrite({"jsonrpc": "2.0", "id": mid, "result": {"ok": True}})
-        elif m == "tools/list":
-            jwrite({"jsonrpc": "2.0", "id": mid, "result": list_tools()})
-        elif m == "resources/list":
-            jwrite({"jsonrpc": "2.0", "id": mid, "result": {"resources": []}})
-        elif m == "prompts/list":
-            jwrite({"jsonrpc": "2.0", "id": mid, "result": {"prompts": []}})
-        elif m == "tools/call":
-            tool_name = (params or {}).get("name", "")
-
-            def run_and_reply(_mid, _params):
+            if mid is None and m:
+                continue
+
+            if m == "initialize":
+                agreed = choose_version(params.get("protocolVersion") or "2024-11-05")
+                jwrite({
+                    "jsonrpc": "2.0",
+                    "id": mid,
+                    "result": {
+                        "protocolVersion": agreed,
+                        "serverInfo": {"name": "firmae-adapter", "version": "0.2.0"},
+                        "capabilities": {"resources": {}}
+                    }
+                })
+            elif m == "shutdown":
+                jwrite({"jsonrpc": "2.0", "id": mid, "result": None})
+            elif m == "ping":
+                jwrite({"jsonrpc": "2.0", "id": mid, "result": {"ok": True}})
+            elif m == "tools/list":
+                jwrite({"jsonrpc": "2.0", "id": mid, "result": list_tools()})
+            elif m == "resources/list":
+                jwrite({"jsonrpc": "2.0", "id": mid, "result": RESOURCES.list(params.get("cursor"))})
+            elif m == "resources/templates/list":
+                jwrite({"jsonrpc": "2.0", "id": mid, "result": RESOURCES.templates()})
+            elif m == "resources/read":
                 try:
-                    result = handle_call(_params)
-                except Exception as e:
-                    result = {"content":[{"type":"text","text":f"Internal error: {e}"}], "isError": True}
-                jwrite({"jsonrpc":"2.0", "id": _mid, "result": result})
+                    result = RESOURCES.read(params.get("uri") or "", params.get("offset"), params.get("length"))
+                except ResourceNotFound:
+                    jwrite({"jsonrpc": "2.0", "id": mid,
+                            "error": {"code": -32002, "message": "Resource not found", "data": {"uri": params.get("uri")}}})
+                else:
+                    jwrite({"jsonrpc": "2.0", "id": mid, "result": result})
+            elif m == "prompts/list":
+                jwrite({"jsonrpc": "2.0", "id": mid, "result": {"prompts": []}})
+            elif m == "tools/call":
+                tool_name = (params or {}).get("name", "")
+
+                def run_and_reply(_mid, _params):
+                    try:
+                        result = dispatch_call(_params)
+                    except Exception as e:
+                        result = {"content":[{"type":"text","text":f"Internal error: {e}"}], "isError": True}
+                    jwrite({"jsonrpc":"2.0", "id": _mid, "result": result})
+
+                LONG = {"firmae.emulate", "firmae.export", "emux.rebuild", "emux.emuxbuild"}  # add others if they can block a while
+                if tool_name in LONG:
+                    threading.Thread(target=run_and_reply, args=(mid, params), daemon=True).start()
+                    # DO NOT write a response here; thread will respond when done
+                else:
+                    jwrite({"jsonrpc":"2.0", "id": mid, "result": handle_call(params)})
 
-            LONG = {"firmae.emulate"}  # add others if they can block a while
-            if tool_name in LONG:
-                threading.Thread(target=run_and_reply, args=(mid, params), daemon=True).start()
-                # DO NOT write a response here; thread will respond when done
             else:
-                jwrite({"jsonrpc":"2.0", "id": mid, "result": handle_call(params)})
+                jwrite({
+                    "jsonrpc": "2.0",
+                    "id": mid,
+                    "error": {"code": -32601, "message": f"Method not found: {m}"}
+                })
 
-        else:
+        except Exception as e:
             jwrite({
                 "jsonrpc": "2.0",
-                "id": mid,
-                "error": {"code": -32601, "message": f"Method not found: {m}"}
+                "id": msg.get("id"),
+                "error": {"code": -32603, "message": str(e)}
             })
 
-    except Exception as e:
-        jwrite({
-            "jsonrpc": "2.0",
-            "id": msg.get("id"),
-            "error": {"code": -32603, "message": str(e)}
-        })
+        finally:
+            busy = False
 
-    finally:
-        busy = False
+if __name__ == "__main__":
+    main()
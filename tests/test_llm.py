@@ -0,0 +1,146 @@
+"""
+LLM stage against a local stub of an OpenAI-style /chat/completions endpoint:
+batching, splitting answers by '### run N' heading, retries and the KB cache.
+
+    python -m unittest discover tests
+"""
+import os, re, sys, json, time, shutil, tempfile, threading, unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from firmae_lib import llm
+from firmae_lib.llm import LLMStage, kb_llm_analyses
+from firmae_lib.sqlite_helper import kb_insert_run
+
+class _Stub(BaseHTTPRequestHandler):
+    """
+    Answers every '### run N' section of a prompt (or the single run) with
+    'cause of run N'. Behaviour is set on the server object: `gate` holds the
+    first request until set, `skip` lists runs left out of batched answers,
+    `fail` is how many requests get a 500 first.
+    """
+
+    def do_POST(self):
+        srv = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = body["messages"][-1]["content"]
+        with srv.lock:
+            srv.prompts.append(prompt)
+            first, fail = len(srv.prompts) == 1, srv.fail > 0
+            srv.fail -= 1 if fail else 0
+        if first:
+            srv.gate.wait(5)
+        if fail:
+            self.send_response(500)
+            self.end_headers()
+            return
+        runs = [int(n) for n in re.findall(r"^### run (\d+)$", prompt, re.M)]
+        if runs:
+            text = "\n\n".join(f"### run {n}\ncause of run {n}" for n in runs if n not in srv.skip)
+        else:
+            text = "cause of run " + re.search(r"run (\d+):", prompt).group(1)
+        data = json.dumps({"choices": [{"message": {"content": text}}]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+# failure texts that stay distinct after masking (digits are masked)
+WORDS = ["mke2fs", "squashfs", "nvram", "httpd", "udhcpc"]
+
+class LLMStageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db = os.path.join(self.tmp, "kb.sqlite")
+        self.srv = ThreadingHTTPServer(("127.0.0.1", 0), _Stub)
+        self.srv.lock, self.srv.prompts, self.srv.gate = threading.Lock(), [], threading.Event()
+        self.srv.skip, self.srv.fail = set(), 0
+        threading.Thread(target=self.srv.serve_forever, daemon=True).start()
+        self.stage = LLMStage(self.db, url=f"http://127.0.0.1:{self.srv.server_port}/v1", model="stub")
+        self.stage.batch = 4
+        self._backoff, llm.ERROR_BACKOFF = llm.ERROR_BACKOFF, 0.05
+
+    def tearDown(self):
+        llm.ERROR_BACKOFF = self._backoff
+        self.srv.gate.set()
+        self.srv.shutdown()
+        self.srv.server_close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _run(self) -> int:
+        return kb_insert_run(self.db, brand="dlink", model=None, firmware="fw.bin", iid_dir=None,
+                             exit_code=1, result_bool=False, duration_sec=1.0)
+
+    def _wait_stored(self, n: int) -> None:
+        deadline = time.time() + 10
+        while time.time() < deadline and self.stage.status()["stats"]["stored"] < n:
+            time.sleep(0.02)
+        self.assertEqual(self.stage.status()["stats"]["stored"], n)
+
+    def test_batches_and_splits_by_run_heading(self):
+        runs = [self._run() for _ in range(4)]
+        for r, word in zip(runs, WORDS):
+            self.assertEqual(self.stage.submit(r, f"Reasons: {word}\n{word} failed"), "queued")
+        self.srv.gate.set()   # runs queued while the first request was held go out together
+        self._wait_stored(4)
+        sizes = [len(re.findall(r"^### run \d+$", p, re.M)) or 1 for p in self.srv.prompts]
+        self.assertEqual(sum(sizes), 4)
+        self.assertGreater(max(sizes), 1)
+        for r in runs:
+            (a,) = kb_llm_analyses(self.db, r)
+            self.assertEqual(a["content"], f"cause of run {r}")
+        self.assertEqual(sorted(kb_llm_analyses(self.db, r)[0]["batch"] for r in runs),
+                         sorted(n for n in sizes for _ in range(n)))
+
+    def test_run_missing_from_batch_answer_is_asked_alone(self):
+        runs = [self._run() for _ in range(3)]
+        self.srv.skip = {runs[2]}
+        for r, word in zip(runs, WORDS):
+            self.stage.submit(r, f"Reasons: {word}")
+        self.srv.gate.set()
+        self._wait_stored(3)
+        self.assertIn(f"run {runs[2]}:", self.srv.prompts[-1])
+        self.assertEqual(kb_llm_analyses(self.db, runs[2])[0]["content"], f"cause of run {runs[2]}")
+
+    def test_batch_stops_before_the_token_cap(self):
+        self._cap, llm.BATCH_TOKENS = llm.BATCH_TOKENS, 50
+        try:
+            runs = [self._run() for _ in range(4)]
+            for r, word in zip(runs, WORDS):
+                self.stage.submit(r, f"Reasons: {word} " + "x" * 80)   # ~25 tokens each
+            self.srv.gate.set()
+            self._wait_stored(4)
+        finally:
+            llm.BATCH_TOKENS = self._cap
+        sizes = [len(re.findall(r"^### run \d+$", p, re.M)) or 1 for p in self.srv.prompts]
+        self.assertEqual(sum(sizes), 4)
+        self.assertLessEqual(max(sizes), 2)
+
+    def test_failed_request_is_retried(self):
+        self.srv.fail = 1
+        self.srv.gate.set()
+        r = self._run()
+        self.stage.submit(r, "Reasons: mke2fs")
+        self._wait_stored(1)
+        self.assertEqual(self.stage.status()["stats"]["errors"], 1)
+        self.assertEqual(self.stage.status()["pending"], 0)
+
+    def test_same_masked_text_hits_the_cache(self):
+        self.srv.gate.set()
+        first, second = self._run(), self._run()
+        self.stage.submit(first, "[ 1.000000] Kernel panic at 0x80001234")
+        self._wait_stored(1)
+        self.assertEqual(self.stage.submit(second, "[ 2.500000] Kernel panic at 0x80005678"), "cached")
+        self.assertEqual(len(self.srv.prompts), 1)
+        (a,) = kb_llm_analyses(self.db, second)
+        self.assertTrue(a["cached"])
+        self.assertEqual(a["content"], f"cause of run {first}")
+
+if __name__ == "__main__":
+    unittest.main()
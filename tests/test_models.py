@@ -0,0 +1,35 @@
+"""
+Model inference from firmware file names: known models from the catalog
+trie first, vendor-style ids otherwise.
+
+    python -m unittest discover tests
+"""
+import os, sys, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from firmae_lib.models import ModelIndex, guess_model
+
+class GuessModelTest(unittest.TestCase):
+
+    def test_netgear_r_series_is_a_model_not_a_revision(self):
+        self.assertEqual(guess_model("NETGEAR", "R9000-V1.0.5.42.zip"), "R9000")
+        self.assertEqual(guess_model("NETGEAR", "R6300v2-V1.0.4.52.chk"), "R6300")
+
+    def test_short_version_markers_are_skipped(self):
+        self.assertEqual(guess_model(None, "fw_V10.0.1_DIR-600.bin"), "DIR-600")
+        self.assertEqual(guess_model(None, "REV12_WNR2000.bin"), "WNR2000")
+        self.assertIsNone(guess_model(None, "firmware_R12.bin"))
+
+    def test_longest_known_model_wins(self):
+        self.assertEqual(guess_model("TPLINK", "Archer_C5400X_US_v1.0.zip"), "Archer C5400X")
+        self.assertEqual(guess_model("TPLINK", "Archer C54(US)_V1_200917.zip"), "Archer C54")
+
+    def test_revision_suffix_after_known_model(self):
+        index = ModelIndex()
+        index.add("TPLINK", "TL-WR841N")
+        self.assertEqual(index.find("TL-WR841NV14_EU.bin", "TPLINK"), "TL-WR841N")
+        self.assertEqual(guess_model("TPLINK", "TL-WR841NV14_EU.bin"), "TL-WR841N")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+"""
+Ranged resources/read: chunks that follow next_offset never split a UTF-8
+character, whatever the requested length.
+
+    python -m unittest discover tests
+"""
+import os, sys, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from firmae_lib.resources import ResourceStore
+
+TEXT = "héllo wörld ✓ 𝄞 end\n" * 20   # 1- to 4-byte characters
+
+class RangedReadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = ResourceStore(os.path.join(self.tmp, "res"), os.path.join(self.tmp, "kb.sqlite"))
+        self.uri = self.store.put("g", "out.txt", TEXT)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _read_all(self, length: int) -> str:
+        offset, chunks = 0, []
+        while True:
+            res = self.store.read(self.uri, offset, length)
+            chunks.append(res["contents"][0]["text"])
+            meta = res["_meta"]
+            if "next_offset" not in meta:
+                return "".join(chunks)
+            self.assertGreater(meta["next_offset"], offset)
+            offset = meta["next_offset"]
+
+    def test_chunks_end_on_character_boundaries(self):
+        for length in (1, 2, 3, 5, 7, 100):
+            with self.subTest(length=length):
+                self.assertEqual(self._read_all(length), TEXT)
+
+    def test_offsets_and_total_stay_in_bytes(self):
+        meta = self.store.read(self.uri, 0, 2)["_meta"]
+        self.assertEqual(meta["total"], len(TEXT.encode("utf-8")))
+        self.assertEqual((meta["length"], meta["next_offset"]), (1, 1))   # "h", then "é" starts
+
+if __name__ == "__main__":
+    unittest.main()